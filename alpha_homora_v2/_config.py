@@ -1,2 +1,108 @@
+from os import getenv
+
+# Every endpoint below can be overridden with an environment variable of the same name, e.g. to use a private RPC
+# node or the local stand-in servers of the offline benchmarks (see benchmarks/)
+
 # Default RPC URLS:
-AVAX_RPC_URL = "https://api.avax.network/ext/bc/C/rpc"
\ No newline at end of file
+AVAX_RPC_URL = getenv("AVAX_RPC_URL", "https://api.avax.network/ext/bc/C/rpc")
+
+# Comma-separated RPC URLs load-balanced with failover by a provider_pool.ProviderPool (defaults to AVAX_RPC_URL alone):
+AVAX_RPC_URLS = [url.strip() for url in getenv("AVAX_RPC_URLS", AVAX_RPC_URL).split(",") if url.strip() != ""]
+
+# Alpha Homora V2 API endpoints (Avalanche):
+HOMORA_POSITIONS_URL = getenv("HOMORA_POSITIONS_URL", "https://api.homora.alphaventuredao.io/v2/43114/positions")
+HOMORA_POOLS_URL = getenv("HOMORA_POOLS_URL", "https://homora-api.alphafinance.io/v2/43114/pools")
+HOMORA_APYS_URL = getenv("HOMORA_APYS_URL", "https://api.homora.alphaventuredao.io/v2/{chain_id}/apys")
+HOMORA_TOKENS_URL = getenv("HOMORA_TOKENS_URL", "https://api.homora.alphaventuredao.io/v2/43114/tokens")
+
+# CoinGecko API (the simple price endpoint is used by the asyncio API, see aio.py):
+COINGECKO_API_URL = getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3/")
+COINGECKO_PRICE_URL = COINGECKO_API_URL + "simple/price"
+
+# CREAM borrow rates (Avalanche):
+CREAM_RATES_URL = getenv("CREAM_RATES_URL", "https://api.cream.finance/api/v1/rates?comptroller=avalanche")
+
+# RPC provider pool (see provider_pool.ProviderPool): consecutive failures that open an endpoint's circuit breaker,
+# seconds before an open breaker lets a trial request through, weight of the latest response in an endpoint's moving
+# average latency, seconds before an unanswered read is hedged on a second endpoint (None disables hedging), seconds
+# between background health checks (None disables them), blocks an endpoint may lag behind the highest head, and
+# seconds before a request to an endpoint times out:
+PROVIDER_FAILURE_THRESHOLD = 3
+PROVIDER_COOLDOWN = 30
+PROVIDER_LATENCY_WEIGHT = 0.2
+PROVIDER_HEDGE_DELAY = None
+PROVIDER_HEALTH_CHECK_INTERVAL = None
+PROVIDER_MAX_BLOCK_LAG = 5
+PROVIDER_REQUEST_TIMEOUT = 10
+
+# JSON-RPC batches (see rpc_batch.py): maximum number of requests per batch, and seconds a rpc_batch.BatchingProvider
+# waits for concurrent requests to join a batch before sending it:
+RPC_BATCH_SIZE = 100
+RPC_BATCH_FLUSH_INTERVAL = 0.005
+
+# Maximum number of contract reads aggregated into a single Multicall3 eth_call:
+MULTICALL_BATCH_SIZE = 250
+
+# Maximum number of read results kept by a multicall.CallCache:
+CALL_CACHE_SIZE = 100000
+
+# Maximum number of contract instances kept in the process-wide cache (see util.ContractInstanceFunc):
+CONTRACT_CACHE_SIZE = 1024
+
+# Seconds a CoinGecko USD price is reused before it is fetched again (see oracles.PriceService):
+PRICE_CACHE_TTL = 30
+
+# Stablecoin (symbol in resources/token_metadata.csv) whose oracle price converts AVAX to USD at past blocks, where
+# CoinGecko prices are not available (see oracles.prepare_oracle_prices()):
+ORACLE_USD_REFERENCE = "USDC.e"
+
+# Report pipeline (see report.py): worker threads, and positions snapshotted per worker task:
+REPORT_MAX_WORKERS = 8
+REPORT_CHUNK_SIZE = 10
+
+# Backtests (see backtest.py): blocks evaluated concurrently:
+BACKTEST_MAX_WORKERS = 8
+
+# Seconds between checks for a new block (see watcher.DebtRatioWatcher):
+WATCHER_POLL_INTERVAL = 1.0
+
+# Seconds a pool's reward accumulator and emission parameters are projected before resyncing (see rewards.RewardEngine):
+REWARD_RESYNC_INTERVAL = 300
+
+# HomoraBank event indexer (see indexer.PositionIndexer): a block before the HomoraBank deployment on Avalanche,
+# and the maximum block range of a single eth_getLogs request:
+HOMORA_BANK_START_BLOCK = 3000000
+INDEXER_CHUNK_SIZE = 2048
+
+# Seconds before the pools list is refreshed in the background, and the minimum seconds between two refreshes
+# forced by a pool missing from the list (see registry.PoolRegistry):
+POOL_REFRESH_INTERVAL = 600
+POOL_MISS_REFRESH_INTERVAL = 30
+
+# Seconds a spell client's get_pool_info() result is reused for the latest block (about one Avalanche block), and
+# the maximum number of memoized results per client:
+POOL_INFO_CACHE_TTL = 2
+POOL_INFO_CACHE_SIZE = 256
+
+# Transaction manager (see transactions.TransactionManager): seconds to wait for a receipt, seconds between receipt
+# polls, seconds before an unmined transaction is replaced with higher fees, the fee multiplier of a replacement
+# (nodes require at least a 10% bump) and the maximum number of replacements per transaction:
+TRANSACTION_RECEIPT_TIMEOUT = 120
+TRANSACTION_POLL_INTERVAL = 0.5
+TRANSACTION_STUCK_TIMEOUT = 30
+TRANSACTION_FEE_BUMP = 1.125
+TRANSACTION_MAX_REPLACEMENTS = 3
+
+# Receipt polling (see receipt.ReceiptService): the maximum seconds between polls after backing off, and the maximum
+# number of hashes per JSON-RPC batch:
+RECEIPT_MAX_POLL_INTERVAL = 4.0
+RECEIPT_BATCH_SIZE = 100
+
+# Gas limit of a HomoraBank execute() whose gas cannot be estimated yet (e.g. it spends approvals still pending):
+EXECUTE_GAS_LIMIT = 2500000
+
+# Multiplier applied to a cached HomoraBank execute() gas estimate (see simulation.GasCache):
+GAS_ESTIMATE_MARGIN = 1.2
+
+# Upper bounds (seconds) of the request latency histogram buckets (see metrics.MetricsCollector):
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
@@ -0,0 +1,304 @@
+"""
+Asyncio counterparts of the position, token, oracle and spell client APIs.
+
+Reads are executed over web3's AsyncHTTPProvider (aggregated through Multicall3) and HTTP requests use aiohttp,
+so many positions can be read concurrently from one event loop:
+
+    book = await load_position_book()
+    positions = await get_avax_positions_by_owner(owner_address, position_book=book)
+    values = await asyncio.gather(*[position.get_position_value() for position in positions])
+"""
+from typing import Iterable, Union
+import asyncio
+import time
+
+from .position import AvalanchePosition
+from .portfolio import PositionBook
+from .token import ARC20Token
+from .oracles import AvalancheSafeOracle
+from .spell import SpellClient
+from .multicall import AsyncMulticall, Call
+from .registry import get_token_registry
+from ._config import (AVAX_RPC_URL, PRICE_CACHE_TTL, COINGECKO_PRICE_URL, HOMORA_POSITIONS_URL, HOMORA_POOLS_URL,
+                      HOMORA_APYS_URL, CREAM_RATES_URL)
+
+import aiohttp
+from web3 import Web3
+from web3.eth import AsyncEth
+from web3.contract import ContractFunction
+from web3.providers.async_rpc import AsyncHTTPProvider
+
+
+def get_async_web3_provider(network_rpc_url: str = AVAX_RPC_URL) -> Web3:
+    """Returns an asynchronous Web3 connection provider object"""
+    return Web3(AsyncHTTPProvider(network_rpc_url), modules={"eth": (AsyncEth,)}, middlewares=[])
+
+
+async_avalanche_provider = get_async_web3_provider()
+
+
+async def get_json(url: str, session: aiohttp.ClientSession = None, **params) -> Union[dict, list]:
+    """GET a JSON endpoint, using the given aiohttp session or a temporary one"""
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await get_json(url, session, **params)
+
+    async with session.get(url, params=params or None) as r:
+        if r.status != 200:
+            raise Exception(f"Could not fetch {url}: {r.status, await r.text()}")
+        return await r.json(content_type=None)
+
+
+async def call(function_call: ContractFunction, async_web3_provider: Web3 = None,
+               block_identifier: Union[str, int] = "latest"):
+    """Await a single contract read, decoded the same way as ContractFunction.call()"""
+    async_web3_provider = async_avalanche_provider if async_web3_provider is None else async_web3_provider
+    pending = Call(function_call)
+    return_data = await async_web3_provider.eth.call(
+        {"to": function_call.address, "data": function_call._encode_transaction_data()}, block_identifier)
+    pending._decode(True, bytes(return_data))
+    return pending.result
+
+
+class AsyncPriceService:
+    """
+    Asyncio counterpart of oracles.PriceService: TTL-cached CoinGecko USD prices, with every uncached id of a
+    request fetched in one call and concurrent requests for the same id sharing a single in-flight fetch.
+    """
+    def __init__(self, ttl: float = PRICE_CACHE_TTL, session: aiohttp.ClientSession = None):
+        """
+        :param ttl: Seconds a fetched price is served from the cache (0 disables caching)
+        :param session: (optional) The aiohttp session used for requests (a temporary one is used if not given)
+        """
+        self.ttl = ttl
+        self.session = session
+        self._prices: dict[str, tuple[float, float]] = {}  # coingecko_id -> (price_usd, fetched_at)
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    async def get_price(self, token_symbol: str) -> float:
+        return (await self.get_prices([token_symbol]))[token_symbol]
+
+    async def get_prices(self, token_symbols: Iterable[str]) -> dict[str, float]:
+        """
+        :param token_symbols: Token symbols as in resources/token_metadata.csv
+        :return: dict of {symbol: price_usd}
+        """
+        registry = get_token_registry()
+        symbol_ids = {symbol: registry.coingecko_id(symbol) for symbol in token_symbols}
+        ids = set(symbol_ids.values())
+
+        now = time.monotonic()
+        to_fetch, to_wait = [], []
+        for token_id in ids:
+            cached = self._prices.get(token_id)
+            if cached is not None and now - cached[1] < self.ttl:
+                continue
+            if token_id in self._in_flight:
+                to_wait.append(self._in_flight[token_id])
+            else:
+                self._in_flight[token_id] = asyncio.get_running_loop().create_future()
+                to_fetch.append(token_id)
+
+        if len(to_fetch) > 0:
+            await self._fetch(to_fetch)
+        if len(to_wait) > 0:
+            await asyncio.gather(*to_wait)
+
+        missing = [token_id for token_id in ids if token_id not in self._prices]
+        if len(missing) > 0:
+            raise KeyError(f"CoinGecko did not return a USD price for: {', '.join(missing)}")
+
+        return {symbol: self._prices[token_id][0] for symbol, token_id in symbol_ids.items()}
+
+    async def _fetch(self, token_ids: list[str]) -> None:
+        try:
+            r = await get_json(COINGECKO_PRICE_URL, self.session, ids=','.join(token_ids), vs_currencies='usd')
+            fetched_at = time.monotonic()
+            for token_id in token_ids:
+                if 'usd' in r.get(token_id, {}):
+                    self._prices[token_id] = r[token_id]['usd'], fetched_at
+        finally:
+            for token_id in token_ids:
+                self._in_flight.pop(token_id).set_result(None)
+
+
+async_price_service = AsyncPriceService()
+
+
+class AsyncARC20Token:
+    """Asyncio counterpart of token.ARC20Token"""
+    def __init__(self, address: str, async_web3_provider: Web3 = None):
+        self.token = ARC20Token(address)
+        self.address = self.token.address
+        self.async_web3_provider = async_web3_provider
+
+    async def name(self) -> str:
+        return await call(self.token.contract.functions.name(), self.async_web3_provider)
+
+    async def symbol(self) -> str:
+        return await call(self.token.contract.functions.symbol(), self.async_web3_provider)
+
+    async def decimals(self) -> int:
+        return await call(self.token.contract.functions.decimals(), self.async_web3_provider)
+
+    async def balanceOf(self, owner_address: str) -> int:
+        return await call(self.token.contract.functions.balanceOf(Web3.toChecksumAddress(owner_address)),
+                          self.async_web3_provider)
+
+
+class AsyncAvalancheSafeOracle:
+    """Asyncio counterpart of oracles.AvalancheSafeOracle"""
+    def __init__(self, async_web3_provider: Web3 = None, price_service: AsyncPriceService = None):
+        self.oracle = AvalancheSafeOracle()
+        self.async_web3_provider = async_avalanche_provider if async_web3_provider is None else async_web3_provider
+        self.price_service = async_price_service if price_service is None else price_service
+
+    async def get_token_price(self, token_address: str, token_decimals: int) -> tuple[float, float]:
+        """
+        :return: tuple
+            - price in AVAX
+            - price in USD
+        """
+        batch = AsyncMulticall(self.async_web3_provider)
+        token_price = self.oracle.prepare_token_price(batch, token_address)
+        _, wavax_price_usd = await asyncio.gather(batch.execute(), self.price_service.get_price("WAVAX"))
+        return token_price(token_decimals, wavax_price_usd)
+
+
+class AsyncSpellClient:
+    """Asyncio counterpart of the read methods of a spell.SpellClient"""
+    def __init__(self, spell_client: SpellClient, async_web3_provider: Web3 = None):
+        self.spell_client = spell_client
+        self.async_web3_provider = async_avalanche_provider if async_web3_provider is None else async_web3_provider
+
+    async def get_pool_info(self, coll_id) -> dict:
+        async with AsyncMulticall(self.async_web3_provider) as batch:
+            pool_info = self.spell_client.prepare_pool_info(batch, coll_id)
+        return pool_info()
+
+
+class AsyncAvalanchePosition:
+    """
+    Asyncio counterpart of the informational methods of position.AvalanchePosition.
+
+    The transactional methods and contract instances are available through the wrapped position attribute.
+    """
+    def __init__(self, position_id: int, owner_wallet_address: str, pool: dict, owner_private_key: str = None,
+                 async_web3_provider: Web3 = None, price_service: AsyncPriceService = None,
+                 session: aiohttp.ClientSession = None):
+        """
+        :param position_id: The Alpha Homora V2 position ID
+        :param owner_wallet_address: The wallet address of the position owner
+        :param pool: The pool metadata for the position (see AsyncAvalanchePosition.create() to resolve it)
+        :param owner_private_key: (optional) The private key of the position owner's wallet
+        :param async_web3_provider: (optional) Asynchronous Web3 object (see get_async_web3_provider())
+        :param price_service: (optional) The AsyncPriceService used for USD prices
+        :param session: (optional) The aiohttp session used for API requests
+        """
+        self.position = AvalanchePosition(position_id, owner_wallet_address, owner_private_key, pool=pool)
+        self.pos_id = self.position.pos_id
+        self.owner = self.position.owner
+        self.pool = self.position.pool
+        self.pool_key = self.position.pool_key
+        self.symbol = self.position.symbol
+        self.dex = self.position.dex
+
+        self.async_web3_provider = async_avalanche_provider if async_web3_provider is None else async_web3_provider
+        self.price_service = async_price_service if price_service is None else price_service
+        self.session = session
+
+    @classmethod
+    async def create(cls, position_id: int, owner_wallet_address: str, **kwargs) -> "AsyncAvalanchePosition":
+        """Resolve the position's pool from the Alpha Homora V2 API and create the position"""
+        position_book = await load_position_book(kwargs.get("session"))
+        return cls(position_id, owner_wallet_address,
+                   pool=position_book.get_position_pool(position_id, owner_wallet_address), **kwargs)
+
+    def batch(self, block_identifier: Union[str, int] = "latest") -> AsyncMulticall:
+        """Returns an AsyncMulticall batch to aggregate contract reads into a single eth_call"""
+        return AsyncMulticall(self.async_web3_provider, block_identifier)
+
+    async def get_position_value(self) -> dict:
+        """See AvalanchePosition.get_position_value()"""
+        batch = self.batch()
+        position_value = self.position.prepare_position_value(batch)
+        _, prices = await asyncio.gather(batch.execute(), self.price_service.get_prices(self.position.price_symbols))
+        return position_value(prices)
+
+    async def get_rewards_value(self) -> dict:
+        """See AvalanchePosition.get_rewards_value()"""
+        position_info = await call(self.position._homora_bank.functions.getPositionInfo(self.pos_id),
+                                   self.async_web3_provider)
+        batch = self.batch()
+        rewards_value = self.position.prepare_rewards_value(batch, position_info)
+        _, reward_price_usd = await asyncio.gather(
+            batch.execute(), self.price_service.get_price(self.position.reward_token_symbol))
+        return rewards_value(reward_price_usd)
+
+    async def get_debt_ratio(self) -> float:
+        """See AvalanchePosition.get_debt_ratio()"""
+        async with self.batch() as batch:
+            debt_ratio = self.position.prepare_debt_ratio(batch)
+        return debt_ratio()
+
+    async def get_leverage_ratio(self) -> float:
+        """See AvalanchePosition.get_leverage_ratio()"""
+        return AvalanchePosition.leverage_from_value(await self.get_position_value())
+
+    async def get_token_debts(self, address: str = None) -> list[tuple[ARC20Token, int, float, float]]:
+        """See AvalanchePosition.get_token_debts()"""
+        position_debts = await call(self.position._homora_bank.functions.getPositionDebts(self.pos_id),
+                                    self.async_web3_provider)
+        if len(position_debts) == 0:
+            return position_debts
+
+        batch = self.batch()
+        token_debts = self.position.prepare_token_debts(batch, position_debts, address)
+        _, wavax_price_usd = await asyncio.gather(batch.execute(), self.price_service.get_price("WAVAX"))
+        return token_debts(wavax_price_usd)
+
+    async def get_current_apy(self) -> dict:
+        """See AvalanchePosition.get_current_apy()"""
+        try:
+            apys, cream_borrow_rates, position_value, token_debts_data = await asyncio.gather(
+                get_json(HOMORA_APYS_URL.format(chain_id=self.position._platform.network_chain_id), self.session),
+                get_json(CREAM_RATES_URL, self.session),
+                self.get_position_value(),
+                self.get_token_debts())
+
+            async with self.batch() as batch:
+                fee_bps = batch.add(self.position._homora_bank.functions.feeBps())
+                symbols = [batch.add(arc20_token.contract.functions.symbol()) for arc20_token, *_ in token_debts_data]
+
+            return AvalanchePosition.apy_from_state(
+                apys[self.pool_key], AvalanchePosition.leverage_from_value(position_value),
+                cream_borrow_rates['borrowRates'], fee_bps.result,
+                [(symbol.result, debt[-1]) for symbol, debt in zip(symbols, token_debts_data)])
+        except Exception as exc:
+            raise Exception(f"Could not get current APY for position: {exc}")
+
+
+async def load_position_book(session: aiohttp.ClientSession = None) -> PositionBook:
+    """Fetch the Alpha Homora V2 positions and pools lists concurrently into a PositionBook"""
+    positions, pools = await asyncio.gather(get_json(HOMORA_POSITIONS_URL, session),
+                                            get_json(HOMORA_POOLS_URL, session))
+    return PositionBook(positions=positions, pools=pools)
+
+
+async def get_avax_positions_by_owner(owner_address: str, owner_private_key: str = None,
+                                      position_book: PositionBook = None,
+                                      **kwargs) -> list[AsyncAvalanchePosition]:
+    """
+    Asyncio counterpart of position.get_avax_positions_by_owner()
+
+    :param owner_address: The owner of the position (address str)
+    :param owner_private_key: (optional) The owner's private key
+    :param position_book: (optional) A loaded PositionBook to reuse across owners (fetched if not provided)
+    :param kwargs: Passed to every AsyncAvalanchePosition (async_web3_provider, price_service, session)
+    """
+    if position_book is None:
+        position_book = await load_position_book(kwargs.get("session"))
+
+    return [AsyncAvalanchePosition(position['id'], owner_address, position_book.get_pool(position['pool']['key']),
+                                   owner_private_key, **kwargs)
+            for position in position_book.get_positions_by_owner(owner_address)]
@@ -0,0 +1,111 @@
+from threading import Lock
+from typing import Union
+
+from .token import ARC20Token
+from .provider import avalanche_provider
+from .multicall import Multicall
+
+from web3 import Web3
+
+# Allowance of approve() calls sent without an amount (see ARC20Token.prepare_approve())
+MAX_ALLOWANCE = 2 ** 256 - 1
+
+
+class ApprovalPlanner:
+    """
+    Decides which token approvals a transaction needs, from the owner's allowances and balances.
+
+    plan() reads the balance and the allowance of every supplied token in a single Multicall, so an allowance revoked
+    outside of the package (e.g. an approve(0)) is always noticed. Allowances set by approvals mined in this session
+    (record_approval()) and reduced by the spender (record_spend()) are cached per (owner, token, spender) with the
+    block they were mined at, and are only used instead of the read while the node lags behind that block, so that
+    an approval just mined is not sent again.
+    """
+    def __init__(self, web3_provider: Web3 = None):
+        """
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        """
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self._allowances: dict[tuple[str, str, str], tuple[int, int]] = {}  # (allowance, block number)
+        self._lock = Lock()
+
+    def plan(self, owner: str, spender: str, amounts: list[tuple[ARC20Token, int]],
+             web3_provider: Web3 = None) -> list[ARC20Token]:
+        """
+        Check that the owner holds the supplied amounts and return the tokens that must be approved first
+
+        :param owner: The wallet address supplying the tokens
+        :param spender: The contract pulling the tokens (e.g. the HomoraBank)
+        :param amounts: (ARC20Token, amount in wei) pairs, zero amounts are ignored
+        :param web3_provider: (optional) The Web3 object to read with (defaults to the planner's provider)
+        :return: The tokens whose allowance is lower than the amount, in the order of amounts
+        """
+        amounts = [(token, amount) for token, amount in amounts if amount > 0]
+        if len(amounts) == 0:
+            return []
+
+        owner, spender = Web3.toChecksumAddress(owner), Web3.toChecksumAddress(spender)
+        with Multicall(self.web3_provider if web3_provider is None else web3_provider) as batch:
+            block_number = batch.add(batch.contract.functions.getBlockNumber())
+            reads = [(token, amount, self._key(owner, token.address, spender),
+                      batch.add(token.contract.functions.balanceOf(owner)),
+                      batch.add(token.contract.functions.allowance(owner, spender))) for token, amount in amounts]
+
+        to_approve = []
+        with self._lock:
+            for token, amount, key, balance, allowance in reads:
+                # Ensure that the user holds the required amount of tokens, or a SafeERC20 low-level call will fail
+                assert balance.result >= amount, \
+                    f"Insufficient funds to supply {amount / (10 ** token.decimals())} {token.symbol()}"
+                cached = self._allowances.get(key)
+                if cached is None or cached[1] <= block_number.result:
+                    cached = self._allowances[key] = allowance.result, block_number.result
+                if cached[0] < amount:
+                    to_approve.append(token)
+        return to_approve
+
+    def get_allowance(self, owner: str, token_address: str, spender: str) -> Union[int, None]:
+        """Returns the cached allowance (None if it has not been read or recorded)"""
+        cached = self._allowances.get(self._key(owner, token_address, spender))
+        return None if cached is None else cached[0]
+
+    def record_approval(self, owner: str, token_address: str, spender: str, block_number: int,
+                        amount: int = MAX_ALLOWANCE) -> None:
+        """
+        Cache the allowance set by a mined approve() transaction
+
+        :param block_number: The block the approval was mined at
+        """
+        with self._lock:
+            self._allowances[self._key(owner, token_address, spender)] = amount, block_number
+
+    def record_spend(self, owner: str, token_address: str, spender: str, amount: int, block_number: int) -> None:
+        """
+        Deduct the amount pulled by the spender from the cached allowance (unlimited allowances are not reduced)
+
+        :param block_number: The block the transaction spending the allowance was mined at
+        """
+        key = self._key(owner, token_address, spender)
+        with self._lock:
+            if key in self._allowances and self._allowances[key][0] != MAX_ALLOWANCE:
+                self._allowances[key] = max(self._allowances[key][0] - amount, 0), block_number
+
+    def invalidate(self, owner: str = None) -> None:
+        """
+        Drop cached allowances, so that only the allowances read by the next plan() are used
+
+        :param owner: (optional) Only drop this owner's allowances
+        """
+        with self._lock:
+            if owner is None:
+                self._allowances.clear()
+                return
+            for key in [key for key in self._allowances if key[0] == owner.lower()]:
+                del self._allowances[key]
+
+    @staticmethod
+    def _key(owner: str, token_address: str, spender: str) -> tuple[str, str, str]:
+        return owner.lower(), token_address.lower(), spender.lower()
+
+
+approval_planner = ApprovalPlanner()
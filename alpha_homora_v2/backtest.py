@@ -0,0 +1,166 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+import time
+
+from .provider import avalanche_provider
+from .multicall import Multicall, CallCache
+from .oracles import prepare_oracle_prices
+from .snapshot import PositionSnapshot, take_snapshots
+from .report import get_report_writer
+from ._config import BACKTEST_MAX_WORKERS
+
+from web3 import Web3
+
+# Backtest columns, in output order
+BACKTEST_COLUMNS = ['block_number', 'timestamp', 'position_id', 'dex', 'symbol', 'position_value_usd',
+                    'equity_value_usd', 'debt_value_usd', 'position_value_avax', 'equity_value_avax',
+                    'debt_value_avax', 'debt_ratio', 'leverage', 'pending_rewards_token', 'pending_rewards_usd',
+                    'reward_token_symbol', 'error']
+
+
+def backtest_blocks(start_block: int, end_block: int = None, stride: int = 1, web3_provider: Web3 = None) -> list[int]:
+    """
+    :param start_block: The first block
+    :param end_block: (optional) The last block, included if the stride lands on it (defaults to the latest block)
+    :param stride: Number of blocks between evaluated blocks
+    :param web3_provider: (optional) The Web3 object the latest block is read with (defaults to the Avalanche provider)
+    """
+    if end_block is None:
+        end_block = (avalanche_provider if web3_provider is None else web3_provider).eth.block_number
+    assert stride > 0, "The stride must be a positive number of blocks"
+    return list(range(start_block, end_block + 1, stride))
+
+
+def snapshot_to_backtest_row(snapshot: PositionSnapshot) -> dict:
+    """Flatten a PositionSnapshot into a backtest row (BACKTEST_COLUMNS)"""
+    value = snapshot.position_value
+    return {'block_number': snapshot.block_number, 'timestamp': snapshot.timestamp,
+            'position_id': snapshot.pos_id, 'dex': snapshot.dex, 'symbol': snapshot.symbol,
+            'position_value_usd': value['position_usd'], 'equity_value_usd': value['equity_usd'],
+            'debt_value_usd': value['debt_usd'], 'position_value_avax': value['position_avax'],
+            'equity_value_avax': value['equity_avax'], 'debt_value_avax': value['debt_avax'],
+            'debt_ratio': snapshot.debt_ratio, 'leverage': snapshot.leverage_ratio,
+            'pending_rewards_token': snapshot.rewards_value['reward_token'],
+            'pending_rewards_usd': snapshot.rewards_value['reward_usd'],
+            'reward_token_symbol': snapshot.rewards_value['reward_token_symbol'], 'error': None}
+
+
+def _error_row(position, block_number: int, exc: Exception) -> dict:
+    row = dict.fromkeys(BACKTEST_COLUMNS)
+    row.update({'block_number': block_number, 'position_id': position.pos_id, 'dex': position.dex,
+                'symbol': position.symbol, 'error': str(exc)})
+    return row
+
+
+def evaluate_block(positions: list, block_number: int, call_cache: CallCache = None) -> list[dict]:
+    """
+    Evaluate every position at one block: the oracle prices are read in one Multicall round trip, and the positions'
+    state in two (see snapshot.take_snapshots()).
+
+    USD values use the oracle prices at the block; tokens the oracles do not price (e.g. some reward tokens) are
+    valued at NaN.
+
+    :return: One backtest row per position (failed positions yield a row with the error column set)
+    """
+    symbols = {"WAVAX"}
+    for position in positions:
+        symbols.update(position.price_symbols)
+        symbols.add(position.reward_token_symbol)
+
+    try:
+        with Multicall(positions[0].web3_provider, block_number, call_cache=call_cache) as batch:
+            oracle_prices = prepare_oracle_prices(batch, symbols)
+        prices = oracle_prices()
+    except Exception as exc:
+        return [_error_row(position, block_number, exc) for position in positions]
+
+    try:
+        snapshots = take_snapshots(positions, block_number, apy=False, prices=prices, call_cache=call_cache)
+        return [snapshot_to_backtest_row(snapshot) for snapshot in snapshots]
+    except Exception:
+        # Isolate the failing position(s) (e.g. positions not opened yet at the block)
+        rows = []
+        for position in positions:
+            try:
+                snapshot = take_snapshots([position], block_number, apy=False, prices=prices,
+                                          call_cache=call_cache)[0]
+                rows.append(snapshot_to_backtest_row(snapshot))
+            except Exception as exc:
+                rows.append(_error_row(position, block_number, exc))
+        return rows
+
+
+def stream_backtest(positions: list, start_block: int, end_block: int = None, stride: int = 1,
+                    max_workers: int = BACKTEST_MAX_WORKERS, call_cache: CallCache = None) -> Iterator[dict]:
+    """
+    Evaluate positions over a block range, yielding the rows block by block (in block order) as they are ready.
+
+    Blocks are evaluated concurrently on a pool of max_workers threads, with every read of a block batched into
+    three Multicall round trips. The RPC node must be an archive node to read past blocks (see _config.AVAX_RPC_URL).
+
+    :param positions: AvalanchePosition objects (read with the first position's provider)
+    :param start_block: The first block
+    :param end_block: (optional) The last block (defaults to the latest block)
+    :param stride: Number of blocks between evaluated blocks
+    :param max_workers: Number of blocks evaluated concurrently
+    :param call_cache: (optional) Cache of the read results by (block, call), reuse it across backtests of
+                       overlapping blocks and positions to skip the reads already made
+    :return: Iterator of backtest rows (BACKTEST_COLUMNS)
+    """
+    positions = list(positions)
+    if len(positions) == 0:
+        return
+
+    blocks = backtest_blocks(start_block, end_block, stride, positions[0].web3_provider)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for block_number in blocks:
+            in_flight.append(executor.submit(evaluate_block, positions, block_number, call_cache))
+            if len(in_flight) >= 2 * max_workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def backtest(positions: list, start_block: int, end_block: int = None, stride: int = 1,
+             max_workers: int = BACKTEST_MAX_WORKERS, call_cache: CallCache = None) -> dict[int, list[dict]]:
+    """
+    Evaluate positions over a block range (see stream_backtest())
+
+        series = backtest(positions, start_block=30000000, stride=43200)  # About every day (2s blocks)
+        equity = [(row['timestamp'], row['equity_value_usd']) for row in series[position.pos_id]]
+
+    :return: The time series of each position: {position ID: backtest rows in block order}
+    """
+    series = {position.pos_id: [] for position in positions}
+    for row in stream_backtest(positions, start_block, end_block, stride, max_workers, call_cache):
+        series[row['position_id']].append(row)
+    return series
+
+
+def write_backtest(positions: list, path: str, start_block: int, end_block: int = None, stride: int = 1,
+                   fmt: str = None, max_workers: int = BACKTEST_MAX_WORKERS, call_cache: CallCache = None,
+                   verbose: bool = True) -> dict:
+    """
+    Write a backtest to CSV, JSON Lines or Parquet, streaming rows to the file as they are built (see
+    stream_backtest())
+
+    :param path: The output file path
+    :param fmt: (optional) One of 'csv', 'jsonl' or 'parquet' (inferred from the path's extension if not given)
+    :param verbose: Print each block as it is written
+    :return: (dict) rows, errors and elapsed_seconds of the backtest
+    """
+    start = time.perf_counter()
+    errors = 0
+    last_block = None
+    with get_report_writer(path, fmt, BACKTEST_COLUMNS) as writer:
+        for row in stream_backtest(positions, start_block, end_block, stride, max_workers, call_cache):
+            writer.write(row)
+            if row['error'] is not None:
+                errors += 1
+            if verbose and row['block_number'] != last_block:
+                last_block = row['block_number']
+                print(f"Processed block {last_block} ({time.perf_counter() - start:.1f}s)")
+
+    return {"rows": writer.rows_written, "errors": errors, "elapsed_seconds": time.perf_counter() - start}
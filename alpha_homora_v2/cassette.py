@@ -0,0 +1,248 @@
+from base64 import b64decode, b64encode
+from contextlib import contextmanager
+from datetime import timedelta
+from os.path import exists
+from threading import Lock
+from typing import Any, Iterator
+import gzip
+import itertools
+import json
+
+from .session import http_session
+
+from requests import PreparedRequest, Response, Session
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from web3 import Web3
+from web3._utils.encoding import Web3JsonEncoder
+from web3.providers.base import BaseProvider
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class Cassette:
+    """
+    JSON-RPC and HTTP responses recorded during a session, saved as gzipped JSON.
+
+    Responses are stored per request: (method, params) for JSON-RPC and (method, URL, body) for HTTP. When a request
+    was recorded more than once, replay serves its responses in the recorded order, then keeps serving the last one.
+    """
+    def __init__(self, path: str = None):
+        """
+        :param path: (optional) The cassette file (loaded if it exists)
+        """
+        self.path = path
+        self._rpc: dict[tuple[str, str], list[dict]] = {}
+        self._http: dict[tuple[str, str, str], list[dict]] = {}
+        self._served: dict[tuple, int] = {}
+        self._lock = Lock()
+        if path is not None and exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return sum(len(responses) for responses in self._rpc.values()) + \
+            sum(len(responses) for responses in self._http.values())
+
+    """ -------------------- JSON-RPC: -------------------- """
+
+    def record_rpc(self, method: str, params: Any, response: dict) -> None:
+        with self._lock:
+            self._rpc.setdefault(self._rpc_key(method, params), []).append(
+                {key: value for key, value in response.items() if key != "id"})
+
+    def next_rpc(self, method: str, params: Any) -> dict:
+        """Returns the next recorded response to the JSON-RPC request (without its id)"""
+        key = self._rpc_key(method, params)
+        return self._next(self._rpc, key, f"JSON-RPC request {method} {key[1]}")
+
+    @staticmethod
+    def _rpc_key(method: str, params: Any) -> tuple[str, str]:
+        return method, json.dumps(params, cls=Web3JsonEncoder, sort_keys=True, separators=(",", ":"))
+
+    """ -------------------- HTTP: -------------------- """
+
+    def record_http(self, request: PreparedRequest, response: Response) -> None:
+        try:
+            content, encoding = response.content.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            content, encoding = b64encode(response.content).decode(), "base64"
+        recorded = {"status": response.status_code, "reason": response.reason, "content": content,
+                    "encoding": encoding, "headers": {"Content-Type": response.headers.get("Content-Type", "")}}
+        with self._lock:
+            self._http.setdefault(self._http_key(request), []).append(recorded)
+
+    def next_http(self, request: PreparedRequest) -> Response:
+        """Returns the next recorded response to the HTTP request"""
+        recorded = self._next(self._http, self._http_key(request), f"HTTP request {request.method} {request.url}")
+        response = Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["reason"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response._content = b64decode(recorded["content"]) if recorded["encoding"] == "base64" \
+            else recorded["content"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(0)
+        return response
+
+    @staticmethod
+    def _http_key(request: PreparedRequest) -> tuple[str, str, str]:
+        body = request.body.decode("utf-8", "replace") if isinstance(request.body, bytes) else request.body
+        return request.method, request.url, body or ""
+
+    """ -------------------- STORAGE: -------------------- """
+
+    def _next(self, recordings: dict, key: tuple, description: str) -> dict:
+        with self._lock:
+            responses = recordings.get(key)
+            if responses is None:
+                raise KeyError(f"The cassette has no recording of the {description}")
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+            return responses[min(served, len(responses) - 1)]
+
+    def rewind(self) -> None:
+        """Serve every request from its first recorded response again"""
+        with self._lock:
+            self._served.clear()
+
+    def save(self, path: str = None) -> None:
+        path = self.path if path is None else path
+        with self._lock:
+            payload = {"version": 1,
+                       "rpc": [{"method": method, "params": params, "responses": responses}
+                               for (method, params), responses in self._rpc.items()],
+                       "http": [{"method": method, "url": url, "body": body, "responses": responses}
+                                for (method, url, body), responses in self._http.items()]}
+        with gzip.open(path, "wt", encoding="utf-8") as cassette_file:
+            json.dump(payload, cassette_file, separators=(",", ":"))
+
+    def load(self, path: str) -> None:
+        with gzip.open(path, "rt", encoding="utf-8") as cassette_file:
+            payload = json.load(cassette_file)
+        with self._lock:
+            for entry in payload["rpc"]:
+                self._rpc.setdefault((entry["method"], entry["params"]), []).extend(entry["responses"])
+            for entry in payload["http"]:
+                self._http.setdefault((entry["method"], entry["url"], entry["body"]), []).extend(entry["responses"])
+
+
+class CassetteProvider(BaseProvider):
+    """
+    Web3 provider recording the JSON-RPC responses of the wrapped provider into a cassette, or serving them from it
+
+    It sits below every middleware, so the cassette holds the raw node responses.
+    Note: the cassette does not send JSON-RPC batches (see rpc_batch.RPCBatch), so batched requests (e.g. receipt
+    polls) are sent one at a time while a cassette is in use.
+    """
+    def __init__(self, cassette: Cassette, mode: str, provider: BaseProvider = None):
+        """
+        :param cassette: The cassette to record into or replay from
+        :param mode: RECORD or REPLAY
+        :param provider: The provider to record (not needed to replay)
+        """
+        assert mode in (RECORD, REPLAY), f"Unsupported cassette mode: {mode}"
+        assert mode == REPLAY or provider is not None, "A provider is required to record"
+        self.cassette = cassette
+        self.mode = mode
+        self.provider = provider
+        self._request_ids = itertools.count()
+
+    def make_request(self, method, params) -> dict:
+        if self.mode == REPLAY:
+            return {"jsonrpc": "2.0", "id": next(self._request_ids), **self.cassette.next_rpc(method, params)}
+
+        response = self.provider.make_request(method, params)
+        self.cassette.record_rpc(method, params, response)
+        return response
+
+    def isConnected(self) -> bool:
+        return self.mode == REPLAY or self.provider.isConnected()
+
+
+class CassetteAdapter(BaseAdapter):
+    """requests transport adapter recording the responses of the wrapped adapter into a cassette, or serving them"""
+    def __init__(self, cassette: Cassette, mode: str, adapter: BaseAdapter = None):
+        """
+        :param cassette: The cassette to record into or replay from
+        :param mode: RECORD or REPLAY
+        :param adapter: The adapter to record (not needed to replay)
+        """
+        super().__init__()
+        assert mode in (RECORD, REPLAY), f"Unsupported cassette mode: {mode}"
+        assert mode == REPLAY or adapter is not None, "An adapter is required to record"
+        self.cassette = cassette
+        self.mode = mode
+        self.adapter = adapter
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        if self.mode == REPLAY:
+            return self.cassette.next_http(request)
+
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record_http(request, response)
+        return response
+
+    def close(self) -> None:
+        if self.adapter is not None:
+            self.adapter.close()
+
+
+@contextmanager
+def use_cassette(path: str, mode: str, web3_provider: Web3 = None,
+                 sessions: list[Session] = None) -> Iterator[Cassette]:
+    """
+    Record or replay the JSON-RPC requests of the Web3 provider and the HTTP requests of the API sessions
+
+        with use_cassette("session.json.gz", RECORD):  # Against the live endpoints
+            position.get_current_apy()
+
+        with use_cassette("session.json.gz", REPLAY):  # Offline, from the recorded responses
+            position.get_current_apy()
+
+    Recording appends to an existing cassette, which is saved when the context exits. Replaying a request that was
+    not recorded raises a KeyError.
+    Note: values cached in memory (e.g. prices, pool info) are not requested again, so clear them first to replay a
+    session from scratch.
+
+    :param path: The cassette file
+    :param mode: RECORD or REPLAY
+    :param web3_provider: (optional) The Web3 object whose provider is recorded (defaults to the Avalanche provider)
+    :param sessions: (optional) The requests sessions to record (defaults to the API session and the CoinGecko
+                     client's session)
+    """
+    from .provider import avalanche_provider
+    from .oracles import cg
+
+    web3_provider = avalanche_provider if web3_provider is None else web3_provider
+    sessions = [http_session, cg.session] if sessions is None else sessions
+    cassette = Cassette(path)
+
+    original_provider = web3_provider.provider
+    original_adapters = [dict(session.adapters) for session in sessions]
+    web3_provider.provider = CassetteProvider(cassette, mode, original_provider)
+    for session in sessions:
+        for prefix in ("https://", "http://"):
+            session.mount(prefix, CassetteAdapter(cassette, mode, session.get_adapter(prefix)))
+    try:
+        yield cassette
+    finally:
+        web3_provider.provider = original_provider
+        for session, adapters in zip(sessions, original_adapters):
+            session.adapters.clear()
+            for prefix, adapter in adapters.items():
+                session.mount(prefix, adapter)
+        if mode == RECORD:
+            cassette.save()
+
+
+def recording(path: str, web3_provider: Web3 = None, sessions: list[Session] = None):
+    """use_cassette() in RECORD mode"""
+    return use_cassette(path, RECORD, web3_provider, sessions)
+
+
+def replaying(path: str, web3_provider: Web3 = None, sessions: list[Session] = None):
+    """use_cassette() in REPLAY mode"""
+    return use_cassette(path, REPLAY, web3_provider, sessions)
@@ -0,0 +1,262 @@
+from os import makedirs
+from os.path import join, expanduser, dirname, abspath
+from threading import Lock
+from typing import Union
+import json
+import sqlite3
+
+from .util import ContractInstanceFunc, load_abi
+from .registry import PoolRegistry, get_pool_registry
+from .resources.abi_reference import HomoraBank_ABI
+from .provider import avalanche_provider
+from ._config import HOMORA_BANK_START_BLOCK, INDEXER_CHUNK_SIZE
+
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from web3._utils.events import get_event_data
+
+INDEXER_DB_PATH = join(expanduser("~"), ".alpha_homora_v2", "homora_bank_43114.sqlite")
+
+# HomoraBank events that create positions or change their owner, collateral or debt
+INDEXED_EVENTS = ("Execute", "Borrow", "Repay", "PutCollateral", "TakeCollateral", "Liquidate")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS positions (
+    id INTEGER PRIMARY KEY,
+    owner TEXT,
+    spell TEXT,
+    coll_token TEXT,
+    coll_id TEXT,
+    collateral_size TEXT NOT NULL DEFAULT '0',
+    created_block INTEGER NOT NULL,
+    updated_block INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS positions_owner ON positions (owner);
+CREATE INDEX IF NOT EXISTS positions_collateral ON positions (coll_token, coll_id);
+CREATE TABLE IF NOT EXISTS debt_shares (
+    position_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    share TEXT NOT NULL,
+    PRIMARY KEY (position_id, token)
+);
+CREATE TABLE IF NOT EXISTS events (
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    event TEXT NOT NULL,
+    position_id INTEGER NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_position ON events (position_id);
+"""
+
+
+class PositionIndexer:
+    """
+    Indexes the HomoraBank position events into a local SQLite database.
+
+    sync() scans the HomoraBank logs with chunked eth_getLogs requests from the last indexed block (the high-water
+    mark stored in the database) to the chain head, committing each chunk with the new high-water mark, so an
+    interrupted sync resumes where it stopped and later syncs only read the new blocks.
+
+    Each position's owner, spell, collateral (wrapper token, collateral id and size) and debt shares are kept
+    current, and owner -> positions and position -> pool lookups are indexed local queries:
+
+        indexer = PositionIndexer()
+        indexer.sync()
+        positions = indexer.get_positions_by_owner(owner_address)
+        pool = indexer.get_position_pool(positions[0]['id'])
+    """
+    def __init__(self, path: str = INDEXER_DB_PATH, web3_provider: Web3 = None,
+                 start_block: int = HOMORA_BANK_START_BLOCK, chunk_size: int = INDEXER_CHUNK_SIZE,
+                 confirmations: int = 0):
+        """
+        :param path: The SQLite database file (created if it does not exist, ":memory:" for a temporary index)
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        :param start_block: The block the first sync starts from
+        :param chunk_size: The maximum block range of a single eth_getLogs request (halved when the RPC rejects it)
+        :param confirmations: Number of blocks behind the chain head to index up to
+        """
+        if path != ":memory:":
+            makedirs(dirname(abspath(path)), exist_ok=True)
+        self.path = path
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.confirmations = confirmations
+
+        self._bank = ContractInstanceFunc(self.web3_provider, *HomoraBank_ABI)
+        self._events = {event_abi_to_log_topic(item): item for item in load_abi(HomoraBank_ABI[0])
+                        if item.get("type") == "event" and item["name"] in INDEXED_EVENTS}
+
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    @property
+    def last_block(self) -> Union[int, None]:
+        """The last indexed block (None if nothing has been indexed yet)"""
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'last_block'").fetchone()
+        return None if row is None else int(row["value"])
+
+    """ -------------------- SYNCING: -------------------- """
+
+    def sync(self, to_block: int = None, verbose: bool = False) -> int:
+        """
+        Index the HomoraBank events from the high-water mark up to to_block
+
+        :param to_block: (optional) The last block to index (defaults to the chain head minus confirmations)
+        :param verbose: Print the progress of each chunk
+        :return: The number of events indexed
+        """
+        if to_block is None:
+            to_block = self.web3_provider.eth.block_number - self.confirmations
+
+        indexed = 0
+        with self._lock:
+            from_block = self.start_block if self.last_block is None else self.last_block + 1
+            while from_block <= to_block:
+                chunk_end = min(from_block + self.chunk_size - 1, to_block)
+                try:
+                    logs = self.web3_provider.eth.get_logs({
+                        "address": self._bank.address, "fromBlock": from_block, "toBlock": chunk_end,
+                        "topics": [[Web3.toHex(topic) for topic in self._events]]})
+                except ValueError as exc:
+                    # The RPC rejected the range (too many blocks or results): retry with a smaller one
+                    if self.chunk_size == 1:
+                        raise
+                    self.chunk_size = max(self.chunk_size // 2, 1)
+                    if verbose:
+                        print(f"eth_getLogs failed ({exc}), retrying with chunks of {self.chunk_size} blocks")
+                    continue
+
+                with self._db:
+                    for log in sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"])):
+                        self._apply(log)
+                    self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_block', ?)",
+                                     (str(chunk_end),))
+                indexed += len(logs)
+                if verbose:
+                    print(f"Indexed blocks {from_block}-{chunk_end} ({len(logs)} events)")
+                from_block = chunk_end + 1
+
+        return indexed
+
+    def _apply(self, log) -> None:
+        event = get_event_data(self.web3_provider.codec, self._events[bytes(log["topics"][0])], log)
+        name, args, block_number = event["event"], dict(event["args"]), event["blockNumber"]
+        position_id = args["positionId"]
+
+        inserted = self._db.execute(
+            "INSERT OR IGNORE INTO events (block_number, log_index, transaction_hash, event, position_id, args) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (block_number, event["logIndex"], event["transactionHash"].hex(), name, position_id,
+             json.dumps({k: str(v) if isinstance(v, int) else v for k, v in args.items()}))).rowcount
+        if inserted == 0:
+            return  # Already indexed
+
+        self._db.execute("INSERT OR IGNORE INTO positions (id, created_block, updated_block) VALUES (?, ?, ?)",
+                         (position_id, block_number, block_number))
+        self._db.execute("UPDATE positions SET updated_block = ? WHERE id = ?", (block_number, position_id))
+
+        if name == "Execute":
+            # Positions cannot be transferred, so the first execute() caller is the owner
+            self._db.execute("UPDATE positions SET owner = COALESCE(owner, ?), spell = ? WHERE id = ?",
+                             (args["user"].lower(), args["spell"].lower(), position_id))
+        elif name == "PutCollateral":
+            self._db.execute("UPDATE positions SET coll_token = ?, coll_id = ? WHERE id = ?",
+                             (args["token"].lower(), str(args["id"]), position_id))
+            self._add_collateral(position_id, args["amount"])
+        elif name == "TakeCollateral":
+            self._add_collateral(position_id, -args["amount"])
+        elif name == "Borrow":
+            self._add_debt_share(position_id, args["token"], args["share"])
+        elif name == "Repay":
+            self._add_debt_share(position_id, args["token"], -args["share"])
+        elif name == "Liquidate":
+            self._add_debt_share(position_id, args["debtToken"], -args["share"])
+            self._add_collateral(position_id, -args["bounty"])
+
+    def _add_collateral(self, position_id: int, amount: int) -> None:
+        row = self._db.execute("SELECT collateral_size FROM positions WHERE id = ?", (position_id,)).fetchone()
+        self._db.execute("UPDATE positions SET collateral_size = ? WHERE id = ?",
+                         (str(max(int(row["collateral_size"]) + amount, 0)), position_id))
+
+    def _add_debt_share(self, position_id: int, token: str, share: int) -> None:
+        row = self._db.execute("SELECT share FROM debt_shares WHERE position_id = ? AND token = ?",
+                               (position_id, token.lower())).fetchone()
+        share = max((0 if row is None else int(row["share"])) + share, 0)
+        if share == 0:
+            self._db.execute("DELETE FROM debt_shares WHERE position_id = ? AND token = ?",
+                             (position_id, token.lower()))
+        else:
+            self._db.execute("INSERT OR REPLACE INTO debt_shares (position_id, token, share) VALUES (?, ?, ?)",
+                             (position_id, token.lower(), str(share)))
+
+    """ -------------------- QUERIES: -------------------- """
+
+    def get_position(self, position_id: int) -> Union[dict, None]:
+        """
+        Returns the indexed position (None if it has not been indexed)
+
+        {id: int
+        owner: str
+        spell: str
+        collToken: str (wrapper token address)
+        collId: str (int)
+        collateralSize: str (int)
+        debtShares: {token address: str (int)}
+        createdBlock: int
+        updatedBlock: int}
+        """
+        row = self._db.execute("SELECT * FROM positions WHERE id = ?", (int(position_id),)).fetchone()
+        return None if row is None else self._position_from_row(row)
+
+    def get_positions_by_owner(self, owner_address: str, open_only: bool = True) -> list[dict]:
+        """
+        Returns the positions held by the owner wallet address (see get_position() for the format)
+
+        :param open_only: Only return positions that still hold collateral
+        """
+        query = "SELECT * FROM positions WHERE owner = ?"
+        if open_only:
+            query += " AND collateral_size != '0'"
+        rows = self._db.execute(query + " ORDER BY id", (owner_address.lower(),)).fetchall()
+        return [self._position_from_row(row) for row in rows]
+
+    def get_position_pool(self, position_id: int, pool_registry: PoolRegistry = None) -> dict:
+        """
+        Returns the metadata for the pool that the position is in, matched by its collateral wrapper token and pid
+
+        :param pool_registry: (optional) The PoolRegistry to search (defaults to the process-wide one)
+        """
+        position = self.get_position(position_id)
+        if position is None or position["collToken"] is None:
+            raise IndexError(f"Could not find collateral for position_id {position_id} in the index")
+
+        if pool_registry is None:
+            pool_registry = get_pool_registry()
+        return pool_registry.by_collateral(position["collToken"], int(position["collId"]))
+
+    def get_events(self, position_id: int) -> list[dict]:
+        """Returns the position's indexed events, oldest first"""
+        rows = self._db.execute("SELECT * FROM events WHERE position_id = ? ORDER BY block_number, log_index",
+                                (int(position_id),)).fetchall()
+        return [{"blockNumber": row["block_number"], "logIndex": row["log_index"],
+                 "transactionHash": row["transaction_hash"], "event": row["event"], "args": json.loads(row["args"])}
+                for row in rows]
+
+    def _position_from_row(self, row: sqlite3.Row) -> dict:
+        debt_shares = self._db.execute("SELECT token, share FROM debt_shares WHERE position_id = ?",
+                                       (row["id"],)).fetchall()
+        return {"id": row["id"], "owner": row["owner"], "spell": row["spell"], "collToken": row["coll_token"],
+                "collId": row["coll_id"], "collateralSize": row["collateral_size"],
+                "debtShares": {debt["token"]: debt["share"] for debt in debt_shares},
+                "createdBlock": row["created_block"], "updatedBlock": row["updated_block"]}
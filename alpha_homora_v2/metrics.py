@@ -0,0 +1,367 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from os import listdir
+from os.path import join, abspath, dirname
+from threading import Lock
+from typing import Any, Callable, Iterator, Union
+from urllib.parse import urlparse
+import bisect
+import json
+import time
+
+from .resources import abi_reference
+from .resources.abi_reference import TRADERJOE_ABI_REF
+from .registry import get_token_registry, get_pool_registry
+from .session import http_session
+from ._config import METRICS_LATENCY_BUCKETS
+
+from eth_abi import decode_abi
+from eth_utils import function_abi_to_4byte_selector
+from requests import Response, Session
+from web3 import Web3
+
+ABI_DIR = join(abspath(dirname(__file__)), "abi")
+
+# Multicall3.aggregate3((address,bool,bytes)[]) (the reads it batches are decoded and counted as batched calls)
+AGGREGATE3_SELECTOR = "0x82ad56cb"
+
+MIDDLEWARE_NAME = "metrics"
+
+
+@dataclass
+class RequestStats:
+    """Counters of the requests made for one (contract, function) or API endpoint"""
+    requests: int = 0
+    errors: int = 0
+    batched_calls: int = 0  # Reads made inside a Multicall or a JSON-RPC batch (no request of their own)
+    request_bytes: int = 0
+    response_bytes: int = 0
+    latency_sum: float = 0.0
+    # Number of requests per latency bucket (the last one counts the requests above the largest bound)
+    latency_buckets: list[int] = field(default_factory=lambda: [0] * (len(METRICS_LATENCY_BUCKETS) + 1))
+
+    def observe(self, seconds: float, request_bytes: int, response_bytes: int, error: bool) -> None:
+        self.requests += 1
+        self.errors += int(error)
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        self.latency_sum += seconds
+        self.latency_buckets[bisect.bisect_left(METRICS_LATENCY_BUCKETS, seconds)] += 1
+
+    def as_dict(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors, "batched_calls": self.batched_calls,
+                "request_bytes": self.request_bytes, "response_bytes": self.response_bytes,
+                "latency_sum": self.latency_sum,
+                "latency_mean": self.latency_sum / self.requests if self.requests > 0 else None}
+
+
+def _abi_name(json_abi_file: str) -> str:
+    """e.g. HomoraBankABI.json -> HomoraBank, AggregatorOracle_ABI.json -> AggregatorOracle"""
+    name = json_abi_file[:-len(".json")]
+    for suffix in ("_ABI", "ABI"):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+@lru_cache(maxsize=None)
+def _selector_index() -> dict[str, tuple[str, str]]:
+    """{function selector: (contract name, function name)} over every bundled ABI"""
+    index = {}
+    # ERC20 first, so that the selectors every token contract shares are attributed to it
+    filenames = sorted(listdir(ABI_DIR), key=lambda filename: filename != "ERC20_ABI.json")
+    for filename in filenames:
+        with open(join(ABI_DIR, filename)) as abi_file:
+            abi = json.load(abi_file)
+        if not isinstance(abi, list):
+            continue  # Pool and token lists
+        for item in abi:
+            if isinstance(item, dict) and item.get("type") == "function":
+                selector = Web3.toHex(function_abi_to_4byte_selector(item))
+                index.setdefault(selector, (_abi_name(filename), item["name"]))
+    return index
+
+
+@lru_cache(maxsize=None)
+def _address_index() -> dict[str, str]:
+    """{contract address: contract name} of the contracts in the ABI reference, pools list and token reference"""
+    index = {}
+    for token in get_token_registry():
+        index[token['address'].lower()] = "ERC20"
+    for pool in get_pool_registry().pools:
+        index[pool['lpTokenAddress'].lower()] = "LP"
+        if pool['exchange']['name'] == "Trader Joe" and pool.get('wTokenType') in TRADERJOE_ABI_REF:
+            abi_ref = TRADERJOE_ABI_REF[pool['wTokenType']]
+            index[pool['wTokenAddress'].lower()] = _abi_name(abi_ref['wrapper'])
+            if "stakingAddress" in pool:
+                index[pool['stakingAddress'].lower()] = _abi_name(abi_ref['staking'])
+    for value in vars(abi_reference).values():
+        if isinstance(value, tuple) and len(value) == 2 and value[1] is not None:
+            index[value[1].lower()] = _abi_name(value[0])
+    return index
+
+
+def decode_call(to: Union[str, None], data: Union[str, bytes]) -> tuple[str, str]:
+    """
+    Name the contract and function of an eth_call from the bundled ABIs (no RPC)
+
+    :param to: The called contract address
+    :param data: The call data
+    :return: (contract name, function name), the contract falls back to the ABI defining the selector, and both to
+             "unknown" and the selector if no bundled ABI defines it
+    """
+    selector = Web3.toHex(data)[:10] if isinstance(data, bytes) else data[:10]
+    contract_name, function_name = _selector_index().get(selector, ("unknown", selector))
+    if to is not None:
+        contract_name = _address_index().get(to.lower(), contract_name)
+    return contract_name, function_name
+
+
+class MetricsCollector:
+    """
+    Counts, latency histograms, payload sizes and errors of the package's requests: JSON-RPC requests per (method,
+    contract, function) and API requests per (host, path).
+
+    Collection is opt-in: instrument a Web3 provider with instrument_provider() (which adds a middleware decoding each
+    eth_call to its contract and function with the bundled ABIs) and a requests session with instrument_session(),
+    or call enable() for the Avalanche provider and the package's API sessions.
+
+        enable()
+        with rpc_metrics.measure() as scope:
+            position.get_current_apy()
+        print(scope.summary())
+        print(rpc_metrics.prometheus())
+    """
+    def __init__(self):
+        self._rpc: dict[tuple[str, str, str], RequestStats] = {}
+        self._http: dict[tuple[str, str, str], RequestStats] = {}
+        self._scopes: list[MetricsCollector] = []
+        self._lock = Lock()
+
+    """ -------------------- INSTRUMENTATION: -------------------- """
+
+    def middleware(self, make_request: Callable, w3: Web3) -> Callable:
+        """web3 middleware recording every JSON-RPC request that goes through the provider"""
+        def metrics_middleware(method, params):
+            start = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception:
+                self.record_rpc(method, params, None, time.perf_counter() - start)
+                raise
+            self.record_rpc(method, params, response, time.perf_counter() - start)
+            return response
+
+        return metrics_middleware
+
+    def instrument_provider(self, web3_provider: Web3) -> None:
+        """Add the metrics middleware to the provider as its innermost layer (once), below the chain ID cache"""
+        if MIDDLEWARE_NAME not in web3_provider.middleware_onion:
+            web3_provider.middleware_onion.inject(self.middleware, name=MIDDLEWARE_NAME, layer=0)
+
+    def instrument_session(self, session: Session) -> None:
+        """Record every response of the requests session"""
+        if self.response_hook not in session.hooks['response']:
+            session.hooks['response'].append(self.response_hook)
+
+    def response_hook(self, response: Response, *args, **kwargs) -> None:
+        """requests response hook (responses with an error status are counted as errors)"""
+        url = urlparse(response.request.url)
+        body = response.request.body
+        request_bytes = len(response.request.url) + (0 if body is None else len(body))
+        key = (response.request.method, url.netloc, url.path)
+        self._observe("http", key, response.elapsed.total_seconds(), request_bytes, len(response.content),
+                      response.status_code >= 400)
+
+    """ -------------------- RECORDING: -------------------- """
+
+    def record_rpc(self, method: str, params, response: Union[dict, None], seconds: float,
+                   batched: bool = False) -> None:
+        """
+        Record a JSON-RPC request
+
+        :param response: The RPC response (None if the request raised)
+        :param batched: The request was sent inside a JSON-RPC batch (see record_rpc_batch()): it is counted as a
+                        batched call and its errors, but not as a request
+        """
+        contract_name, function_name = "", ""
+        calls = []
+        if method == "eth_call" and len(params) > 0 and isinstance(params[0], dict) and "data" in params[0]:
+            to, data = params[0].get("to"), params[0]["data"]
+            data = Web3.toHex(data) if isinstance(data, bytes) else data
+            contract_name, function_name = decode_call(to, data)
+            if data.startswith(AGGREGATE3_SELECTOR):
+                calls = self._decode_aggregate3(data)
+
+        error = response is None or "error" in response
+        if batched:
+            self._count_batched((method, contract_name, function_name), error)
+        else:
+            self._observe("rpc", (method, contract_name, function_name), seconds, _json_size(params),
+                          0 if response is None else _json_size(response.get("result", response.get("error"))), error)
+        for call in calls:
+            self._count_batched(("eth_call", *decode_call(*call)))
+
+    def record_rpc_batch(self, requests: list[tuple[str, Any]], responses: Union[list[dict], None],
+                         seconds: float) -> None:
+        """
+        Record a JSON-RPC batch sent below the provider's middlewares (see rpc_batch.RPCBatch): the HTTP request is
+        counted once under the "batch" method, and each of its requests as a batched call
+
+        :param requests: (method, params) pairs
+        :param responses: The responses, in the order of requests (None if the batch raised)
+        """
+        error = responses is None
+        self._observe("rpc", ("batch", "", ""), seconds, _json_size([params for _, params in requests]),
+                      0 if responses is None else _json_size(responses), error)
+        for i, (method, params) in enumerate(requests):
+            self.record_rpc(method, params, None if responses is None else responses[i], seconds, batched=True)
+
+    @staticmethod
+    def _decode_aggregate3(data: str) -> list[tuple[str, bytes]]:
+        try:
+            calls, = decode_abi(["(address,bool,bytes)[]"], Web3.toBytes(hexstr=data)[4:])
+        except Exception:
+            return []
+        return [(target, call_data) for target, _, call_data in calls]
+
+    def _observe(self, kind: str, key: tuple, seconds: float, request_bytes: int, response_bytes: int,
+                 error: bool) -> None:
+        with self._lock:
+            collectors = [self, *self._scopes]
+        for collector in collectors:
+            with collector._lock:
+                getattr(collector, f"_{kind}").setdefault(key, RequestStats()).observe(seconds, request_bytes, response_bytes, error)
+
+    def _count_batched(self, key: tuple, error: bool = False) -> None:
+        with self._lock:
+            collectors = [self, *self._scopes]
+        for collector in collectors:
+            with collector._lock:
+                stats = collector._rpc.setdefault(key, RequestStats())
+                stats.batched_calls += 1
+                stats.errors += int(error)
+
+    @contextmanager
+    def measure(self) -> Iterator["MetricsCollector"]:
+        """
+        Collect the requests made inside the context (from any thread) into a new collector, e.g. to measure what
+        a single method costs
+        """
+        scope = MetricsCollector()
+        with self._lock:
+            self._scopes.append(scope)
+        try:
+            yield scope
+        finally:
+            with self._lock:
+                self._scopes.remove(scope)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._rpc.clear()
+            self._http.clear()
+
+    """ -------------------- REPORTING: -------------------- """
+
+    def rpc_stats(self) -> dict[tuple[str, str, str], dict]:
+        """{(method, contract, function): stats dict} (contract and function are empty for methods other than eth_call)"""
+        with self._lock:
+            return {key: stats.as_dict() for key, stats in self._rpc.items()}
+
+    def http_stats(self) -> dict[tuple[str, str, str], dict]:
+        """{(HTTP method, host, path): stats dict}"""
+        with self._lock:
+            return {key: stats.as_dict() for key, stats in self._http.items()}
+
+    def summary(self) -> dict:
+        """Totals: rpc_requests, eth_calls, batched_calls, rpc_errors, http_requests and http_errors"""
+        with self._lock:
+            rpc, http = list(self._rpc.items()), list(self._http.values())
+        return {"rpc_requests": sum(stats.requests for _, stats in rpc),
+                "eth_calls": sum(stats.requests for key, stats in rpc if key[0] == "eth_call"),
+                "batched_calls": sum(stats.batched_calls for _, stats in rpc),
+                "rpc_errors": sum(stats.errors for _, stats in rpc),
+                "http_requests": sum(stats.requests for stats in http),
+                "http_errors": sum(stats.errors for stats in http)}
+
+    def prometheus(self, prefix: str = "alpha_homora") -> str:
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            rpc = {key: _copy(stats) for key, stats in self._rpc.items()}
+            http = {key: _copy(stats) for key, stats in self._http.items()}
+
+        lines = []
+        for kind, label_names, table in (("rpc", ("method", "contract", "function"), rpc),
+                                         ("http", ("method", "host", "path"), http)):
+            series = [(_labels(label_names, key), stats) for key, stats in sorted(table.items())]
+            name = f"{prefix}_{kind}"
+            counters = [("requests_total", "Requests", "requests"), ("errors_total", "Failed requests", "errors"),
+                        ("request_bytes_total", "Request payload bytes", "request_bytes"),
+                        ("response_bytes_total", "Response payload bytes", "response_bytes")]
+            if kind == "rpc":
+                counters.append(("batched_calls_total", "Requests batched in a Multicall or a JSON-RPC batch",
+                                 "batched_calls"))
+            for suffix, help_text, attribute in counters:
+                lines += [f"# HELP {name}_{suffix} {help_text}", f"# TYPE {name}_{suffix} counter"]
+                lines += [f"{name}_{suffix}{{{labels}}} {getattr(stats, attribute)}" for labels, stats in series]
+
+            histogram = f"{name}_request_duration_seconds"
+            lines += [f"# HELP {histogram} Request latency", f"# TYPE {histogram} histogram"]
+            for labels, stats in series:
+                if stats.requests == 0:
+                    continue
+                cumulative = 0
+                for bound, count in zip([*METRICS_LATENCY_BUCKETS, "+Inf"], stats.latency_buckets):
+                    cumulative += count
+                    lines.append(f'{histogram}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines += [f"{histogram}_sum{{{labels}}} {stats.latency_sum}",
+                          f"{histogram}_count{{{labels}}} {stats.requests}"]
+        return "\n".join(lines) + "\n"
+
+
+def _copy(stats: RequestStats) -> RequestStats:
+    return RequestStats(stats.requests, stats.errors, stats.batched_calls, stats.request_bytes, stats.response_bytes,
+                        stats.latency_sum, list(stats.latency_buckets))
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, default=lambda o: Web3.toHex(o) if isinstance(o, bytes) else str(o)))
+
+
+rpc_metrics = MetricsCollector()
+
+
+def enable(web3_provider: Web3 = None) -> MetricsCollector:
+    """
+    Start collecting the package's request metrics in rpc_metrics
+
+    :param web3_provider: (optional) The provider to instrument (defaults to the Avalanche provider)
+    :return: rpc_metrics
+    """
+    from .provider import avalanche_provider
+    from .oracles import cg
+
+    rpc_metrics.instrument_provider(avalanche_provider if web3_provider is None else web3_provider)
+    rpc_metrics.instrument_session(http_session)
+    rpc_metrics.instrument_session(cg.session)
+    return rpc_metrics
+
+
+def disable(web3_provider: Web3 = None) -> None:
+    """Stop collecting (the collected metrics are kept)"""
+    from .provider import avalanche_provider
+    from .oracles import cg
+
+    web3_provider = avalanche_provider if web3_provider is None else web3_provider
+    if MIDDLEWARE_NAME in web3_provider.middleware_onion:
+        web3_provider.middleware_onion.remove(MIDDLEWARE_NAME)
+    for session in (http_session, cg.session):
+        if rpc_metrics.response_hook in session.hooks['response']:
+            session.hooks['response'].remove(rpc_metrics.response_hook)
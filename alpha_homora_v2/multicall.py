@@ -0,0 +1,264 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Union
+import asyncio
+
+from .util import ContractInstanceFunc
+from .resources.abi_reference import Multicall3_ABI
+from .provider import avalanche_provider
+from ._config import MULTICALL_BATCH_SIZE, CALL_CACHE_SIZE
+
+from web3 import Web3
+from web3.contract import ContractFunction
+from web3.exceptions import ContractLogicError
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+
+# Selector of the standard Solidity Error(string) revert payload
+ERROR_STRING_SELECTOR = bytes.fromhex("08c379a0")
+
+
+class Call:
+    """
+    A single contract read queued on a Multicall.
+    The decoded value is available through the result property once the batch has been executed.
+    """
+    __slots__ = ("function_call", "allow_failure", "default", "success", "_value", "_error")
+
+    def __init__(self, function_call: ContractFunction, allow_failure: bool = False, default: Any = None):
+        self.function_call = function_call
+        self.allow_failure = allow_failure
+        self.default = default
+        self.success = None
+        self._value = None
+        self._error = None
+
+    @property
+    def result(self) -> Any:
+        if self.success is None:
+            raise RuntimeError(f"The batch containing {self.function_call.fn_name}() has not been executed yet")
+        if not self.success and not self.allow_failure:
+            raise self._error
+        return self._value
+
+    def _encode(self) -> tuple[str, bool, str]:
+        return self.function_call.address, True, self.function_call._encode_transaction_data()
+
+    def _cache_key(self) -> tuple[str, str]:
+        return self.function_call.address.lower(), self.function_call._encode_transaction_data()
+
+    def _decode(self, success: bool, return_data: bytes) -> None:
+        self.success = success
+        if not success:
+            self._value = self.default
+            self._error = ContractLogicError(
+                f"execution reverted: {decode_revert_reason(return_data) or self.function_call.fn_name}")
+            return
+
+        web3_provider = self.function_call.web3
+        output_types = get_abi_output_types(self.function_call.abi)
+        try:
+            output_data = web3_provider.codec.decode_abi(output_types, return_data)
+        except Exception as exc:
+            # Treat undecodable output (e.g. no contract at the target) the same as a revert
+            self.success = False
+            self._value = self.default
+            self._error = ContractLogicError(f"Could not decode the output of {self.function_call.fn_name}(): {exc}")
+            return
+
+        normalized_data = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, output_data)
+        self._value = normalized_data[0] if len(normalized_data) == 1 else normalized_data
+
+
+class CallCache:
+    """
+    Raw results of contract reads at fixed block numbers, keyed by (block number, target address, call data).
+
+    State at a past block never changes, so a Multicall given a cache only sends the reads it has not seen at that
+    block (reads at "latest" or another block tag are never cached). The least recently used results are evicted.
+    """
+    def __init__(self, max_size: int = CALL_CACHE_SIZE):
+        """
+        :param max_size: Maximum number of cached results
+        """
+        self.max_size = max_size
+        self._results: OrderedDict[tuple[int, str, str], tuple[bool, bytes]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, block_number: int, call: Call) -> Union[tuple[bool, bytes], None]:
+        key = (block_number, *call._cache_key())
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._results.move_to_end(key)
+            return result
+
+    def put(self, block_number: int, call: Call, result: tuple[bool, bytes]) -> None:
+        with self._lock:
+            self._results[(block_number, *call._cache_key())] = result
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+
+class Multicall:
+    """
+    Aggregates many ContractFunction reads into a single eth_call through the Multicall3 contract.
+
+    Can be used directly or as a context manager, in which case the batch is executed on exit:
+
+        with position.batch() as batch:
+            reserves = batch.add(lp_contract.functions.getReserves())
+            supply = batch.add(lp_contract.functions.totalSupply())
+        r0, r1, last_block_time = reserves.result
+    """
+    def __init__(self, web3_provider: Web3 = None, block_identifier: Union[str, int] = "latest",
+                 batch_size: int = MULTICALL_BATCH_SIZE, call_cache: CallCache = None):
+        """
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        :param block_identifier: The block at which every queued read is executed
+        :param batch_size: The maximum number of reads sent in a single eth_call
+        :param call_cache: (optional) Cache of read results, used when block_identifier is a block number
+        """
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.block_identifier = block_identifier
+        self.batch_size = batch_size
+        self.call_cache = call_cache
+        self.contract = ContractInstanceFunc(self.web3_provider, *Multicall3_ABI)
+        self.calls: list[Call] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, function_call: ContractFunction, allow_failure: bool = False, default: Any = None) -> Call:
+        """
+        Queue a contract read
+
+        :param function_call: The uncalled contract method to read (e.g. contract.functions.totalSupply())
+        :param allow_failure: If True, a revert yields the default value instead of raising on access
+        :param default: The value returned for a failed read when allow_failure is set
+        :return: Call object holding the decoded result once the batch is executed
+        """
+        call = Call(function_call, allow_failure, default)
+        self.calls.append(call)
+        return call
+
+    def execute(self) -> list:
+        """
+        Execute every pending read, batch_size calls per eth_call
+
+        :return: The decoded results in the order the calls were added
+        """
+        for chunk in self._pending_chunks():
+            results = self.contract.functions.aggregate3([call._encode() for call in chunk]).call(
+                block_identifier=self.block_identifier)
+            self._set_results(chunk, results)
+
+        return [call.result for call in self.calls]
+
+    def _pending_chunks(self) -> list[list[Call]]:
+        pending = [call for call in self.calls if call.success is None]
+        if self._cacheable:
+            # Serve the reads already made at this block from the cache
+            uncached = []
+            for call in pending:
+                cached = self.call_cache.get(self.block_identifier, call)
+                if cached is None:
+                    uncached.append(call)
+                else:
+                    call._decode(*cached)
+            pending = uncached
+        return [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+
+    @property
+    def _cacheable(self) -> bool:
+        return self.call_cache is not None and isinstance(self.block_identifier, int)
+
+    def _set_results(self, chunk: list[Call], results: list) -> None:
+        for call, (success, return_data) in zip(chunk, results):
+            if self._cacheable:
+                self.call_cache.put(self.block_identifier, call, (success, return_data))
+            call._decode(success, return_data)
+
+
+class AsyncMulticall(Multicall):
+    """
+    Multicall executed over an asynchronous Web3 provider (see aio.get_async_web3_provider).
+    Chunks are sent concurrently, and the batch is used with "async with" or by awaiting execute().
+    """
+    def __init__(self, async_web3_provider: Web3, block_identifier: Union[str, int] = "latest",
+                 batch_size: int = MULTICALL_BATCH_SIZE):
+        """
+        :param async_web3_provider: The asynchronous Web3 object used to send the aggregated calls
+        :param block_identifier: The block at which every queued read is executed
+        :param batch_size: The maximum number of reads sent in a single eth_call
+        """
+        # Calls are encoded and decoded offline with the default provider's contract instances
+        super().__init__(avalanche_provider, block_identifier, batch_size)
+        self.async_web3_provider = async_web3_provider
+
+    def __enter__(self):
+        raise TypeError("AsyncMulticall must be used with 'async with'")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.execute()
+
+    async def execute(self) -> list:
+        await asyncio.gather(*[self._execute_chunk(chunk) for chunk in self._pending_chunks()])
+
+        return [call.result for call in self.calls]
+
+    async def _execute_chunk(self, chunk: list[Call]) -> None:
+        data = self.contract.encodeABI(fn_name="aggregate3", args=[[call._encode() for call in chunk]])
+        return_data = await self.async_web3_provider.eth.call({"to": self.contract.address, "data": data},
+                                                              self.block_identifier)
+        self._set_results(chunk, self.web3_provider.codec.decode_abi(["(bool,bytes)[]"], return_data)[0])
+
+
+def aggregate(function_calls: list[ContractFunction], block_identifier: Union[str, int] = "latest",
+              web3_provider: Web3 = None, call_cache: CallCache = None) -> list:
+    """
+    Read many contract functions in a single round trip
+
+    :param function_calls: List of uncalled contract methods
+    :param block_identifier: The block at which every read is executed
+    :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+    :param call_cache: (optional) Cache of read results at block numbers (see CallCache)
+    :return: The decoded results in the order of function_calls (raises ContractLogicError if any call reverted)
+    """
+    batch = Multicall(web3_provider, block_identifier, call_cache=call_cache)
+    for function_call in function_calls:
+        batch.add(function_call)
+    return batch.execute()
+
+
+def decode_revert_reason(return_data: bytes) -> Union[str, None]:
+    """Decode the message of a reverted call from its Error(string) payload, if there is one"""
+    if return_data[:4] != ERROR_STRING_SELECTOR:
+        return None
+    try:
+        return avalanche_provider.codec.decode_abi(["string"], return_data[4:])[0]
+    except Exception:
+        return None
@@ -1,31 +1,125 @@
-from os.path import join, abspath, dirname
+from typing import Callable, Iterable, Union
+from threading import Event, Lock
+import time
 
 from .util import ContractInstanceFunc, checksum
 from .resources.abi_reference import AggregatorOracle_ABI, ISafeOracle_ABI
 from .provider import avalanche_provider
+from .multicall import Multicall
+from .registry import get_token_registry
+from ._config import PRICE_CACHE_TTL, COINGECKO_API_URL, ORACLE_USD_REFERENCE
 
-import pandas as pd
 from pycoingecko import CoinGeckoAPI
 from web3 import Web3
+from web3.exceptions import ContractLogicError
 
 cg = CoinGeckoAPI()
+cg.api_base_url = COINGECKO_API_URL
 
 
-def get_token_price_cg(token_symbol: str):
-    """Get the realtime USD price of a token"""
-    path = join(abspath((dirname(__file__))), "resources", "token_metadata.csv")
-    id_df = pd.read_csv(path, index_col=0)
-    token_id = id_df['coingecko_id'].loc[token_symbol]
+class PriceService:
+    """
+    Realtime USD token prices from CoinGecko with a TTL cache.
+
+    Prices are cached per CoinGecko id, every uncached id in a get_prices() request is fetched in a single
+    CoinGecko call, and concurrent requests for an id that is already being fetched wait for that fetch
+    instead of sending their own (single-flight).
+    """
+    def __init__(self, ttl: float = PRICE_CACHE_TTL, coingecko: CoinGeckoAPI = None):
+        """
+        :param ttl: Seconds a fetched price is served from the cache (0 disables caching)
+        :param coingecko: The CoinGeckoAPI client used for requests (defaults to the module client)
+        """
+        self.ttl = ttl
+        self.coingecko = cg if coingecko is None else coingecko
+        self._prices: dict[str, tuple[float, float]] = {}  # coingecko_id -> (price_usd, fetched_at)
+        self._in_flight: dict[str, Event] = {}
+        self._lock = Lock()
 
-    return cg.get_price(ids=token_id, vs_currencies='usd')[token_id]['usd']
+    def get_price(self, token_symbol: str) -> float:
+        """Get the USD price of a token by its symbol in resources/token_metadata.csv"""
+        return self.get_prices([token_symbol])[token_symbol]
+
+    def get_prices(self, token_symbols: Iterable[str]) -> dict[str, float]:
+        """
+        Get the USD prices of many tokens with at most one CoinGecko request
+
+        :param token_symbols: Token symbols as in resources/token_metadata.csv
+        :return: dict of {symbol: price_usd}
+        """
+        registry = get_token_registry()
+        symbol_ids = {symbol: registry.coingecko_id(symbol) for symbol in token_symbols}
+        ids = set(symbol_ids.values())
+
+        # Claim the ids that nobody is fetching yet, and wait on the ones that are already in flight
+        now = time.monotonic()
+        to_fetch, to_wait = [], []
+        with self._lock:
+            for token_id in ids:
+                cached = self._prices.get(token_id)
+                if cached is not None and now - cached[1] < self.ttl:
+                    continue
+                if token_id in self._in_flight:
+                    to_wait.append(self._in_flight[token_id])
+                else:
+                    self._in_flight[token_id] = Event()
+                    to_fetch.append(token_id)
+
+        if len(to_fetch) > 0:
+            self._fetch(to_fetch)
+        for event in to_wait:
+            event.wait()
+
+        with self._lock:
+            prices = {token_id: self._prices.get(token_id) for token_id in ids}
+        missing = [token_id for token_id, cached in prices.items() if cached is None]
+        if len(missing) > 0:
+            raise KeyError(f"CoinGecko did not return a USD price for: {', '.join(missing)}")
+
+        return {symbol: prices[token_id][0] for symbol, token_id in symbol_ids.items()}
+
+    def invalidate(self, token_symbol: str = None) -> None:
+        """Drop the cached price for a token, or every cached price if no symbol is given"""
+        with self._lock:
+            if token_symbol is None:
+                self._prices.clear()
+            else:
+                self._prices.pop(get_token_registry().coingecko_id(token_symbol), None)
+
+    def _fetch(self, token_ids: list[str]) -> None:
+        try:
+            r = self.coingecko.get_price(ids=','.join(token_ids), vs_currencies='usd')
+            fetched_at = time.monotonic()
+            with self._lock:
+                for token_id in token_ids:
+                    if 'usd' in r.get(token_id, {}):
+                        self._prices[token_id] = r[token_id]['usd'], fetched_at
+        finally:
+            with self._lock:
+                for token_id in token_ids:
+                    self._in_flight.pop(token_id).set()
+
+
+price_service = PriceService()
+
+
+def get_token_price_cg(token_symbol: str):
+    """Get the realtime USD price of a token (cached for _config.PRICE_CACHE_TTL seconds)"""
+    return price_service.get_price(token_symbol)
 
 
 class AvalancheAggOracle:
-    def __init__(self):
-        self.contract = ContractInstanceFunc(avalanche_provider, AggregatorOracle_ABI[0], AggregatorOracle_ABI[1])
+    def __init__(self, web3_provider: Web3 = None):
+        """
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        """
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.contract = ContractInstanceFunc(self.web3_provider, AggregatorOracle_ABI[0], AggregatorOracle_ABI[1])
 
-    def get_token_price(self, token_address: str, token_decimals: int) -> tuple[float, float]:
+    def get_token_price(self, token_address: str, token_decimals: int,
+                        block_identifier: Union[str, int] = "latest") -> tuple[float, float]:
         """
+        :param block_identifier: The block to read the price at (see get_prices_at() for the USD conversion)
         :return: tuple
             - price in AVAX
             - price in USD
@@ -33,19 +127,25 @@ class AvalancheAggOracle:
         @dev-note
         The token price will always be returned from the contract in the network native token (AVAX in this case)
         """
-        price_u112 = self.contract.functions.getETHPx(checksum(token_address)).call()
+        price_u112 = self.contract.functions.getETHPx(checksum(token_address)).call(block_identifier=block_identifier)
         price_avax = price_u112 / 2 ** 112 / 10 ** (18 - token_decimals)
-        price_usd = price_avax * get_token_price_cg("WAVAX")
+        price_usd = price_avax * get_prices_at(["WAVAX"], block_identifier, self.web3_provider)["WAVAX"]
         return price_avax, price_usd
 
 
 class AvalancheSafeOracle:
-    def __init__(self):
-        self.contract = ContractInstanceFunc(avalanche_provider, ISafeOracle_ABI[0], ISafeOracle_ABI[1])
-        self.agg_oracle = AvalancheAggOracle()
+    def __init__(self, web3_provider: Web3 = None):
+        """
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        """
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.contract = ContractInstanceFunc(self.web3_provider, ISafeOracle_ABI[0], ISafeOracle_ABI[1])
+        self.agg_oracle = AvalancheAggOracle(self.web3_provider)
 
-    def get_token_price(self, token_address: str, token_decimals: int) -> tuple[float, float]:
+    def get_token_price(self, token_address: str, token_decimals: int,
+                        block_identifier: Union[str, int] = "latest") -> tuple[float, float]:
         """
+        :param block_identifier: The block to read the price at (see get_prices_at() for the USD conversion)
         :return: tuple
             - price in AVAX
             - price in USD
@@ -54,12 +154,98 @@ class AvalancheSafeOracle:
         The token price will always be returned from the contract in the network native token (AVAX in this case)
         """
         try:
-            price_u112 = self.contract.functions.getSafeETHPx(checksum(token_address)).call()[0]
+            price_u112 = self.contract.functions.getSafeETHPx(checksum(token_address)).call(
+                block_identifier=block_identifier)[0]
             price_avax = price_u112 / 2 ** 112 / 10 ** (18 - token_decimals)
-            price_usd = price_avax * get_token_price_cg("WAVAX")
+            price_usd = price_avax * get_prices_at(["WAVAX"], block_identifier, self.web3_provider)["WAVAX"]
             return price_avax, price_usd
         except:
             # Revert to aggregate
-            return self.agg_oracle.get_token_price(token_address, token_decimals)
+            return self.agg_oracle.get_token_price(token_address, token_decimals, block_identifier)
+
+    def prepare_token_price(self, batch: Multicall, token_address: str) -> Callable[[int], tuple[float, float]]:
+        """
+        Queue the safe and aggregate oracle reads for a token on a Multicall batch
 
+        :return: A function that takes the token decimals (and optionally the USD price of WAVAX, fetched from
+                 CoinGecko if not given) and, once the batch has been executed, returns the tuple:
+            - price in AVAX
+            - price in USD
+        """
+        safe_price = batch.add(self.contract.functions.getSafeETHPx(checksum(token_address)), allow_failure=True)
+        agg_price = batch.add(self.agg_oracle.contract.functions.getETHPx(checksum(token_address)), allow_failure=True)
+
+        def token_price(token_decimals: int, wavax_price_usd: float = None) -> tuple[float, float]:
+            # Revert to aggregate if the safe oracle call failed
+            if safe_price.success:
+                price_u112 = safe_price.result[0]
+            elif agg_price.success:
+                price_u112 = agg_price.result
+            else:
+                raise ContractLogicError(f"Could not get an oracle price for token {token_address}")
+            price_avax = price_u112 / 2 ** 112 / 10 ** (18 - token_decimals)
+            price_usd = price_avax * (get_token_price_cg("WAVAX") if wavax_price_usd is None else wavax_price_usd)
+            return price_avax, price_usd
 
+        return token_price
+
+
+def prepare_oracle_prices(batch: Multicall, token_symbols: Iterable[str]) -> Callable[[], dict[str, float]]:
+    """
+    Queue the oracle reads that price tokens in USD at the batch's block
+
+    The oracles price tokens in AVAX; AVAX is converted to USD with the oracle price of the reference stablecoin
+    (_config.ORACLE_USD_REFERENCE, assumed to be worth 1 USD).
+
+    :param token_symbols: Token symbols as in resources/token_metadata.csv ("AVAX" is priced as WAVAX)
+    :return: A function returning {symbol: price_usd} once the batch has been executed, with NaN for the tokens
+             that neither oracle prices at that block
+    """
+    registry = get_token_registry()
+    oracle = AvalancheSafeOracle(batch.web3_provider)
+    reference = registry.by_symbol(ORACLE_USD_REFERENCE)
+    reference_price = oracle.prepare_token_price(batch, reference['address'])
+    token_prices = {}
+    for symbol in set(token_symbols):
+        token = registry.by_symbol("WAVAX" if symbol == "AVAX" else symbol)
+        token_prices[symbol] = int(token['precision']), oracle.prepare_token_price(batch, token['address'])
+
+    def oracle_prices() -> dict[str, float]:
+        avax_price_usd = 1 / reference_price(int(reference['precision']), 1.0)[0]
+        prices = {}
+        for symbol, (decimals, token_price) in token_prices.items():
+            try:
+                prices[symbol] = token_price(decimals, avax_price_usd)[1]
+            except ContractLogicError:
+                prices[symbol] = float("nan")
+        return prices
+
+    return oracle_prices
+
+
+def prepare_prices(batch: Multicall, token_symbols: Iterable[str]) -> Callable[[], dict[str, float]]:
+    """
+    Queue the USD prices of tokens at the batch's block: CoinGecko prices (cached, see PriceService) at "latest",
+    oracle prices (see prepare_oracle_prices()) at any other block, as CoinGecko has no block-level history
+
+    :return: A function returning {symbol: price_usd} once the batch has been executed
+    """
+    if batch.block_identifier == "latest":
+        token_symbols = list(token_symbols)
+        return lambda: price_service.get_prices(token_symbols)
+    return prepare_oracle_prices(batch, token_symbols)
+
+
+def get_prices_at(token_symbols: Iterable[str], block_identifier: Union[str, int] = "latest",
+                  web3_provider: Web3 = None) -> dict[str, float]:
+    """
+    Get the USD prices of tokens at a block (see prepare_prices())
+
+    :param token_symbols: Token symbols as in resources/token_metadata.csv
+    :param block_identifier: The block to price the tokens at
+    :param web3_provider: (optional) The Web3 object the oracles are read with (defaults to the Avalanche provider)
+    :return: dict of {symbol: price_usd}
+    """
+    with Multicall(web3_provider, block_identifier) as batch:
+        prices = prepare_prices(batch, token_symbols)
+    return prices()
@@ -0,0 +1,67 @@
+from .registry import PoolRegistry, get_pool_registry
+from .session import http_session
+from ._config import HOMORA_POSITIONS_URL
+
+
+class PositionBook:
+    """
+    Fetches the Alpha Homora V2 positions list once and indexes it in memory, with the pools served by a
+    PoolRegistry (the process-wide one unless a pools list is given).
+
+    Pass the book to get_avax_positions_by_owner() (or a pool from get_pool() to AvalanchePosition) so that
+    constructing many positions costs one positions request (and the shared pools list) instead of two requests
+    per position.
+    """
+    def __init__(self, positions: list[dict] = None, pools: list[dict] = None):
+        """
+        :param positions: (optional) Pre-fetched positions list, as returned by the Homora positions endpoint
+        :param pools: (optional) Pre-fetched pools list, as returned by the Homora pools endpoint
+        """
+        self.positions = self.fetch_positions() if positions is None else positions
+        self.pool_registry = get_pool_registry() if pools is None else PoolRegistry(pools)
+
+        self._positions_by_id = {int(position['id']): position for position in self.positions}
+        self._positions_by_owner: dict[str, list[dict]] = {}
+        for position in self.positions:
+            self._positions_by_owner.setdefault(position['owner'].lower(), []).append(position)
+
+    @staticmethod
+    def fetch_positions() -> list[dict]:
+        r = http_session.get(HOMORA_POSITIONS_URL)
+        if r.status_code != 200:
+            raise Exception(f"Could not fetch positions: {r.status_code, r.text}")
+        return r.json()
+
+    @property
+    def pools(self) -> tuple[dict, ...]:
+        return self.pool_registry.pools
+
+    def get_position(self, position_id: int, owner_address: str = None) -> dict:
+        """
+        Returns the position matching the position ID (and owner wallet address, if given)
+
+        {id: int
+        owner: str
+        collateralSize: str (int)
+        pool: {key: str}
+        collateralCredit: str (int)
+        borrowCredit: str (int)
+        debtRatio: str (float)}
+        """
+        position = self._positions_by_id.get(int(position_id))
+        if position is None or (owner_address is not None and position['owner'].lower() != owner_address.lower()):
+            raise IndexError(f"Could not fetch pool for position_id {position_id} owned by {owner_address} "
+                             f"(If you just opened the position, please retry in a few minutes)")
+        return position
+
+    def get_positions_by_owner(self, owner_address: str) -> list[dict]:
+        """Returns every position held by the owner wallet address"""
+        return self._positions_by_owner.get(owner_address.lower(), [])
+
+    def get_pool(self, pool_key: str) -> dict:
+        """Returns the metadata for the pool matching the key"""
+        return self.pool_registry.get(pool_key)
+
+    def get_position_pool(self, position_id: int, owner_address: str = None) -> dict:
+        """Returns the metadata for the pool that the position is in"""
+        return self.get_pool(self.get_position(position_id, owner_address)['pool']['key'])
@@ -1,39 +1,60 @@
-from typing import Optional, Union, TypedDict
+from typing import Callable, Optional, Union, TypedDict
 from math import floor
 
 from .token import ARC20Token
 from .resources.abi_reference import *
 from .provider import avalanche_provider
 from .receipt import TransactionReceipt, build_receipt
-from .oracles import get_token_price_cg, AvalancheSafeOracle
+from .oracles import price_service, prepare_prices, AvalancheSafeOracle
 from .util import ContractInstanceFunc, get_token_info_from_ref, checksum
-from .spell import SpellClient, PangolinV2Client, TraderJoeClient
+from .registry import get_pool_registry
+from .spell import SpellClient, get_spell_client
+from .multicall import Multicall
+from .rpc_batch import RPCBatch
+from .portfolio import PositionBook
+from .indexer import PositionIndexer
+from .snapshot import PositionSnapshot, take_snapshot
+from .rewards import reward_engine
+from .transactions import TransactionManager, PendingTransaction, get_transaction_manager
+from .simulation import SimulationResult, gas_cache, simulate_execute, spell_call_shape, spell_function_name
+from .approvals import approval_planner
+from .session import http_session
+from ._config import HOMORA_POSITIONS_URL, HOMORA_APYS_URL, HOMORA_TOKENS_URL, CREAM_RATES_URL, EXECUTE_GAS_LIMIT
 
-import requests
 from web3 import Web3
 # from web3.constants import MAX_INT
 from web3.contract import ContractFunction
-from web3.exceptions import ContractLogicError
 
 
 class AvalanchePosition:
-    def __init__(self, position_id: int, owner_wallet_address: str, owner_private_key: str = None):
+    def __init__(self, position_id: int, owner_wallet_address: str, owner_private_key: str = None,
+                 pool: dict = None, web3_provider: Web3 = None):
         """
         :param position_id: The Alpha Homora V2 position ID
         :param owner_wallet_address: The wallet address of the position owner
         :param owner_private_key: The private key of the position owner's wallet (for transaction signing)
+        :param pool: (optional) The pre-resolved pool metadata for the position (see portfolio.PositionBook),
+                     skips fetching the positions and pools lists from the Alpha Homora V2 API
+        :param web3_provider: (optional) The Web3 object used for the position's contracts, tokens, spell client,
+                              oracles and transactions, e.g. get_web3_provider([rpc_url, ...]) for a pool of RPC
+                              endpoints (defaults to the Avalanche provider)
         """
 
         self.pos_id = position_id
         self.owner = owner_wallet_address
         self.private_key = owner_private_key
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
 
-        self._homora_bank = ContractInstanceFunc(web3_provider=avalanche_provider,
+        self._homora_bank = ContractInstanceFunc(web3_provider=self.web3_provider,
                                                  json_abi_file=HomoraBank_ABI[0],
                                                  contract_address=HomoraBank_ABI[1])
 
-        self.pool_key = self._get_position()['pool']['key']
-        self.pool = self._get_pool_info()
+        if pool is None:
+            self.pool_key = self._get_position()['pool']['key']
+            self.pool = self._get_pool_info()
+        else:
+            self.pool_key = pool['key']
+            self.pool = pool
         self.symbol = self.pool['name']
         self.dex = self.pool['exchange']['name']
 
@@ -43,14 +64,15 @@ class AvalanchePosition:
         except KeyError:
             self.spell_address = checksum(self._platform.spell_contract.address)
 
-        self._oracle = AvalancheSafeOracle()
+        self._oracle = AvalancheSafeOracle(self.web3_provider)
 
     """ -------------------- TRANSACTIONAL METHODS: -------------------- """
     
     def add(self,
             tokenA_data: tuple[ARC20Token, float, float] = None,
             tokenB_data: tuple[ARC20Token, float, float] = None,
-            tokenLP_data: tuple[ARC20Token, float, float] = None) -> TransactionReceipt:
+            tokenLP_data: tuple[ARC20Token, float, float] = None,
+            dry_run: bool = False) -> Union[TransactionReceipt, SimulationResult]:
         """
         Add liquidity to the position
 
@@ -62,10 +84,13 @@ class AvalanchePosition:
                             (ARC20Token, supply_amount, borrow_amount)
         :param tokenLP_data: The LP token if supplying, supply amount, and borrow amount (optional)
                              (ARC20Token object, supply_amount, borrow_amount)
-                             
-        :return: TransactionReceipt object
+        :param dry_run: Simulate the transaction at the latest block instead of sending it (no approvals are sent)
+
+        :return: TransactionReceipt object of the execute, with the receipts of the token approvals sent before it in
+                 its approvals attribute (SimulationResult if dry_run)
         """
-        self._has_private_key()
+        if not dry_run:
+            self._has_private_key()
 
         assert not all(v is None for v in [tokenA_data, tokenB_data, tokenLP_data]), "Must provide least one pool token"
 
@@ -89,25 +114,39 @@ class AvalanchePosition:
                                                                   tokenA_data=tokenA_data,
                                                                   tokenB_data=tokenB_data,
                                                                   tokenLP_data=tokenLP_data)
-        encoded_bank_func = self._homora_bank.functions.execute(self.pos_id, self.spell_address, encoded_spell_func)
 
-        # Approve supply amounts
-        for data in [tokenA_data, tokenB_data, tokenLP_data]:
-            if data[1] > 0:
-                # Ensure that the user holds the required amount of tokens, or a SafeERC20 low-level call will fail
-                assert data[0].balanceOf(self.owner) >= data[1], \
-                    f"Insufficient funds to supply {data[1] / (10 ** data[0].decimals())} {data[0].symbol()}"
+        # Approve the supplied tokens whose allowance does not cover the amount (see approvals.ApprovalPlanner).
+        # The approvals and the execute are broadcast back-to-back with consecutive nonces and mined together, so the
+        # execute gas estimate reverts for lack of allowance while approvals are pending (any other revert is raised)
+        supplied = [(data[0], data[1]) for data in [tokenA_data, tokenB_data, tokenLP_data]]
+        to_approve = approval_planner.plan(self.owner, HomoraBank_ABI[1], supplied, self.web3_provider)
+        if dry_run:
+            return simulate_execute(self, encoded_spell_func, [token.address for token in to_approve])
 
-                approval_txn = self._sign_and_send(data[0].prepare_approve(HomoraBank_ABI[1]))
-                print(f"Approved {data[0].symbol()}: {approval_txn}")
+        manager = self._transaction_manager
+        approvals = [(token, manager.send(token.prepare_approve(HomoraBank_ABI[1]))) for token in to_approve]
 
         # Sign and send add liquidity transaction
-        return self._sign_and_send(encoded_bank_func)
+        pending_execute = self._send_execute(encoded_spell_func, gas_limit=EXECUTE_GAS_LIMIT if approvals else None)
+        receipts = manager.wait_all([pending for _, pending in approvals] + [pending_execute])
+
+        for (token, _), receipt in zip(approvals, receipts):
+            if receipt['status'] == 1:
+                approval_planner.record_approval(self.owner, token.address, HomoraBank_ABI[1],
+                                                 receipt['blockNumber'])
+        if receipts[-1]['status'] == 1:
+            for token, amount in supplied:
+                approval_planner.record_spend(self.owner, token.address, HomoraBank_ABI[1], amount,
+                                              receipts[-1]['blockNumber'])
+
+        receipt = build_receipt(receipts[-1])
+        receipt.approvals = [build_receipt(approval_receipt) for approval_receipt in receipts[:-1]]
+        return receipt
 
     def remove(self, pct_position_size: float,
                tokenA_data: tuple[ARC20Token, float] = None,
                tokenB_data: tuple[ARC20Token, float] = None,
-               amount_lp_withdraw: int = 0) -> TransactionReceipt:
+               amount_lp_withdraw: int = 0, dry_run: bool = False) -> Union[TransactionReceipt, SimulationResult]:
         """
         Remove liquidity from the pool.
         If both tokenA and tokenB data are left as None, no debt will be repaid.
@@ -118,154 +157,148 @@ class AvalanchePosition:
         :param tokenB_data: The second underlying (or native) token in the pool, and the percentage of this token debt to repay (e.g. 0.50 = 50% of USDC debt)
                             (ARC20Token, pct_amount_repay) (optional)
         :param amount_lp_withdraw: (Advanced) The amount of LP token to withdraw
-        
-        :return: TransactionReceipt object
+        :param dry_run: Simulate the transaction at the latest block instead of sending it
+
+        :return: TransactionReceipt object (SimulationResult if dry_run)
         """
-        self._has_private_key()
+        if not dry_run:
+            self._has_private_key()
 
         assert 0.0 < pct_position_size <= 1.0, "pct_position_size must be a float (percentage) of 0.0 - 1.0"
 
-        position_amount = floor(self._get_position_info()[-1] * pct_position_size)
+        # Read the position size and the required token debts in a single call
+        with self.batch() as batch:
+            position_info = batch.add(self._homora_bank.functions.getPositionInfo(self.pos_id))
+            debts = [batch.add(self._homora_bank.functions.borrowBalanceCurrent(self.pos_id, checksum(data[0].address)))
+                     for data in [tokenA_data, tokenB_data] if data is not None]
+
+        position_amount = floor(position_info.result[-1] * pct_position_size)
 
         pool_tokens = self.get_pool_tokens()
         if tokenA_data is None:
             tokenA_data = pool_tokens['tokenA'], 0
         else:
-            debt = self.get_token_borrow_balance(tokenA_data[0].address)
-            tokenA_data = tokenA_data[0], floor(debt * tokenA_data[1])
+            tokenA_data = tokenA_data[0], floor(debts.pop(0).result * tokenA_data[1])
 
         if tokenB_data is None:
             tokenB_data = pool_tokens['tokenB'], 0
         else:
-            # debt = list(filter(lambda t: t[0].address == tokenB_data[0].address, self.get_token_debts()))[0][1]
-            debt = self.get_token_borrow_balance(tokenB_data[0].address)
-            tokenB_data = tokenB_data[0], floor(debt * tokenB_data[1])
+            tokenB_data = tokenB_data[0], floor(debts.pop(0).result * tokenB_data[1])
 
         encoded_spell_func = self._platform.prepare_remove_liquidity(amt_position_remove=position_amount,
                                                                      tokenA_data=tokenA_data, tokenB_data=tokenB_data,
                                                                      amt_lp_withdraw=amount_lp_withdraw)
-        encoded_bank_func = self._homora_bank.functions.execute(self.pos_id, self.spell_address, encoded_spell_func)
 
-        # Sign and send add liquidity transaction
-        return self._sign_and_send(encoded_bank_func)
+        # Sign and send remove liquidity transaction
+        return self._execute(encoded_spell_func, dry_run)
 
-    def close(self) -> TransactionReceipt:
+    def close(self, dry_run: bool = False) -> Union[TransactionReceipt, SimulationResult]:
         """
         Close the position if it is open
 
-        :return: TransactionReceipt object
+        :param dry_run: Simulate the transaction at the latest block instead of sending it
+
+        :return: TransactionReceipt object (SimulationResult if dry_run)
         """
-        self._has_private_key()
+        if not dry_run:
+            self._has_private_key()
 
-        underlying_tokens = self.pool['tokens']
+        underlying_tokens = [Web3.toChecksumAddress(address) for address in self.pool['tokens']]
 
-        underlying_tokens_data = list(zip([Web3.toChecksumAddress(address) for address in underlying_tokens],
-                                          [self.get_token_borrow_balance(address) for address in underlying_tokens]))
+        with self.batch() as batch:
+            borrow_balances = [batch.add(self._homora_bank.functions.borrowBalanceCurrent(self.pos_id, address))
+                               for address in underlying_tokens]
+            position_info = batch.add(self._homora_bank.functions.getPositionInfo(self.pos_id))
+            # In the even that there is no LP token owed, the call will revert
+            lp_balance = batch.add(self._homora_bank.functions.borrowBalanceCurrent(
+                self.pos_id, checksum(self.pool['lpTokenAddress'])), allow_failure=True, default=0)
 
-        position_size = self._get_position_info()[-1]
-
-        try:
-            lp_balance = self.get_token_borrow_balance(self.pool['lpTokenAddress'])
-        except ContractLogicError:
-            # In the even that there is no LP token owed, a ContractLogicError will be raised
-            lp_balance = 0
+        underlying_tokens_data = list(zip(underlying_tokens, [balance.result for balance in borrow_balances]))
+        position_size = position_info.result[-1]
+        lp_balance = lp_balance.result
 
         encoded_spell_func = self._platform.prepare_close_position(underlying_tokens_data, position_size,
                                                                    amtLPRepay=lp_balance)
 
-        encoded_bank_func = self._homora_bank.functions.execute(self.pos_id, self.spell_address, encoded_spell_func)
-
-        return self._sign_and_send(encoded_bank_func)
+        return self._execute(encoded_spell_func, dry_run)
 
-    def harvest(self) -> Union[TransactionReceipt, None]:
+    def harvest(self, dry_run: bool = False) -> Union[TransactionReceipt, SimulationResult, None]:
         """
         Harvests available position rewards
 
+        :param dry_run: Simulate the transaction at the latest block instead of sending it
+
         Returns:
             if there are rewards to harvest:
-                - TransactionReceipt object
+                - TransactionReceipt object (SimulationResult if dry_run)
             else:
                 - None
         """
-        self._has_private_key()
+        if not dry_run:
+            self._has_private_key()
 
         # Prevent needless gas spending
         if self.get_rewards_value()['reward_token'] == 0:
             return None
 
-        encoded_spell_func = self._platform.prepare_claim_all_rewards()
-        encoded_bank_func = self._homora_bank.functions.execute(self.pos_id, self.spell_address, encoded_spell_func)
-
-        return self._sign_and_send(encoded_bank_func)
+        return self._execute(self._platform.prepare_claim_all_rewards(), dry_run)
 
     """ -------------------- INFORMATIONAL METHODS: -------------------- """
     
-    def get_rewards_value(self) -> dict:  # tuple[float, float, str, str]
+    def get_rewards_value(self, block_identifier: Union[str, int] = "latest") -> dict:  # tuple[float, float, str, str]
         """
         Get the amount of outstanding yield farming rewards in the position.
 
+        :param block_identifier: The block to read the rewards at (USD prices at a past block come from the oracles,
+                                 see oracles.prepare_prices())
         :return:
             - reward_token (float) (in the native reward token)
             - reward_usd (float) (in USD)
             - reward_token_address (str)
             - reward_token_symbol (str)
         """
-        owner, coll_token, coll_id, collateral_size = self._get_position_info()
-        pool_info = self._platform.get_pool_info(coll_id)
-        start_reward_per_share = pool_info['entryRewardPerShare']
-        end_reward_per_share = pool_info['accRewardPerShare']
+        position_info = self._get_position_info(block_identifier)
+        with self.batch(block_identifier) as batch:
+            rewards_value = self.prepare_rewards_value(batch, position_info)
+            prices = prepare_prices(batch, [self.reward_token_symbol])
 
-        if self.dex == "Trader Joe":
-            if self.pool['wTokenType'].startswith("WMasterChef"):
-                precision = 10 ** 12
-                reward_amount = collateral_size * (end_reward_per_share - start_reward_per_share) // precision
-            else:  # Accounts for BoostedMasterChef positions
-                wrapper_token_per_share = pool_info['wrapper_token_per_share']
-                lp_amt = pool_info['lpAmt']
-                reward_debt = pool_info['rewardDebt']
-                precision = 10 ** 18
-
-                extra_reward_per_share = end_reward_per_share - (reward_debt * precision // lp_amt)
-                end_token_per_share = wrapper_token_per_share + extra_reward_per_share
-                reward_amount = (collateral_size * (end_token_per_share - start_reward_per_share) // precision) / precision
-        else:
-            # entryRewardPerShare = pool_info['entryRewardPerShare'] / 1e18
-            # accRewardPerShare = pool_info['accRewardPerShare'] / 1e18
-            reward_amount = collateral_size * ((end_reward_per_share / 1e18) - (start_reward_per_share / 1e18)) / 1e12
+        return rewards_value(prices()[self.reward_token_symbol])
 
-        reward_token_symbol, reward_token_address = [v for k, v in self._get_pool_info()["exchange"]["reward"].items()]
-        reward_usd = reward_amount * get_token_price_cg(reward_token_symbol)
-
-        return {"reward_token": reward_amount, "reward_usd": reward_usd, "reward_token_address": reward_token_address,
-                "reward_token_symbol": reward_token_symbol}
+    def get_projected_rewards_value(self, timestamp: float = None) -> dict:
+        """
+        Project the outstanding yield farming rewards from cached pool state (see rewards.RewardEngine), which
+        costs no RPC until the pool is resynced.
 
-    def get_debt_ratio(self) -> float:
-        """Return the position's debt ratio percentage in decimal form (10% = 0.10)"""
+        :param timestamp: (optional) Unix timestamp to project the rewards at (defaults to now)
+        :return: Same output as get_rewards_value()
+        """
+        return reward_engine.get_rewards_value(self, timestamp)
 
-        collateral_credit = self._homora_bank.functions.getCollateralETHValue(self.pos_id).call()
-        borrow_credit = self._homora_bank.functions.getBorrowETHValue(self.pos_id).call()
+    def get_debt_ratio(self, block_identifier: Union[str, int] = "latest") -> float:
+        """
+        Return the position's debt ratio percentage in decimal form (10% = 0.10)
 
-        try:
-            return borrow_credit / collateral_credit
-        except ZeroDivisionError:
-            return 0.0
+        :param block_identifier: The block to read the debt ratio at
+        """
+        with self.batch(block_identifier) as batch:
+            debt_ratio = self.prepare_debt_ratio(batch)
 
-    def get_leverage_ratio(self) -> float:
-        """Return the position's leverage ratio"""
-        position_values = self.get_position_value()
+        return debt_ratio()
 
-        coll_value = position_values['position_usd']
-        debt_value = position_values['debt_usd']
+    def get_leverage_ratio(self, block_identifier: Union[str, int] = "latest") -> float:
+        """
+        Return the position's leverage ratio
 
-        try:
-            return coll_value / (coll_value - debt_value)
-        except ZeroDivisionError:
-            return 0.0
+        :param block_identifier: The block to read the position value at
+        """
+        return self.leverage_from_value(self.get_position_value(block_identifier))
 
-    def get_current_apy(self) -> dict:
+    def get_current_apy(self, block_identifier: Union[str, int] = "latest") -> dict:
         """
         Return the current APY for the position with APY source breakdowns.
 
+        :param block_identifier: The block to read the position's leverage, debts and the HomoraBank fee at (the pool
+                                 APYs and CREAM borrow rates are always the current ones, their APIs have no history)
         :return: (dict)
             - APY (float) - The current aggregate APY (farming APY + trading APY - borrow APY)
             - farmingAPY (float)
@@ -273,38 +306,22 @@ class AvalanchePosition:
             - borrowAPY (-float)
         """
         try:
-            r = requests.get(f"https://api.homora.alphaventuredao.io/v2/{self._platform.network_chain_id}/apys")
+            r = http_session.get(HOMORA_APYS_URL.format(chain_id=self._platform.network_chain_id))
             if r.status_code != 200:
                 raise Exception(f"{r.status_code}, {r.text}")
             apy_data = r.json()[self.pool_key]
 
-            leverage = self.get_leverage_ratio()
+            leverage = self.get_leverage_ratio(block_identifier)
 
             # Calculate Borrow APY:
             CREAM_borrow_rates = self.get_cream_borrow_rates()  # Get all CREAM borrow rates
-            homora_fee = self._homora_bank.functions.feeBps().call() / 10000  # Get current Homora Fee
-
-            agg_adj_borrow_apy = 0
-
-            token_debts_data = self.get_token_debts()
-            total_debt_usd = sum([tok[-1] for tok in token_debts_data])
-            for arc20_token, debt_tok_wei, debt_tok, debt_USD in token_debts_data:
-                symbol = arc20_token.symbol()
-                cream_apy = float(list(filter(lambda t: t['tokenSymbol'] == symbol, CREAM_borrow_rates))[0]['apy']) * 100
-                leverage_adjusted_apy = (leverage - 1) * (cream_apy * (1 + homora_fee))
-                agg_adj_borrow_apy += leverage_adjusted_apy * (debt_USD / total_debt_usd)  # Adjust for token debt weight of total debt
+            token_debts_data = self.get_token_debts(block_identifier=block_identifier)
+            with self.batch(block_identifier) as batch:
+                fee_bps = batch.add(self._homora_bank.functions.feeBps())  # Get current Homora Fee
+                symbols = [batch.add(arc20_token.contract.functions.symbol()) for arc20_token, *_ in token_debts_data]
 
-            # Pull trading and farming APYs from API and adjust for leverage
-            adj_tradingFeeAPY = leverage * float(apy_data['tradingFeeAPY'])
-            adj_farmingAPY = leverage * float(apy_data['farmingAPY'])
-
-            # Calculate aggregate APY
-            aggregate_apy = adj_tradingFeeAPY + adj_farmingAPY + -agg_adj_borrow_apy
-
-            return {"APY": aggregate_apy,
-                    "tradingFeeAPY": adj_tradingFeeAPY,
-                    "farmingAPY": adj_farmingAPY,
-                    "borrowAPY": -agg_adj_borrow_apy}
+            return self.apy_from_state(apy_data, leverage, CREAM_borrow_rates, fee_bps.result,
+                                       [(symbol.result, debt[-1]) for symbol, debt in zip(symbols, token_debts_data)])
         except Exception as exc:
             raise Exception(f"Could not get current APY for position: {exc}")
 
@@ -315,13 +332,16 @@ class AvalanchePosition:
         tokenLP: ARC20Token
     def get_pool_tokens(self) -> PoolTokens:
         """Returns the underlying and LP tokens from the pool"""
-        underlying = [ARC20Token(address) for address in self.pool['tokens']]
-        return {"tokenA": underlying[0], "tokenB": underlying[1], "tokenLP": ARC20Token(self.pool['lpTokenAddress'])}
+        underlying = [ARC20Token(address, self.web3_provider) for address in self.pool['tokens']]
+        return {"tokenA": underlying[0], "tokenB": underlying[1],
+                "tokenLP": ARC20Token(self.pool['lpTokenAddress'], self.web3_provider)}
 
-    def get_position_value(self) -> dict:
+    def get_position_value(self, block_identifier: Union[str, int] = "latest") -> dict:
         """
         Get equity, debt, and total position value in AVAX and USD.
 
+        :param block_identifier: The block to read the position at (USD prices at a past block come from the oracles,
+                                 see oracles.prepare_prices())
         :return: (tuple)
             - equity_avax (float)
             - equity_usd (float)
@@ -330,36 +350,182 @@ class AvalanchePosition:
             - position_avax (float)
             - position_usd (float)
         """
-        # Get pool info & underlying token metadata
-        pool_info = self._get_pool_info()
-        underlying_token_data = [get_token_info_from_ref(token) for token in self._get_pool_info()['tokens']]
+        # Get token pair liquidity pool data and the position's token debts in a single call, and the AVAX and
+        # underlying token prices in a single request:
+        with self.batch(block_identifier) as batch:
+            position_value = self.prepare_position_value(batch)
+            prices = prepare_prices(batch, self.price_symbols)
+
+        return position_value(prices())
+
+    def get_token_debts(self, address: str = None,
+                        block_identifier: Union[str, int] = "latest") -> list[tuple[ARC20Token, int, float, float]]:
+        """
+        Returns the debt amount per token for the position.
+        
+        :param address: (str) Optional address to get debt for a specific token
+        :param block_identifier: The block to read the debts at
+
+        :return: list of tuples containing:
+            - ARC20Token object
+            - debt in integer
+            - debt in token
+            - debt in USD
+        """
+        r = self._homora_bank.functions.getPositionDebts(self.pos_id).call(block_identifier=block_identifier)
+        if len(r) == 0:
+            return r
+
+        # Read every token's decimals and oracle price in a single call
+        with self.batch(block_identifier) as batch:
+            token_debts = self.prepare_token_debts(batch, r, address)
+            prices = prepare_prices(batch, ["WAVAX"])
+
+        return token_debts(prices()["WAVAX"])
+
+    """ -------------------- BATCHED READS: -------------------- """
+
+    # The prepare_* methods queue the contract reads behind an informational method on a Multicall batch and return
+    # a function that computes the result once the batch has been executed. Queue several of them on one batch
+    # (e.g. across positions) to read everything in a single round trip.
+
+    @property
+    def underlying_token_data(self) -> list:
+        """Token metadata rows (resources/token_metadata.csv) for the pool's underlying tokens"""
+        return [get_token_info_from_ref(token) for token in self.pool['tokens']]
+
+    @property
+    def price_symbols(self) -> list[str]:
+        """Symbols of the USD prices required by prepare_position_value()"""
+        return ["AVAX"] + [token["symbol"] for token in self.underlying_token_data]
+
+    @property
+    def reward_token_symbol(self) -> str:
+        return self.pool["exchange"]["reward"]["tokenName"]
+
+    def prepare_position_value(self, batch: Multicall) -> Callable[[dict], dict]:
+        """
+        Queue the reads for get_position_value()
+
+        :return: A function taking the USD prices for price_symbols ({symbol: price}) that returns the
+                 get_position_value() dict once the batch has been executed
+        """
+        underlying_token_data = self.underlying_token_data
+        pool_instance = self._platform.get_lp_contract(self.pool['lpTokenAddress'])
+
+        position_info = batch.add(self._homora_bank.functions.getPositionInfo(self.pos_id))
+        reserves = batch.add(pool_instance.functions.getReserves())
+        supply = batch.add(pool_instance.functions.totalSupply())
+        borrow_balances = [batch.add(self._homora_bank.functions.borrowBalanceCurrent(
+            self.pos_id, Web3.toChecksumAddress(token['address']))) for token in underlying_token_data]
+
+        def position_value(prices: dict) -> dict:
+            return self.value_from_state(underlying_token_data, prices, position_info.result[-1],
+                                         reserves.result[:2], supply.result,
+                                         [balance.result for balance in borrow_balances])
+
+        return position_value
+
+    def prepare_rewards_value(self, batch: Multicall, position_info: list) -> Callable[[float], dict]:
+        """
+        Queue the reads for get_rewards_value()
+
+        :param position_info: The position's HomoraBank.getPositionInfo() result (holds the collateral id and size)
+        :return: A function taking the USD price of the reward token that returns the get_rewards_value() dict
+                 once the batch has been executed
+        """
+        owner, coll_token, coll_id, collateral_size = position_info
+        pool_info = self._platform.prepare_pool_info(batch, coll_id)
+
+        def rewards_value(reward_price_usd: float) -> dict:
+            reward_amount = self.reward_amount_from_state(pool_info(), collateral_size)
+            reward_token_symbol, reward_token_address = [v for k, v in self.pool["exchange"]["reward"].items()]
+            return {"reward_token": reward_amount, "reward_usd": reward_amount * reward_price_usd,
+                    "reward_token_address": reward_token_address, "reward_token_symbol": reward_token_symbol}
+
+        return rewards_value
+
+    def prepare_debt_ratio(self, batch: Multicall) -> Callable[[], float]:
+        """
+        Queue the reads for get_debt_ratio()
+
+        :return: A function returning the debt ratio once the batch has been executed
+        """
+        collateral_credit = batch.add(self._homora_bank.functions.getCollateralETHValue(self.pos_id))
+        borrow_credit = batch.add(self._homora_bank.functions.getBorrowETHValue(self.pos_id))
+
+        def debt_ratio() -> float:
+            try:
+                return borrow_credit.result / collateral_credit.result
+            except ZeroDivisionError:
+                return 0.0
+
+        return debt_ratio
+
+    def prepare_token_debts(self, batch: Multicall, position_debts: list,
+                            address: str = None) -> Callable[..., list]:
+        """
+        Queue the reads for get_token_debts()
+
+        :param position_debts: The position's HomoraBank.getPositionDebts() result (tokens, debts)
+        :param address: (str) Optional address to get debt for a specific token
+        :return: A function returning the get_token_debts() list once the batch has been executed, optionally
+                 taking the USD price of WAVAX used to convert the oracle prices (fetched if not given)
+        """
+        debts = [(self.get_token(token, web3_provider=self.web3_provider), debt)
+                 for token, debt in zip(position_debts[0], position_debts[1])
+                 if address is None or address.lower() == token.lower()]
+
+        decimals = [batch.add(arc20_token.contract.functions.decimals()) for arc20_token, _ in debts]
+        prices = [self._oracle.prepare_token_price(batch, arc20_token.address) for arc20_token, _ in debts]
+
+        def token_debts(wavax_price_usd: float = None) -> list:
+            debt_output = []
+            for (arc20_token, debt), token_decimals, token_price in zip(debts, decimals, prices):
+                debt_token = debt / 10 ** token_decimals.result
+                try:
+                    debt_usd = debt_token * token_price(token_decimals.result, wavax_price_usd)[1]
+                except Exception as exc:
+                    print(f"Could not get debt in USD for token {arc20_token.address} - {exc}")
+                    debt_usd = 0
+                debt_output.append((arc20_token, debt, debt_token, debt_usd))
+
+            if len(debt_output) == 0:
+                raise ValueError("Could not find a debt token matching the address: {}".format(address))
 
-        # Get AVAX price once since operation is heavily reliant on this value
-        avax_price = get_token_price_cg("AVAX")
+            return debt_output
 
-        # Get token pair liquidity pool data:
-        pool_instance = self._platform.get_lp_contract(pool_info['lpTokenAddress'])
-        collateral_size = self._get_position_info()[-1]
-        r0, r1, last_block_time = pool_instance.functions.getReserves().call()
-        supply = pool_instance.functions.totalSupply().call()
+        return token_debts
+
+    @staticmethod
+    def value_from_state(underlying_token_data: list, prices: dict, collateral_size: int, reserves: list,
+                         supply: int, borrow_balances: list) -> dict:
+        """
+        Compute the get_position_value() dict from raw position state
+
+        :param underlying_token_data: Token metadata rows for the pool's underlying tokens
+        :param prices: USD prices by symbol, including "AVAX"
+        :param collateral_size: The position's collateral (LP) size
+        :param reserves: The pair reserves of the underlying tokens
+        :param supply: The LP total supply
+        :param borrow_balances: The position's borrow balance of each underlying token
+        """
+        avax_price = prices["AVAX"]
 
         # Process values by token to get full totals:
         debt_value_usd = 0
         debt_value_avax = 0
         position_value_usd = 0
         position_value_avax = 0
-        for i, token_reserve_amt in enumerate([r0, r1]):
-            token_price_usd = get_token_price_cg(underlying_token_data[i]["symbol"])
+        for i, token_reserve_amt in enumerate(reserves):
+            token_price_usd = prices[underlying_token_data[i]["symbol"]]
             precision = int(underlying_token_data[i]['precision'])
 
             owned_reserve_amt = (token_reserve_amt * collateral_size // supply) / 10 ** precision
             owned_reserve_amt_usd = owned_reserve_amt * token_price_usd
-            # print(f"{underlying_token_data[i]['symbol']} owned_reserve_amt_usd:", owned_reserve_amt_usd)
 
-            # Get & calculate token debt for underlying token:
-            borrow_bal = self._homora_bank.functions.\
-                borrowBalanceCurrent(self.pos_id, Web3.toChecksumAddress(underlying_token_data[i]['address'])).call()
-            token_debt = borrow_bal / 10 ** precision
+            # Calculate token debt for underlying token:
+            token_debt = borrow_balances[i] / 10 ** precision
             token_debt_usd = token_debt * token_price_usd
             token_debt_avax = token_debt_usd / avax_price
 
@@ -375,72 +541,132 @@ class AvalanchePosition:
         total_equity_avax = position_value_avax - debt_value_avax
         total_equity_usd = position_value_usd - debt_value_usd
 
-        # return total_equity_avax, total_equity_usd, debt_value_avax, debt_value_usd, position_value_avax, position_value_usd
         return {"equity_avax": total_equity_avax, "equity_usd": total_equity_usd,
                 "debt_avax": debt_value_avax, "debt_usd": debt_value_usd,
                 "position_avax": position_value_avax, "position_usd": position_value_usd}
 
-    def get_token_debts(self, address: str = None) -> list[tuple[ARC20Token, int, float, float]]:
+    def reward_amount_from_state(self, pool_info: dict, collateral_size: int) -> float:
         """
-        Returns the debt amount per token for the position.
-        
-        :param address: (str) Optional address to get debt for a specific token
+        Compute the pending reward amount (in the reward token) from raw state
 
-        :return: list of tuples containing:
-            - ARC20Token object
-            - debt in integer
-            - debt in token
-            - debt in USD
+        :param pool_info: The spell client's get_pool_info() dict for the position's collateral id
+        :param collateral_size: The position's collateral (LP) size
         """
-        r = self._homora_bank.functions.getPositionDebts(self.pos_id).call()
-        if len(r) == 0:
-            return r
+        start_reward_per_share = pool_info['entryRewardPerShare']
+        end_reward_per_share = pool_info['accRewardPerShare']
 
-        debt_output = []
-        for token, debt in zip(r[0], r[1]):
-            if address is not None and address.lower() != token.lower():
-                continue
-            
-            arc20_token = self.get_token(token)
-            decimals = arc20_token.decimals()
-            debt_token = debt / 10 ** decimals
-            try:
-                debt_usd = debt_token * self._oracle.get_token_price(token, decimals)[1]
-            except Exception as exc:
-                print(f"Could not get debt in USD for token {arc20_token.symbol()} - {exc}")
-                debt_usd = 0
-            debt_output.append((arc20_token, debt, debt_token, debt_usd))
-
-        if len(debt_output) == 0:
-            raise ValueError("Could not find a debt token matching the address: {}".format(address))
-        
-        return debt_output
+        if self.dex == "Trader Joe":
+            if self.pool['wTokenType'].startswith("WMasterChef"):
+                precision = 10 ** 12
+                return collateral_size * (end_reward_per_share - start_reward_per_share) // precision
+            else:  # Accounts for BoostedMasterChef positions
+                wrapper_token_per_share = pool_info['wrapper_token_per_share']
+                lp_amt = pool_info['lpAmt']
+                reward_debt = pool_info['rewardDebt']
+                precision = 10 ** 18
+
+                extra_reward_per_share = end_reward_per_share - (reward_debt * precision // lp_amt)
+                end_token_per_share = wrapper_token_per_share + extra_reward_per_share
+                return (collateral_size * (end_token_per_share - start_reward_per_share) // precision) / precision
+        else:
+            return collateral_size * ((end_reward_per_share / 1e18) - (start_reward_per_share / 1e18)) / 1e12
+
+    @staticmethod
+    def leverage_from_value(position_values: dict) -> float:
+        """Compute the leverage ratio from a get_position_value() dict"""
+        coll_value = position_values['position_usd']
+        debt_value = position_values['debt_usd']
+
+        try:
+            return coll_value / (coll_value - debt_value)
+        except ZeroDivisionError:
+            return 0.0
+
+    @staticmethod
+    def apy_from_state(apy_data: dict, leverage: float, cream_borrow_rates: list[dict], fee_bps: int,
+                       token_debts: list[tuple[str, float]]) -> dict:
+        """
+        Compute the get_current_apy() dict from raw state
+
+        :param apy_data: The pool's entry in the Alpha Homora V2 APYs endpoint
+        :param leverage: The position's leverage ratio
+        :param cream_borrow_rates: All CREAM borrow rates (see get_cream_borrow_rates())
+        :param fee_bps: The HomoraBank fee in basis points
+        :param token_debts: List of (token symbol, debt in USD) for every debt token
+        """
+        homora_fee = fee_bps / 10000
+
+        agg_adj_borrow_apy = 0
+        total_debt_usd = sum([debt_USD for symbol, debt_USD in token_debts])
+        for symbol, debt_USD in token_debts:
+            cream_apy = float(list(filter(lambda t: t['tokenSymbol'] == symbol, cream_borrow_rates))[0]['apy']) * 100
+            leverage_adjusted_apy = (leverage - 1) * (cream_apy * (1 + homora_fee))
+            agg_adj_borrow_apy += leverage_adjusted_apy * (debt_USD / total_debt_usd)  # Adjust for token debt weight of total debt
+
+        # Pull trading and farming APYs from API and adjust for leverage
+        adj_tradingFeeAPY = leverage * float(apy_data['tradingFeeAPY'])
+        adj_farmingAPY = leverage * float(apy_data['farmingAPY'])
+
+        # Calculate aggregate APY
+        aggregate_apy = adj_tradingFeeAPY + adj_farmingAPY + -agg_adj_borrow_apy
+
+        return {"APY": aggregate_apy,
+                "tradingFeeAPY": adj_tradingFeeAPY,
+                "farmingAPY": adj_farmingAPY,
+                "borrowAPY": -agg_adj_borrow_apy}
 
     """ -------------------- UTILITY METHODS: -------------------- """
 
-    def get_token_borrow_balance(self, token_address: str):
-        return self._homora_bank.functions.borrowBalanceCurrent(self.pos_id, Web3.toChecksumAddress(token_address)).call()
+    def batch(self, block_identifier: Union[str, int] = "latest") -> Multicall:
+        """
+        Returns a Multicall batch to aggregate contract reads into a single eth_call
+
+        Usage:
+            with position.batch() as batch:
+                debt_ratio_inputs = [batch.add(position._homora_bank.functions.getCollateralETHValue(position.pos_id)),
+                                     batch.add(position._homora_bank.functions.getBorrowETHValue(position.pos_id))]
+            collateral_credit, borrow_credit = [call.result for call in debt_ratio_inputs]
+
+        :param block_identifier: The block at which every read in the batch is executed
+        """
+        return Multicall(self.web3_provider, block_identifier)
+
+    def snapshot(self, block_identifier: Union[str, int] = "latest", apy: bool = True) -> PositionSnapshot:
+        """
+        Fetch the position's raw state at a single block and compute every informational metric from it in memory.
+        Use snapshot.take_snapshots() to snapshot many positions with the same number of round trips.
+
+        :param block_identifier: The block to read the position at ("latest" is pinned to the current block number)
+        :param apy: Whether to fetch the APY data and compute current_apy
+        :return: Immutable PositionSnapshot (position_value, debt_ratio, leverage_ratio, rewards_value,
+                 token_debts, current_apy and the raw state they were computed from)
+        """
+        return take_snapshot(self, block_identifier, apy)
+
+    def get_token_borrow_balance(self, token_address: str, block_identifier: Union[str, int] = "latest"):
+        return self._homora_bank.functions.borrowBalanceCurrent(self.pos_id, Web3.toChecksumAddress(token_address)).call(
+            block_identifier=block_identifier)
 
     @staticmethod
     def get_cream_borrow_rates() -> list[dict]:
-        return requests.get(f"https://api.cream.finance/api/v1/rates?comptroller=avalanche").json()['borrowRates']
+        return http_session.get(CREAM_RATES_URL).json()['borrowRates']
 
     @staticmethod
     def to_wei(token: ARC20Token, amt: float) -> int:
         return int(amt * (10 ** token.decimals()))
 
     @staticmethod
-    def get_token(address: str = None, symbol: str = None) -> ARC20Token:
+    def get_token(address: str = None, symbol: str = None, web3_provider: Web3 = None) -> ARC20Token:
         assert not all(v is None for v in [address, symbol]), "Address or symbol required to locate token"
 
         if address is not None:
-            return ARC20Token(address)
+            return ARC20Token(address, web3_provider)
 
-        r = requests.get("https://api.homora.alphaventuredao.io/v2/43114/tokens")
+        r = http_session.get(HOMORA_TOKENS_URL)
         assert r.status_code != 200, f"Could not get tokens from AHV2 API: {r.status_code}, {r.text}"
         for token_address, meta in r.json().items():
             if meta['name'] == symbol.upper():
-                return ARC20Token(token_address)
+                return ARC20Token(token_address, web3_provider)
         else:
             raise Exception(f"Could not locate token on Alpha Homora V2 with symbol: {symbol}")
 
@@ -457,13 +683,27 @@ class AvalanchePosition:
             decoded spell function (ContractFunction, dict)
         )
         """
-        transaction = avalanche_provider.eth.get_transaction(transaction_address)
+        return self.decode_transactions_data([transaction_address])[0]
+
+    def decode_transactions_data(self, transaction_addresses: list) -> list[tuple]:
+        """
+        decode_transaction_data() of many transactions, fetched in a single JSON-RPC batch (see rpc_batch.RPCBatch)
+
+        :param transaction_addresses: The transaction addresses (binary or str)
+        :return: The decode_transaction_data() tuple of each transaction, in order
+        """
+        with RPCBatch(self.web3_provider) as batch:
+            transactions = [batch.get_transaction(transaction_address) for transaction_address in transaction_addresses]
 
-        decoded_bank_transaction = self._homora_bank.decode_function_input(transaction.input)
+        decoded = []
+        for transaction in transactions:
+            decoded_bank_transaction = self._homora_bank.decode_function_input(transaction.result['input'])
 
-        encoded_contract_data = decoded_bank_transaction[1]['data']
+            encoded_contract_data = decoded_bank_transaction[1]['data']
 
-        return decoded_bank_transaction, self._platform.spell_contract.decode_function_input(encoded_contract_data)
+            decoded.append((decoded_bank_transaction,
+                            self._platform.spell_contract.decode_function_input(encoded_contract_data)))
+        return decoded
 
     def _get_position(self) -> dict:
         """
@@ -477,7 +717,7 @@ class AvalanchePosition:
         borrowCredit: str (int)
         debtRatio: str (float)}
         """
-        r = requests.get("https://api.homora.alphaventuredao.io/v2/43114/positions")
+        r = http_session.get(HOMORA_POSITIONS_URL)
         if r.status_code != 200:
             raise Exception(f"Could not fetch position: {r.status_code, r.text}")
 
@@ -489,10 +729,12 @@ class AvalanchePosition:
                              f"(If you just opened the position, please retry in a few minutes)")
 
     def _get_platform(self) -> SpellClient:
-        """Determine what dex the position is on (i.e. Trader Joe, Pangolin V2, Sushiswap, etc)"""
-        if self.dex == "Pangolin V2":
-            return PangolinV2Client()
-        elif self.dex == "Trader Joe":
+        """
+        Determine what dex the position is on (i.e. Trader Joe, Pangolin V2, Sushiswap, etc)
+
+        Spell clients are shared by every position on the same contracts (see spell.get_spell_client()).
+        """
+        if self.dex == "Trader Joe":
             try:
                 spell_address = self.pool['spellAddress']
             except KeyError:
@@ -501,16 +743,14 @@ class AvalanchePosition:
                 staking_address = self.pool['stakingAddress']
             except KeyError:
                 staking_address = self.pool['exchange']['stakingAddress']
-            return TraderJoeClient(spell_address=spell_address,
-                                   w_token_type=self.pool['wTokenType'], w_token_address=self.pool['wTokenAddress'],
-                                   staking_address=staking_address)
-        else:
-            raise NotImplementedError(f"Spell client not yet implemented for the '{self.dex}' DEX. "
-                                      f"Please make sure that the dex entered is exactly as shown on your Alpha Homora V2 position.")
+            return get_spell_client(self.dex, spell_address=spell_address, w_token_type=self.pool['wTokenType'],
+                                    w_token_address=self.pool['wTokenAddress'], staking_address=staking_address,
+                                    web3_provider=self.web3_provider)
+        return get_spell_client(self.dex, web3_provider=self.web3_provider)
 
-    def _get_position_info(self) -> list:
+    def _get_position_info(self, block_identifier: Union[str, int] = "latest") -> list:
         """
-        Returns position info from the HomoraBank.getPositionInfo method
+        Returns position info from the HomoraBank.getPositionInfo method at the block
 
         Returns (list):
             owner (address)
@@ -518,26 +758,18 @@ class AvalanchePosition:
             collid (int)
             collateralSize (int)
         """
-        return self._homora_bank.functions.getPositionInfo(self.pos_id).call()
+        return self._homora_bank.functions.getPositionInfo(self.pos_id).call(block_identifier=block_identifier)
 
     def _get_pool_info(self) -> dict:
         """
         If the open position is an LP position, returns the metadata regarding the current pool.
         "https://homora-api.alphafinance.io/v2/43114/pools"
 
+        The pools list is loaded once per process into an indexed PoolRegistry (see registry.py).
+
         :return: Dict object containing data about the pool
         """
-        r = requests.get("https://homora-api.alphafinance.io/v2/43114/pools")
-        if r.status_code != 200:
-            raise Exception(f"Could not fetch pools: {r.status_code, r.text}")
-
-        pool = list(filter(lambda p: p['key'] == self.pool_key, r.json()))
-        if len(pool) == 0:
-            raise IndexError(f"Could not find pool matching key: {self.pool_key}")
-        if len(pool) > 1:
-            raise IndexError(f"Found multiple pools matching key: {self.pool_key}")
-
-        return pool[0]
+        return get_pool_registry().get(self.pool_key)
 
     def _sign_and_send(self, function_call: ContractFunction) -> TransactionReceipt:
         """
@@ -545,16 +777,48 @@ class AvalanchePosition:
         """
         self._has_private_key()
 
-        txn = function_call.buildTransaction({"nonce": avalanche_provider.eth.get_transaction_count(self.owner),
-                                              "from": self.owner})
-        signed_txn = avalanche_provider.eth.account.sign_transaction(
-            txn, private_key=self.private_key
-        )
-        tx_hash = avalanche_provider.eth.send_raw_transaction(signed_txn.rawTransaction)
+        manager = self._transaction_manager
+        return build_receipt(manager.wait(manager.send(function_call)))
 
-        receipt = dict(avalanche_provider.eth.wait_for_transaction_receipt(tx_hash))
+    def _execute(self, encoded_spell_func: str, dry_run: bool = False) -> Union[TransactionReceipt, SimulationResult]:
+        """
+        Send the HomoraBank.execute() of the encoded spell call and wait for it (or simulate it if dry_run)
+        """
+        if dry_run:
+            return simulate_execute(self, encoded_spell_func)
+        return build_receipt(self._transaction_manager.wait(self._send_execute(encoded_spell_func)))
 
-        return build_receipt(receipt)
+    def _send_execute(self, encoded_spell_func: str, gas_limit: int = None,
+                      use_cached_gas: bool = False) -> PendingTransaction:
+        """
+        Broadcast the HomoraBank.execute() of the encoded spell call. Its gas is estimated, so that a revert is raised
+        instead of broadcast, and the estimate is recorded in the gas cache (see simulation.GasCache).
+
+        :param gas_limit: (optional) Gas limit to use if the estimate reverts for lack of allowance because approvals
+                          are still pending (the cached estimate of the same call shape is used instead if there is
+                          one)
+        :param use_cached_gas: Send with the cached estimate of the same call shape, if there is one, instead of
+                               estimating the gas (for batches of identical calls, e.g. harvest_all())
+        """
+        encoded_bank_func = self._homora_bank.functions.execute(self.pos_id, self.spell_address, encoded_spell_func)
+        spell_function = spell_function_name(self._platform.spell_contract, encoded_spell_func)
+        call_shape = spell_call_shape(self._platform.spell_contract, encoded_spell_func)
+        cached_gas = gas_cache.get(spell_function, self.pool_key, call_shape)
+        if use_cached_gas and cached_gas is not None:
+            return self._transaction_manager.send(encoded_bank_func, {"gas": cached_gas})
+
+        if gas_limit is not None and cached_gas is not None:
+            gas_limit = cached_gas
+        pending = self._transaction_manager.send(encoded_bank_func, gas_limit=gas_limit)
+        if pending.transaction["gas"] != gas_limit:
+            gas_cache.record(spell_function, self.pool_key, pending.transaction["gas"], call_shape)
+        return pending
+
+    @property
+    def _transaction_manager(self) -> TransactionManager:
+        """The owner's shared TransactionManager (local nonces, shared by every position of the owner)"""
+        self._has_private_key()
+        return get_transaction_manager(self.owner, self.private_key, self.web3_provider)
 
     def _has_private_key(self):
         if self.private_key is None:
@@ -572,18 +836,114 @@ class FantomPosition:
         raise NotImplementedError("Fantom positions are not yet available.")
 
 
-def get_avax_positions_by_owner(owner_address: str, owner_private_key: str = None) -> list[AvalanchePosition]:
+def get_avax_positions_by_owner(owner_address: str, owner_private_key: str = None,
+                                position_book: PositionBook = None, indexer: PositionIndexer = None,
+                                web3_provider: Web3 = None) -> list[AvalanchePosition]:
     """
     Get all pool positions on Avalanche held by the provided owner address
 
+    The positions and pools lists are fetched once and shared by every returned position.
+
     :param owner_address: The owner of the position (address str)
     :param owner_private_key: (optional) The owner's private key for using transactional methods from the AvalanchePosition object(s)
+    :param position_book: (optional) A loaded PositionBook to reuse across owners (fetched if not provided)
+    :param indexer: (optional) A synced PositionIndexer to look the positions up in instead of the Homora API
+    :param web3_provider: (optional) The Web3 object of the returned positions (defaults to the Avalanche provider)
     """
-    owned_positions = list(filter(lambda pos: pos["owner"].lower() == owner_address.lower(),
-                                  requests.get("https://api.homora.alphaventuredao.io/v2/43114/positions").json()))
+    if indexer is not None:
+        pool_registry = None if position_book is None else position_book.pool_registry
+        return [AvalanchePosition(position_id=position['id'],
+                                  owner_wallet_address=owner_address,
+                                  owner_private_key=owner_private_key,
+                                  pool=indexer.get_position_pool(position['id'], pool_registry),
+                                  web3_provider=web3_provider)
+                for position in indexer.get_positions_by_owner(owner_address)]
+
+    if position_book is None:
+        position_book = PositionBook()
+
+    owned_positions = position_book.get_positions_by_owner(owner_address)
     if len(owned_positions) == 0:
         return owned_positions
 
     return [AvalanchePosition(position_id=position['id'],
                               owner_wallet_address=owner_address,
-                              owner_private_key=owner_private_key) for position in owned_positions]
+                              owner_private_key=owner_private_key,
+                              pool=position_book.get_pool(position['pool']['key']),
+                              web3_provider=web3_provider) for position in owned_positions]
+
+
+def harvest_all(positions: list[AvalanchePosition], min_reward_usd: float = 0.0, verbose: bool = True) -> list[dict]:
+    """
+    Harvest the rewards of many positions
+
+    The pending rewards of every position are read in two Multicalls and one price request. Positions with no
+    rewards, or rewards worth less than min_reward_usd, are skipped. The remaining harvests are broadcast back-to-back
+    through each owner's TransactionManager, and their receipts are awaited together. Only the first harvest of
+    each pool estimates its gas (see simulation.GasCache).
+
+    :param positions: AvalanchePosition objects (with the owner's private key)
+    :param min_reward_usd: The minimum USD value of a position's pending rewards to harvest it
+    :param verbose: Print the result of each position
+    :return: One dict per position, in the order of positions:
+             {position_id: int
+             symbol: str
+             dex: str
+             reward_token: float (pending rewards before the harvest)
+             reward_usd: float
+             reward_token_symbol: str
+             status: str ("harvested", "skipped", "reverted" or "failed")
+             receipt: TransactionReceipt or None
+             error: str or None}
+    """
+    positions = list(positions)
+    results = [{"position_id": position.pos_id, "symbol": position.symbol, "dex": position.dex,
+                "reward_token": None, "reward_usd": None, "reward_token_symbol": position.reward_token_symbol,
+                "status": None, "receipt": None, "error": None} for position in positions]
+    if len(positions) == 0:
+        return results
+
+    # Position info first (the collateral id holds the pid), then every staking pool
+    with Multicall(positions[0].web3_provider) as batch:
+        position_infos = [batch.add(position._homora_bank.functions.getPositionInfo(position.pos_id))
+                          for position in positions]
+    with Multicall(positions[0].web3_provider) as batch:
+        rewards_values = [position.prepare_rewards_value(batch, position_info.result)
+                          for position, position_info in zip(positions, position_infos)]
+    prices = price_service.get_prices({position.reward_token_symbol for position in positions} | {"AVAX"})
+
+    # Broadcast every harvest before waiting for any of them
+    pending = {}
+    for position, result, rewards_value in zip(positions, results, rewards_values):
+        rewards = rewards_value(prices[position.reward_token_symbol])
+        result.update(reward_token=rewards['reward_token'], reward_usd=rewards['reward_usd'])
+        if rewards['reward_token'] == 0 or rewards['reward_usd'] < min_reward_usd:
+            result['status'] = "skipped"
+            continue
+        try:
+            manager = position._transaction_manager
+            harvest = position._send_execute(position._platform.prepare_claim_all_rewards(), use_cached_gas=True)
+            pending.setdefault(manager, []).append((result, harvest))
+        except Exception as exc:
+            result.update(status="failed", error=str(exc))
+
+    for manager, harvests in pending.items():
+        wait_error = None
+        try:
+            manager.wait_all([pending_txn for _, pending_txn in harvests])
+        except Exception as exc:
+            wait_error = exc
+        for result, pending_txn in harvests:
+            if pending_txn.receipt is not None:
+                result['status'] = "harvested" if pending_txn.receipt.get('status') == 1 else "reverted"
+                result['receipt'] = build_receipt(dict(pending_txn.receipt), prices["AVAX"])
+            else:
+                result.update(status="failed", error=str(pending_txn.error or wait_error))
+
+    if verbose:
+        for result in results:
+            print(f"#{result['position_id']} {result['symbol']} {result['dex']}: {result['status']} "
+                  f"({result['reward_token']} {result['reward_token_symbol']}, ${result['reward_usd']})"
+                  + (f" - {result['error']}" if result['error'] is not None else ""))
+
+    return results
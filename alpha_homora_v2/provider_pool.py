@@ -0,0 +1,315 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Iterable, Union
+import time
+
+from .rpc_batch import post_batch
+from ._config import PROVIDER_FAILURE_THRESHOLD, PROVIDER_COOLDOWN, PROVIDER_LATENCY_WEIGHT, PROVIDER_HEDGE_DELAY, \
+    PROVIDER_HEALTH_CHECK_INTERVAL, PROVIDER_MAX_BLOCK_LAG, PROVIDER_REQUEST_TIMEOUT
+
+from requests import exceptions
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+# Read-only JSON-RPC methods, safe to send to a second endpoint while the first one is still answering
+HEDGED_METHODS = {"eth_call", "eth_blockNumber", "eth_chainId", "eth_getBlockByNumber", "eth_getBlockByHash",
+                  "eth_getTransactionByHash", "eth_getTransactionReceipt", "eth_getTransactionCount", "eth_getLogs",
+                  "eth_getBalance", "eth_getCode", "eth_getStorageAt", "eth_estimateGas", "eth_gasPrice",
+                  "eth_maxPriorityFeePerGas", "eth_feeHistory", "net_version"}
+
+# JSON-RPC errors that depend on the endpoint rather than on the request (rate limits, pruned state), in lower case
+FAILOVER_ERROR_MESSAGES = ("rate limit", "too many requests", "limit exceeded", "missing trie node",
+                           "header not found")
+
+
+class EndpointError(Exception):
+    """An endpoint could not serve a request that another endpoint may serve"""
+    def __init__(self, endpoint_uri: str, reason: Union[str, Exception], processed: bool = True):
+        """
+        :param processed: False if the endpoint certainly did not process the request (unreachable or rate limited),
+                          so that even a transaction can be resent to another endpoint
+        """
+        super().__init__(f"{endpoint_uri}: {reason}")
+        self.endpoint_uri = endpoint_uri
+        self.reason = reason
+        self.processed = processed
+
+
+@dataclass
+class Endpoint:
+    """An RPC endpoint of a ProviderPool, with its latency average and circuit breaker state"""
+    provider: Web3.HTTPProvider
+    latency: float = None  # Moving average of the request latency in seconds (None until the first response)
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    consecutive_failures: int = 0
+    opened_at: float = None  # When the circuit breaker opened (None while it is closed)
+    trial_in_flight: bool = False  # A half-open breaker lets a single trial request through
+    block_number: int = None  # Head block at the last health check
+    lagging: bool = False
+
+    @property
+    def uri(self) -> str:
+        return self.provider.endpoint_uri
+
+    def as_dict(self) -> dict:
+        return {"uri": self.uri, "latency": self.latency, "in_flight": self.in_flight, "requests": self.requests,
+                "errors": self.errors, "circuit_open": self.opened_at is not None,
+                "block_number": self.block_number, "lagging": self.lagging}
+
+
+class ProviderPool(BaseProvider):
+    """
+    Web3 provider spreading the JSON-RPC requests over several RPC endpoints.
+
+    Each request goes to the healthy endpoint with the lowest expected wait: its moving average latency times the
+    requests it is already serving. An endpoint that cannot be reached, returns an HTTP error or a rate limit
+    error fails the request over to the next endpoint; after failure_threshold consecutive failures its circuit
+    breaker opens and it gets no traffic for cooldown seconds, after which a single trial request decides whether
+    it closes again. Health checks (check_health(), or every health_check_interval seconds in the background) also
+    take endpoints lagging behind the others' head block out of rotation.
+
+    With a hedge_delay, a read that the first endpoint has not answered after hedge_delay seconds is also sent to the
+    next endpoint, and the first answer wins. Transactions are never hedged, and only fail over when the endpoint
+    could not be reached or rate limited them.
+
+        pool = ProviderPool(["https://api.avax.network/ext/bc/C/rpc", "https://rpc.ankr.com/avalanche"],
+                            hedge_delay=0.5)
+        web3_provider = Web3(pool)  # or get_web3_provider([...]), with the middlewares of the package's provider
+
+    Note: requests go straight to each endpoint's HTTPProvider.make_request(), so web3's HTTP retry middleware does
+    not retry a failing endpoint before the pool fails over.
+    """
+    def __init__(self, endpoint_uris: Iterable[str], hedge_delay: float = PROVIDER_HEDGE_DELAY,
+                 failure_threshold: int = PROVIDER_FAILURE_THRESHOLD, cooldown: float = PROVIDER_COOLDOWN,
+                 latency_weight: float = PROVIDER_LATENCY_WEIGHT,
+                 health_check_interval: float = PROVIDER_HEALTH_CHECK_INTERVAL,
+                 max_block_lag: int = PROVIDER_MAX_BLOCK_LAG, request_kwargs: dict = None):
+        """
+        :param endpoint_uris: The RPC node URLs
+        :param hedge_delay: (optional) Seconds before an unanswered read is also sent to a second endpoint
+        :param failure_threshold: Consecutive failures that open an endpoint's circuit breaker
+        :param cooldown: Seconds an open circuit breaker keeps the endpoint out of rotation
+        :param latency_weight: Weight of the latest response in an endpoint's moving average latency
+        :param health_check_interval: (optional) Seconds between background health checks
+        :param max_block_lag: Blocks an endpoint may lag behind the highest head before it is taken out of rotation
+        :param request_kwargs: (optional) requests keyword arguments of every endpoint (defaults to a timeout of
+                               _config.PROVIDER_REQUEST_TIMEOUT seconds)
+        """
+        super().__init__()
+        request_kwargs = {"timeout": PROVIDER_REQUEST_TIMEOUT} if request_kwargs is None else request_kwargs
+        self.endpoints = [Endpoint(Web3.HTTPProvider(uri, request_kwargs=request_kwargs)) for uri in endpoint_uris]
+        assert len(self.endpoints) > 0, "A provider pool needs at least one endpoint"
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latency_weight = latency_weight
+        self.max_block_lag = max_block_lag
+        self._lock = Lock()
+        self._executor = None
+        self._health_check_thread = None
+        self._stop_health_checks = Event()
+        if health_check_interval is not None:
+            self.start_health_checks(health_check_interval)
+
+    def __str__(self) -> str:
+        return f"RPC provider pool {', '.join(endpoint.uri for endpoint in self.endpoints)}"
+
+    """ -------------------- REQUESTS: -------------------- """
+
+    def make_request(self, method, params) -> dict:
+        candidates = self._candidates()
+        if self.hedge_delay is not None and method in HEDGED_METHODS and len(candidates) > 1:
+            return self._hedged_request(method, params, candidates)
+
+        error = None
+        for endpoint in candidates:
+            try:
+                return self._request(endpoint, method, params)
+            except EndpointError as exc:
+                error = exc
+                if method not in HEDGED_METHODS and exc.processed:
+                    break  # The endpoint may have processed the transaction
+        raise error
+
+    def make_batch_request(self, requests: list[tuple[str, Any]]) -> list[dict]:
+        """
+        Send a JSON-RPC batch to a single endpoint (see rpc_batch.make_batch_request()), failing over like
+        make_request() (a batch holding a transaction is handled like a transaction)
+        """
+        read_only = all(method in HEDGED_METHODS for method, _ in requests)
+        error = None
+        for endpoint in self._candidates():
+            try:
+                return self._send(endpoint, lambda provider: post_batch(provider, requests))
+            except EndpointError as exc:
+                error = exc
+                if not read_only and exc.processed:
+                    break
+        raise error
+
+    def _hedged_request(self, method, params, candidates: list[Endpoint]) -> dict:
+        """Send the read to the best endpoint, and to the next one whenever it is unanswered after hedge_delay"""
+        executor = self._get_executor()
+        remaining = iter(candidates)
+        pending = {executor.submit(self._request, next(remaining), method, params)}
+        error = None
+        while len(pending) > 0:
+            done, pending = wait(pending, timeout=self.hedge_delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except EndpointError as exc:
+                    error = exc
+            # Hedge on a timeout, fail over on an error
+            endpoint = next(remaining, None)
+            if endpoint is not None:
+                pending.add(executor.submit(self._request, endpoint, method, params))
+        raise error
+
+    def _request(self, endpoint: Endpoint, method, params) -> dict:
+        return self._send(endpoint, lambda provider: provider.make_request(method, params))
+
+    def _send(self, endpoint: Endpoint, send: Callable[[Web3.HTTPProvider], Any]) -> Any:
+        """Send a request (or batch) to one endpoint, recording its latency and outcome"""
+        with self._lock:
+            endpoint.in_flight += 1
+            if endpoint.opened_at is not None:
+                endpoint.trial_in_flight = True  # Half-open: this request decides whether the breaker closes
+        start = time.perf_counter()
+        try:
+            response = send(endpoint.provider)
+        except exceptions.ConnectionError as exc:
+            self._record_failure(endpoint)
+            raise EndpointError(endpoint.uri, exc, processed=False)
+        except exceptions.HTTPError as exc:
+            self._record_failure(endpoint)
+            raise EndpointError(endpoint.uri, exc,
+                                processed=exc.response is None or exc.response.status_code != 429)
+        except (exceptions.RequestException, ValueError) as exc:
+            self._record_failure(endpoint)
+            raise EndpointError(endpoint.uri, exc)
+        finally:
+            with self._lock:
+                endpoint.in_flight -= 1
+
+        for single_response in response if isinstance(response, list) else [response]:
+            error = single_response.get("error") or ""
+            message = str(error.get("message", "") if isinstance(error, dict) else error).lower()
+            if any(failover_message in message for failover_message in FAILOVER_ERROR_MESSAGES):
+                self._record_failure(endpoint)
+                raise EndpointError(endpoint.uri, single_response["error"], processed="rate limit" not in message)
+
+        self._record_success(endpoint, time.perf_counter() - start)
+        return response
+
+    def _candidates(self) -> list[Endpoint]:
+        """The endpoints to try in order: the available ones by expected wait, or every one if none is available"""
+        now = time.monotonic()
+        with self._lock:
+            available = []
+            for endpoint in self.endpoints:
+                if endpoint.lagging:
+                    continue
+                if endpoint.opened_at is None:
+                    available.append(endpoint)
+                elif now - endpoint.opened_at >= self.cooldown and not endpoint.trial_in_flight:
+                    available.append(endpoint)
+            if len(available) == 0:
+                # Better a degraded endpoint than none: the one whose breaker opened first, lagging ones last
+                return sorted(self.endpoints, key=lambda endpoint: (endpoint.lagging, endpoint.opened_at or 0))
+            # Endpoints without a measured latency first, so that every endpoint gets measured
+            return sorted(available, key=lambda endpoint: 0 if endpoint.latency is None
+                          else endpoint.latency * (1 + endpoint.in_flight))
+
+    def _record_success(self, endpoint: Endpoint, seconds: float) -> None:
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.latency = seconds if endpoint.latency is None \
+                else self.latency_weight * seconds + (1 - self.latency_weight) * endpoint.latency
+            endpoint.consecutive_failures = 0
+            endpoint.opened_at = None
+            endpoint.trial_in_flight = False
+
+    def _record_failure(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.trial_in_flight or endpoint.consecutive_failures >= self.failure_threshold:
+                if endpoint.opened_at is None:
+                    print(f"RPC endpoint {endpoint.uri} failed {endpoint.consecutive_failures} times in a row, "
+                          f"taking it out of rotation for {self.cooldown}s")
+                endpoint.opened_at = time.monotonic()
+            endpoint.trial_in_flight = False
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=4 * len(self.endpoints),
+                                                    thread_name_prefix="provider-pool")
+            return self._executor
+
+    """ -------------------- HEALTH: -------------------- """
+
+    def check_health(self) -> list[dict]:
+        """
+        Request the head block of every endpoint (in parallel), updating their latency and circuit breakers, and take
+        the endpoints lagging more than max_block_lag blocks behind the highest head out of rotation
+
+        :return: endpoint_stats() after the check
+        """
+        def head(endpoint: Endpoint) -> Union[int, None]:
+            try:
+                response = self._request(endpoint, "eth_blockNumber", [])
+                return int(response["result"], 16) if "result" in response else None
+            except EndpointError:
+                return None
+
+        executor = self._get_executor()
+        heads = list(executor.map(head, self.endpoints))
+        highest = max((block for block in heads if block is not None), default=None)
+        with self._lock:
+            for endpoint, block in zip(self.endpoints, heads):
+                endpoint.block_number = block
+                lagging = block is not None and highest - block > self.max_block_lag
+                if lagging and not endpoint.lagging:
+                    print(f"RPC endpoint {endpoint.uri} is {highest - block} blocks behind, taking it out of rotation")
+                endpoint.lagging = lagging
+        return self.endpoint_stats()
+
+    def start_health_checks(self, interval: float) -> None:
+        """Run check_health() every interval seconds on a background thread"""
+        if self._health_check_thread is not None:
+            return
+        self._stop_health_checks.clear()
+
+        def run():
+            while not self._stop_health_checks.wait(interval):
+                self.check_health()
+
+        self._health_check_thread = Thread(target=run, name="provider-pool-health", daemon=True)
+        self._health_check_thread.start()
+
+    def stop_health_checks(self) -> None:
+        if self._health_check_thread is not None:
+            self._stop_health_checks.set()
+            self._health_check_thread.join()
+            self._health_check_thread = None
+
+    def endpoint_stats(self) -> list[dict]:
+        """The latency, request counters and state of every endpoint"""
+        with self._lock:
+            return [endpoint.as_dict() for endpoint in self.endpoints]
+
+    def isConnected(self) -> bool:
+        return any(endpoint.provider.isConnected() for endpoint in self.endpoints)
+
+    def close(self) -> None:
+        """Stop the health checks and the hedging threads"""
+        self.stop_health_checks()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
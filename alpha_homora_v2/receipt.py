@@ -1,7 +1,16 @@
-from .oracles import get_token_price_cg
+from typing import Iterable, Iterator, Union
+import time
 
-from dataclasses import dataclass
+from .oracles import price_service
+from .provider import avalanche_provider
+from .rpc_batch import RPCBatch
+from ._config import TRANSACTION_RECEIPT_TIMEOUT, TRANSACTION_POLL_INTERVAL, RECEIPT_MAX_POLL_INTERVAL, \
+    RECEIPT_BATCH_SIZE
+
+from dataclasses import dataclass, field
 from hexbytes import HexBytes
+from web3 import Web3
+from web3.exceptions import TimeExhausted
 
 @dataclass
 class TransactionReceipt:
@@ -21,14 +30,18 @@ class TransactionReceipt:
     status: int
     transactionIndex: int
     type: str
+    # Receipts of the token approvals sent right before this transaction (see AvalanchePosition.add())
+    approvals: list['TransactionReceipt'] = field(default_factory=list)
 
 
-def build_receipt(d: dict) -> TransactionReceipt:
+def build_receipt(d: dict, avax_price_usd: float = None) -> TransactionReceipt:
     """
     Prepare the Web3 transaction receipt dictionary to map to the TransactionReceipt class
 
     :param d: Transaction receipt JSON data as returned by Web3.eth.wait_for_transaction_receipt():
               https://web3py.readthedocs.io/en/stable/web3.eth.html#web3.eth.Eth.wait_for_transaction_receipt
+    :param avax_price_usd: (optional) The USD price of AVAX used to price the gas (defaults to the cached
+                           price_service price)
     :return: TransactionReceipt class to model the transaction
     """
     # Account for "from" being unable to map:
@@ -37,9 +50,11 @@ def build_receipt(d: dict) -> TransactionReceipt:
     if "to" in d.keys():
         d['toAddress'] = d.pop("to")
 
-    # Calculate gas price in USD
+    # Calculate gas price in USD (gas is paid in AVAX at the effective gas price, in wei)
     if "gasUsed" in d.keys():
-        d['gasSpendUSD'] = (d.pop('gasUsed') * 0.000000001) * get_token_price_cg("ETH")  # ETH per GWEI
+        if avax_price_usd is None:
+            avax_price_usd = price_service.get_price("AVAX")
+        d['gasSpendUSD'] = d.pop('gasUsed') * d['effectiveGasPrice'] / 10 ** 18 * avax_price_usd
 
     # Clean logs - will not be used:
     for key in d.copy().keys():
@@ -47,3 +62,85 @@ def build_receipt(d: dict) -> TransactionReceipt:
             d.pop(key)
 
     return TransactionReceipt(**d)
+
+
+class ReceiptService:
+    """
+    Waits for the receipts of many transactions at once.
+
+    Each poll looks every pending hash up in a single JSON-RPC batch of eth_getTransactionReceipt requests (one request
+    per hash if the provider or the node does not support batches, see rpc_batch.RPCBatch). Receipts are yielded as
+    they land. The poll interval starts at poll_interval and grows by backoff (up to max_poll_interval) while no
+    receipt lands, and is reset whenever one does.
+
+        for tx_hash, receipt in receipt_service.iter_receipts(tx_hashes):
+            print(tx_hash.hex(), receipt['status'])
+    """
+    def __init__(self, web3_provider: Web3 = None, poll_interval: float = TRANSACTION_POLL_INTERVAL,
+                 max_poll_interval: float = RECEIPT_MAX_POLL_INTERVAL, backoff: float = 1.5,
+                 batch_size: int = RECEIPT_BATCH_SIZE):
+        """
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        :param poll_interval: Seconds between the first polls
+        :param max_poll_interval: Maximum seconds between polls
+        :param backoff: Poll interval multiplier after a poll that found no receipt
+        :param batch_size: Maximum number of hashes looked up in a single JSON-RPC batch
+        """
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.batch_size = batch_size
+
+    def get_receipts(self, tx_hashes: Iterable[Union[HexBytes, str]]) -> dict[HexBytes, Union[dict, None]]:
+        """
+        Look the transactions' receipts up once
+
+        :return: dict of {tx_hash: receipt dict, or None if the transaction is not mined yet}
+        """
+        tx_hashes = [HexBytes(tx_hash) for tx_hash in tx_hashes]
+        with RPCBatch(self.web3_provider, self.batch_size) as batch:
+            lookups = [batch.get_transaction_receipt(tx_hash) for tx_hash in tx_hashes]
+        return {tx_hash: None if lookup.result is None else dict(lookup.result)
+                for tx_hash, lookup in zip(tx_hashes, lookups)}
+
+    def iter_receipts(self, tx_hashes: Iterable[Union[HexBytes, str]],
+                      timeout: float = TRANSACTION_RECEIPT_TIMEOUT) -> Iterator[tuple[HexBytes, dict]]:
+        """
+        Yield (tx_hash, receipt) pairs as the transactions are mined
+
+        :param tx_hashes: The transaction hashes to wait for
+        :param timeout: Seconds to wait for every receipt before raising TimeExhausted
+        """
+        pending = {HexBytes(tx_hash) for tx_hash in tx_hashes}
+        deadline = time.time() + timeout
+        interval = self.poll_interval
+        while len(pending) > 0:
+            landed = {tx_hash: receipt for tx_hash, receipt in self.get_receipts(pending).items()
+                      if receipt is not None}
+            for tx_hash, receipt in landed.items():
+                pending.discard(tx_hash)
+                yield tx_hash, receipt
+            if len(pending) == 0:
+                return
+
+            if time.time() >= deadline:
+                raise TimeExhausted(f"Transactions {[tx_hash.hex() for tx_hash in pending]} "
+                                    f"were not mined after {timeout}s")
+            interval = self.poll_interval if len(landed) > 0 else min(interval * self.backoff,
+                                                                      self.max_poll_interval)
+            time.sleep(min(interval, max(deadline - time.time(), 0)))
+
+    def wait_for_receipts(self, tx_hashes: Iterable[Union[HexBytes, str]],
+                          timeout: float = TRANSACTION_RECEIPT_TIMEOUT) -> list[dict]:
+        """
+        Wait for every transaction to be mined (see iter_receipts())
+
+        :return: The receipt dicts, in the order of tx_hashes
+        """
+        tx_hashes = [HexBytes(tx_hash) for tx_hash in tx_hashes]
+        receipts = dict(self.iter_receipts(tx_hashes, timeout))
+        return [receipts[tx_hash] for tx_hash in tx_hashes]
+
+
+receipt_service = ReceiptService()
@@ -0,0 +1,288 @@
+from os.path import join, abspath, dirname
+from threading import Event, Lock, Thread
+from types import MappingProxyType
+from typing import Mapping, Union
+import csv
+import json
+import time
+
+from .session import http_session
+from ._config import HOMORA_POOLS_URL, POOL_REFRESH_INTERVAL, POOL_MISS_REFRESH_INTERVAL
+
+TOKEN_METADATA_PATH = join(abspath(dirname(__file__)), "resources", "token_metadata.csv")
+POOLS_SEED_PATH = join(abspath(dirname(__file__)), "abi", "pool.json")
+
+
+class TokenRegistry:
+    """
+    Immutable, in-memory index of the token reference file (resources/token_metadata.csv)
+
+    Each row is a read-only mapping with the same string values as the CSV:
+        {'symbol (str)', 'coingecko_id (str)', 'precision (str need to convert to int)', 'address (str)'}
+    """
+    def __init__(self, path: str = TOKEN_METADATA_PATH):
+        """
+        :param path: Path to a token metadata CSV with symbol, coingecko_id, precision and address columns
+        """
+        with open(path) as csv_file:
+            rows = tuple(MappingProxyType(dict(row)) for row in csv.DictReader(csv_file))
+
+        by_symbol, by_symbol_upper, by_address, by_coingecko_id = {}, {}, {}, {}
+        for row in rows:
+            # setdefault keeps the first row for duplicate keys, matching the previous row-by-row scan
+            by_symbol.setdefault(row['symbol'], row)
+            by_symbol_upper.setdefault(row['symbol'].upper(), row)
+            by_address.setdefault(row['address'].lower(), row)
+            by_coingecko_id.setdefault(row['coingecko_id'], []).append(row)
+
+        self.rows = rows
+        self._by_symbol = MappingProxyType(by_symbol)
+        self._by_symbol_upper = MappingProxyType(by_symbol_upper)
+        self._by_address = MappingProxyType(by_address)
+        self._by_coingecko_id = MappingProxyType({k: tuple(v) for k, v in by_coingecko_id.items()})
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def get(self, identifier: str) -> Union[Mapping, None]:
+        """
+        :param identifier: Either the token symbol (case-insensitive) or the token address
+        :return: The token info row, or None if the token is not in the reference file
+        """
+        row = self._by_symbol_upper.get(identifier.upper())
+        if row is None:
+            row = self._by_address.get(identifier.lower())
+        return row
+
+    def by_symbol(self, symbol: str) -> Mapping:
+        """Returns the token info row for the exact symbol (raises KeyError if not found)"""
+        return self._by_symbol[symbol]
+
+    def by_address(self, address: str) -> Mapping:
+        """Returns the token info row for the address in any case (raises KeyError if not found)"""
+        return self._by_address[address.lower()]
+
+    def by_coingecko_id(self, coingecko_id: str) -> tuple[Mapping, ...]:
+        """Returns every token info row priced by the CoinGecko id (empty tuple if not found)"""
+        return self._by_coingecko_id.get(coingecko_id, ())
+
+    def coingecko_id(self, symbol: str) -> str:
+        """Returns the CoinGecko id for the exact symbol (raises KeyError if not found)"""
+        return self._by_symbol[symbol]['coingecko_id']
+
+
+_token_registry = None
+_token_registry_lock = Lock()
+
+
+def get_token_registry() -> TokenRegistry:
+    """Returns the process-wide TokenRegistry, loading the reference file on first use"""
+    global _token_registry
+    if _token_registry is None:
+        with _token_registry_lock:
+            if _token_registry is None:
+                _token_registry = TokenRegistry()
+    return _token_registry
+
+
+class _PoolIndex:
+    """Immutable lookup tables over one version of the pools list (swapped as a whole on refresh)"""
+    def __init__(self, pools: list[dict]):
+        self.pools = tuple(pools)
+        self.by_key, self.by_lp_token, self.by_collateral = {}, {}, {}
+        by_w_token, by_exchange, by_pair = {}, {}, {}
+        for pool in self.pools:
+            if pool['key'] in self.by_key:
+                print(f"Skipping a pool with a duplicate key (the first one is kept): {pool['key']}")
+                continue
+            self.by_key[pool['key']] = pool
+            self.by_lp_token.setdefault(pool['lpTokenAddress'].lower(), pool)
+            self.by_collateral.setdefault((pool['wTokenAddress'].lower(), pool.get('pid')), pool)
+            by_w_token.setdefault(pool['wTokenAddress'].lower(), []).append(pool)
+            by_exchange.setdefault(pool['exchange']['name'], []).append(pool)
+            by_pair.setdefault(frozenset(token.lower() for token in pool['tokens']), []).append(pool)
+
+        # Wrappers holding a single pool (e.g. WStakingRewards) also match any collateral id
+        for w_token, pools in by_w_token.items():
+            if len(pools) == 1:
+                self.by_collateral.setdefault((w_token, None), pools[0])
+
+        self.by_w_token = {k: tuple(v) for k, v in by_w_token.items()}
+        self.by_exchange = {k: tuple(v) for k, v in by_exchange.items()}
+        self.by_pair = {k: tuple(v) for k, v in by_pair.items()}
+
+
+class PoolRegistry:
+    """
+    In-memory index of the Alpha Homora V2 pools list, with O(1) lookups by key, LP token, wrapper token (and
+    collateral id), exchange and token pair.
+
+    The registry fetches the pools endpoint when it is created, and falls back to the bundled abi/pool.json only if
+    the fetch fails. Once the list is older than refresh_interval seconds, the next lookup starts a background
+    refresh. A lookup missing from the list waits for a refresh (at most one every miss_refresh_interval seconds)
+    before giving up, so that a pool added since the last refresh is found.
+
+    Each pool is a dict as returned by the Homora pools endpoint (see AvalanchePosition.pool).
+    """
+    def __init__(self, pools: list[dict] = None, url: str = HOMORA_POOLS_URL,
+                 refresh_interval: float = POOL_REFRESH_INTERVAL, seed_path: str = POOLS_SEED_PATH,
+                 miss_refresh_interval: float = POOL_MISS_REFRESH_INTERVAL):
+        """
+        :param pools: (optional) A fixed pools list to index (never refreshed)
+        :param url: The pools endpoint
+        :param refresh_interval: Seconds before the pools list is refreshed in the background
+        :param seed_path: The pools list used if the first fetch fails (None to raise instead)
+        :param miss_refresh_interval: Minimum seconds between two refreshes forced by lookup misses
+        """
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        self.refreshed_at = None
+        self._refresh_lock = Lock()
+        self._refreshing = None  # Event set when the in-flight refresh completes
+
+        if pools is not None:
+            self._index = _PoolIndex(pools)
+            self.refresh_interval = None
+        else:
+            try:
+                self._index = _PoolIndex(self.fetch_pools())
+            except Exception as exc:
+                if seed_path is None:
+                    raise
+                print(f"Could not fetch the pools list, using the bundled one until the next refresh - {exc}")
+                with open(seed_path) as seed_file:
+                    self._index = _PoolIndex(json.load(seed_file))
+            self.refreshed_at = time.time()
+
+    def __len__(self):
+        return len(self._index.pools)
+
+    def __iter__(self):
+        return iter(self.pools)
+
+    @property
+    def pools(self) -> tuple[dict, ...]:
+        self._maybe_refresh()
+        return self._index.pools
+
+    def fetch_pools(self) -> list[dict]:
+        r = http_session.get(self.url)
+        if r.status_code != 200:
+            raise Exception(f"Could not fetch pools: {r.status_code, r.text}")
+        return r.json()
+
+    def refresh(self, block: bool = True) -> None:
+        """
+        Fetch the pools list and swap in the new index (single-flight: concurrent calls share one request)
+
+        :param block: Wait for the refresh to complete (otherwise it runs in a background thread)
+        """
+        with self._refresh_lock:
+            done = self._refreshing
+            if done is None:
+                done = self._refreshing = Event()
+                Thread(target=self._refresh, args=(done,), name="PoolRegistry refresh", daemon=True).start()
+        if block:
+            done.wait()
+
+    def _refresh(self, done: Event) -> None:
+        try:
+            self._index = _PoolIndex(self.fetch_pools())
+        except Exception as exc:
+            print(f"Could not refresh the pools list, keeping the current one - {exc}")
+        finally:
+            # A failed refresh is retried after the next interval as well
+            self.refreshed_at = time.time()
+            with self._refresh_lock:
+                self._refreshing = None
+            done.set()
+
+    def _maybe_refresh(self) -> None:
+        if self.refresh_interval is not None and self.refreshed_at is not None \
+                and time.time() - self.refreshed_at > self.refresh_interval:
+            self.refresh(block=False)
+
+    def _refresh_on_miss(self) -> bool:
+        """
+        Refresh the pools list for a lookup missing from it, unless it was refreshed less than miss_refresh_interval
+        seconds ago (an in-flight refresh is waited for)
+
+        :return: Whether the index may have changed
+        """
+        if self.refresh_interval is None:
+            return False
+        if self._refreshing is None and self.refreshed_at is not None \
+                and time.time() - self.refreshed_at < self.miss_refresh_interval:
+            return False
+        self.refresh(block=True)
+        return True
+
+    def _lookup(self, table: str, *keys):
+        """Look the keys up in order, refreshing the pools list once if none of them is in the current index"""
+        self._maybe_refresh()
+
+        def find():
+            index = getattr(self._index, table)
+            return next((index[key] for key in keys if key in index), None)
+
+        value = find()
+        if value is None and self._refresh_on_miss():
+            value = find()
+        return value
+
+    def get(self, pool_key: str) -> dict:
+        """Returns the pool matching the key (raises IndexError if not found)"""
+        pool = self._lookup("by_key", pool_key)
+        if pool is None:
+            raise IndexError(f"Could not find pool matching key: {pool_key}")
+        return pool
+
+    def by_lp_token(self, lp_token_address: str) -> dict:
+        """Returns the pool of the LP token (raises IndexError if not found)"""
+        pool = self._lookup("by_lp_token", lp_token_address.lower())
+        if pool is None:
+            raise IndexError(f"Could not find pool matching LP token: {lp_token_address}")
+        return pool
+
+    def by_w_token(self, w_token_address: str) -> tuple[dict, ...]:
+        """Returns every pool held through the wrapper token (empty tuple if not found)"""
+        return self._lookup("by_w_token", w_token_address.lower()) or ()
+
+    def by_collateral(self, w_token_address: str, coll_id: int) -> dict:
+        """
+        Returns the pool of a position's collateral (raises IndexError if not found)
+
+        :param w_token_address: The HomoraBank collateral token (wrapper token address)
+        :param coll_id: The collateral id (the pool id is stored in its top 16 bits)
+        """
+        w_token_address, pid = w_token_address.lower(), int(coll_id) >> 240
+        pool = self._lookup("by_collateral", (w_token_address, pid), (w_token_address, None))
+        if pool is None:
+            raise IndexError(f"Could not find pool for collateral token {w_token_address} (pid {pid})")
+        return pool
+
+    def by_exchange(self, exchange_name: str) -> tuple[dict, ...]:
+        """Returns every pool on the exchange, e.g. "Trader Joe" (empty tuple if not found)"""
+        return self._lookup("by_exchange", exchange_name) or ()
+
+    def by_pair(self, token_a: str, token_b: str) -> tuple[dict, ...]:
+        """Returns every pool of the token pair, in either order (empty tuple if not found)"""
+        return self._lookup("by_pair", frozenset((token_a.lower(), token_b.lower()))) or ()
+
+
+_pool_registry = None
+_pool_registry_lock = Lock()
+
+
+def get_pool_registry() -> PoolRegistry:
+    """Returns the process-wide PoolRegistry, fetching the pools list on first use"""
+    global _pool_registry
+    if _pool_registry is None:
+        with _pool_registry_lock:
+            if _pool_registry is None:
+                _pool_registry = PoolRegistry()
+    return _pool_registry
@@ -0,0 +1,251 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import splitext
+from typing import Iterator, Union
+import csv
+import json
+import time
+
+from .snapshot import PositionSnapshot, take_snapshots, fetch_apy_inputs
+from ._config import REPORT_MAX_WORKERS, REPORT_CHUNK_SIZE
+
+# Report columns, in output order
+REPORT_COLUMNS = ['position_id', 'dex', 'symbol', 'position_value_usd', 'equity_value_usd', 'debt_value_usd',
+                  'debt_ratio', 'leverage', 'tradingFeeAPY', 'farmingAPY', 'borrowAPY', 'aggAPY',
+                  'pending_rewards_token', 'pending_rewards_usd', 'reward_token_symbol', 'block_number',
+                  'chunk_seconds_per_row', 'error']
+
+
+def snapshot_to_row(snapshot: PositionSnapshot) -> dict:
+    """Flatten a PositionSnapshot into a report row (REPORT_COLUMNS)"""
+    apys = snapshot.current_apy or {}
+    return {'position_id': snapshot.pos_id, 'dex': snapshot.dex, 'symbol': snapshot.symbol,
+            'position_value_usd': snapshot.position_value['position_usd'],
+            'equity_value_usd': snapshot.position_value['equity_usd'],
+            'debt_value_usd': snapshot.position_value['debt_usd'],
+            'debt_ratio': snapshot.debt_ratio, 'leverage': snapshot.leverage_ratio,
+            'tradingFeeAPY': apys.get('tradingFeeAPY'), 'farmingAPY': apys.get('farmingAPY'),
+            'borrowAPY': apys.get('borrowAPY'), 'aggAPY': apys.get('APY'),
+            'pending_rewards_token': snapshot.rewards_value['reward_token'],
+            'pending_rewards_usd': snapshot.rewards_value['reward_usd'],
+            'reward_token_symbol': snapshot.rewards_value['reward_token_symbol'],
+            'block_number': snapshot.block_number, 'chunk_seconds_per_row': None, 'error': None}
+
+
+def _error_row(position, block_identifier, exc: Exception) -> dict:
+    row = dict.fromkeys(REPORT_COLUMNS)
+    row.update({'position_id': position.pos_id, 'dex': position.dex, 'symbol': position.symbol,
+                'block_number': block_identifier, 'error': str(exc)})
+    return row
+
+
+def _build_chunk(positions: list, block_identifier: int, apy_inputs: tuple) -> list[dict]:
+    start = time.perf_counter()
+    try:
+        snapshots = take_snapshots(positions, block_identifier, apy_inputs is not None, apy_inputs)
+        rows = [snapshot_to_row(snapshot) for snapshot in snapshots]
+    except Exception:
+        # Isolate the failing position(s) so that one bad position does not drop the whole chunk
+        rows = []
+        for position in positions:
+            try:
+                snapshot = take_snapshots([position], block_identifier, apy_inputs is not None, apy_inputs)[0]
+                rows.append(snapshot_to_row(snapshot))
+            except Exception as exc:
+                rows.append(_error_row(position, block_identifier, exc))
+
+    # Rows of a chunk are fetched together, so there is no per-position timing: only the chunk's time per row
+    seconds_per_row = (time.perf_counter() - start) / max(len(rows), 1)
+    for row in rows:
+        row['chunk_seconds_per_row'] = seconds_per_row
+    return rows
+
+
+def stream_rows(positions: list, max_workers: int = REPORT_MAX_WORKERS, chunk_size: int = REPORT_CHUNK_SIZE,
+                block_identifier: Union[str, int] = "latest", apy: bool = True) -> Iterator[dict]:
+    """
+    Build report rows concurrently, yielding them in the order of positions as soon as they are ready.
+
+    Positions are snapshotted chunk_size at a time (one take_snapshots() call per chunk) on a pool of max_workers
+    threads. At most 2 * max_workers chunks are in flight, so memory stays constant however many positions are
+    reported. Every chunk is read at the same block.
+
+    :param positions: AvalanchePosition objects (read with the first position's provider)
+    :param max_workers: Number of worker threads
+    :param chunk_size: Number of positions snapshotted per worker task
+    :param block_identifier: The block to report at ("latest" is resolved to a block number once)
+    :param apy: Whether to include the APY columns (the APY inputs are fetched once for the whole report)
+    :return: Iterator of report rows (REPORT_COLUMNS); failed positions yield a row with the error column set
+    """
+    positions = list(positions)
+    if len(positions) == 0:
+        return
+
+    if not isinstance(block_identifier, int):
+        block_identifier = positions[0].web3_provider.eth.get_block(block_identifier)['number']
+
+    apy_inputs = None
+    if apy:
+        try:
+            apy_inputs = fetch_apy_inputs(positions[0]._platform.network_chain_id)
+        except Exception as exc:
+            print(f"Could not fetch APY data for the report - {exc}")
+
+    chunks = (positions[i:i + chunk_size] for i in range(0, len(positions), chunk_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(executor.submit(_build_chunk, chunk, block_identifier, apy_inputs))
+            if len(in_flight) >= 2 * max_workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+class ReportWriter(ABC):
+    """Incrementally writes report rows to a file. Use as a context manager, or call close() when done."""
+    def __init__(self, path: str, columns: list[str] = None):
+        """
+        :param path: The output file path
+        :param columns: The columns to write (defaults to REPORT_COLUMNS)
+        """
+        self.path = path
+        self.columns = REPORT_COLUMNS if columns is None else columns
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @abstractmethod
+    def write(self, row: dict) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class CSVReportWriter(ReportWriter):
+    def __init__(self, path: str, columns: list[str] = None):
+        super().__init__(path, columns)
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write(self, row: dict) -> None:
+        self._writer.writerow(row)
+        self.rows_written += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JSONLinesReportWriter(ReportWriter):
+    def __init__(self, path: str, columns: list[str] = None):
+        super().__init__(path, columns)
+        self._file = open(path, 'w')
+
+    def write(self, row: dict) -> None:
+        self._file.write(json.dumps({column: row.get(column) for column in self.columns}) + "\n")
+        self.rows_written += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetReportWriter(ReportWriter):
+    """Buffers row_group_size rows at a time and writes each buffer as a Parquet row group (requires pyarrow)"""
+    def __init__(self, path: str, columns: list[str] = None, row_group_size: int = 1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("pyarrow is required to write Parquet reports: pip install pyarrow")
+
+        super().__init__(path, columns)
+        self.row_group_size = row_group_size
+        self._pa = pa
+        self._schema = pa.schema([(column, self._column_type(column)) for column in self.columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._buffer: list[dict] = []
+
+    def _column_type(self, column: str):
+        if column in ('position_id', 'block_number', 'timestamp'):
+            return self._pa.int64()
+        if column in ('dex', 'symbol', 'reward_token_symbol', 'error'):
+            return self._pa.string()
+        return self._pa.float64()
+
+    def write(self, row: dict) -> None:
+        self._buffer.append(row)
+        self.rows_written += 1
+        if len(self._buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if len(self._buffer) == 0:
+            return
+        data = {}
+        for column in self.columns:
+            values = [row.get(column) for row in self._buffer]
+            if self._schema.field(column).type == self._pa.float64():
+                # Integer metrics (e.g. some reward amounts) are not implicitly converted to float64 by pyarrow
+                values = [None if value is None else float(value) for value in values]
+            data[column] = values
+        table = self._pa.Table.from_pydict(data, schema=self._schema)
+        self._writer.write_table(table)
+        self._buffer = []
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+REPORT_WRITERS = {'.csv': CSVReportWriter, '.jsonl': JSONLinesReportWriter, '.parquet': ParquetReportWriter}
+
+
+def get_report_writer(path: str, fmt: str = None, columns: list[str] = None) -> ReportWriter:
+    """
+    :param path: The output file path
+    :param fmt: (optional) One of 'csv', 'jsonl' or 'parquet' (inferred from the path's extension if not given)
+    :param columns: The columns to write (defaults to REPORT_COLUMNS)
+    """
+    extension = splitext(path)[1].lower() if fmt is None else "." + fmt.lower().lstrip(".")
+    if extension not in REPORT_WRITERS:
+        raise ValueError(f"Unsupported report format: {extension} (expected one of {list(REPORT_WRITERS)})")
+    return REPORT_WRITERS[extension](path, columns)
+
+
+def generate_report(positions: list, path: str, fmt: str = None, max_workers: int = REPORT_MAX_WORKERS,
+                    chunk_size: int = REPORT_CHUNK_SIZE, block_identifier: Union[str, int] = "latest",
+                    apy: bool = True, verbose: bool = True) -> dict:
+    """
+    Write a position report to CSV, JSON Lines or Parquet, streaming rows to the file as they are built
+
+    :param positions: AvalanchePosition objects
+    :param path: The output file path
+    :param fmt: (optional) One of 'csv', 'jsonl' or 'parquet' (inferred from the path's extension if not given)
+    :param max_workers: Number of worker threads (see stream_rows())
+    :param chunk_size: Number of positions snapshotted per worker task (see stream_rows())
+    :param block_identifier: The block to report at
+    :param apy: Whether to include the APY columns
+    :param verbose: Print each row's position and its chunk's time per row as it is written
+    :return: (dict) rows, errors and elapsed_seconds of the report
+    """
+    start = time.perf_counter()
+    errors = 0
+    with get_report_writer(path, fmt) as writer:
+        for row in stream_rows(positions, max_workers, chunk_size, block_identifier, apy):
+            writer.write(row)
+            if row['error'] is not None:
+                errors += 1
+            if verbose:
+                status = f"failed - {row['error']}" if row['error'] is not None \
+                    else f"{row['chunk_seconds_per_row']:.3f}s/row"
+                print(f"Processed #{row['position_id']} {row['symbol']} {row['dex']} ({status})")
+
+    return {"rows": writer.rows_written, "errors": errors, "elapsed_seconds": time.perf_counter() - start}
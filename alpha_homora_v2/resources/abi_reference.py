@@ -12,6 +12,9 @@ AggregatorOracle_ABI = 'AggregatorOracle_ABI.json','0xc842CC25FE89F0A60Fe9C1fd64
 ISafeOracle_ABI = 'ISafeOracle_ABI.json', '0xdB90a1A31ff72976b6F2f009e77131673404180b'
 WERC20_ABI = 'WERC20ABI.json', '0x496Aa991Cf3952264f284355371cD190ddcc8588'
 
+# Multicall3 (same address on every supported network)
+Multicall3_ABI = 'Multicall3_ABI.json', '0xcA11bde05977b3631167028862bE2a173976CA11'
+
 # Avalanche - Trader Joe:
 WMasterchefJoeV2_ABI = "WMasterchefJoeV2_ABI.json", '0xB41DE9c1f50697cC3Fd63F24EdE2B40f6269CBcb'
 MasterChefJoeV2_ABI = "MasterChefJoeV2_ABI.json", "0xd6a4F121CA35509aF06A0Be99093d08462f53052"
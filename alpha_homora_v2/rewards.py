@@ -0,0 +1,256 @@
+from threading import Lock
+from typing import Union
+import time
+
+from .util import ContractInstanceFunc, load_abi
+from .resources.abi_reference import HomoraBank_ABI
+from .provider import avalanche_provider
+from .multicall import Multicall
+from .oracles import price_service
+from ._config import REWARD_RESYNC_INTERVAL
+
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from web3._utils.events import get_event_data
+
+# Reward accumulators of every supported staking contract are scaled by 1e12
+ACC_REWARD_PRECISION = 10 ** 12
+
+EXECUTE_TOPIC = Web3.keccak(text="Execute(address,uint256,address)")
+
+
+class RewardEngine:
+    """
+    Projects pending farming rewards locally from cached staking pool state.
+
+    For each staking pool (staking contract, pid) the engine caches the reward-per-share accumulator, its last update
+    timestamp, the pool's allocation points and the contract's emission parameters and staked LP balance, and
+    replays the staking contract's accrual formula for any timestamp. Positions' collateral ids and sizes are cached
+    as well, so projecting rewards costs no RPC until a pool is resynced.
+
+    A pool (or position) is resynced when it is older than resync_interval seconds, when invalidate() is called, or
+    when poll_events() sees one of its staking contract events (or a HomoraBank Execute for a position).
+    Stale positions and pools are resynced in at most two Multicalls (position info first, as it holds the pid).
+
+    Supported: Pangolin V2 (MiniChefV2) and Trader Joe WMasterChef (MasterChefJoeV2) and WMasterChefJoeV3 pools.
+    Boosted (WBoostedMasterChefJoe) pools are not projected: their cached rewards are returned until they are
+    resynced.
+    """
+    def __init__(self, resync_interval: float = REWARD_RESYNC_INTERVAL, web3_provider: Web3 = None):
+        """
+        :param resync_interval: Seconds cached pool and position state is used before it is read again
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        """
+        self.resync_interval = resync_interval
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self._bank = ContractInstanceFunc(self.web3_provider, *HomoraBank_ABI)
+        # (staking address, pid) -> pool state, and position id -> (coll_id, collateral_size, synced_at)
+        self._pools: dict[tuple[str, int], dict] = {}
+        self._positions: dict[int, tuple[int, int, float]] = {}
+        # Staking contract address -> ABI filename, for event decoding
+        self._staking_abis: dict[str, str] = {}
+        self._last_event_block = None
+        self._lock = Lock()
+
+    """ -------------------- PROJECTIONS: -------------------- """
+
+    def get_rewards_value(self, position, timestamp: float = None) -> dict:
+        """
+        Project the position's pending rewards (same output as AvalanchePosition.get_rewards_value())
+
+        :param position: AvalanchePosition
+        :param timestamp: (optional) Unix timestamp to project the rewards at (defaults to now)
+        """
+        reward_amount = self.get_pending_rewards(position, timestamp)
+        reward_token_symbol, reward_token_address = [v for k, v in position.pool["exchange"]["reward"].items()]
+        return {"reward_token": reward_amount,
+                "reward_usd": reward_amount * price_service.get_price(position.reward_token_symbol),
+                "reward_token_address": reward_token_address, "reward_token_symbol": reward_token_symbol}
+
+    def get_pending_rewards(self, position, timestamp: float = None) -> float:
+        """
+        Project the position's pending rewards, in the reward token
+
+        :param position: AvalanchePosition
+        :param timestamp: (optional) Unix timestamp to project the rewards at (defaults to now)
+        """
+        self.sync([position])
+        coll_id, collateral_size, _ = self._positions[position.pos_id]
+        pool = self._pools[self._pool_key(position, coll_id)]
+
+        pool_info = dict(pool["pool_info"])
+        pool_info["entryRewardPerShare"] = position._platform.decode_collid(coll_id)[1]
+        pool_info["accRewardPerShare"] = self.project_acc_reward_per_share(
+            pool, time.time() if timestamp is None else timestamp)
+        return position.reward_amount_from_state(pool_info, collateral_size)
+
+    @staticmethod
+    def project_acc_reward_per_share(pool: dict, timestamp: float) -> int:
+        """
+        Replay the staking contract's pool update to get its reward-per-share accumulator at the timestamp
+
+        :param pool: Cached pool state (see sync())
+        :param timestamp: Unix timestamp to project the accumulator at
+        """
+        pool_info = pool["pool_info"]
+        acc_reward_per_share = pool_info["accRewardPerShare"]
+        if pool["kind"] is None:
+            return acc_reward_per_share
+
+        end = int(timestamp)
+        if pool["rewards_expiration"] is not None:
+            end = min(end, pool["rewards_expiration"])
+        elapsed = end - pool_info["lastRewardTimestamp"]
+        if elapsed <= 0 or pool["lp_supply"] == 0 or pool["total_alloc_point"] == 0:
+            return acc_reward_per_share
+
+        reward = elapsed * pool["reward_per_second"] * pool_info["allocPoint"] // pool["total_alloc_point"]
+        reward = reward * pool["lp_percent"] // 1000
+        return acc_reward_per_share + reward * ACC_REWARD_PRECISION // pool["lp_supply"]
+
+    """ -------------------- SYNCING: -------------------- """
+
+    def sync(self, positions: list, force: bool = False) -> None:
+        """
+        Read the state of the positions' stale pools and collateral info (one Multicall each)
+
+        :param positions: AvalanchePosition objects (read with the first position's provider)
+        :param force: Resync even if the cached state is fresh
+        """
+        now = time.time()
+        web3_provider = positions[0].web3_provider if len(positions) > 0 else self.web3_provider
+        with self._lock:
+            # Position info first (the collateral id holds the pid), then the pools
+            stale_positions = [position for position in positions if force or self._is_stale(
+                self._positions.get(position.pos_id), now, lambda state: state[2])]
+            if len(stale_positions) > 0:
+                with Multicall(web3_provider) as batch:
+                    reads = [(position, batch.add(self._bank.functions.getPositionInfo(position.pos_id)))
+                             for position in stale_positions]
+                for position, position_info in reads:
+                    owner, coll_token, coll_id, collateral_size = position_info.result
+                    self._positions[position.pos_id] = (coll_id, collateral_size, now)
+
+            stale_pools = {}
+            for position in positions:
+                coll_id = self._positions[position.pos_id][0]
+                key = self._pool_key(position, coll_id)
+                if key not in stale_pools and (force or self._is_stale(self._pools.get(key), now,
+                                                                       lambda state: state["synced_at"])):
+                    stale_pools[key] = (position, coll_id)
+            if len(stale_pools) == 0:
+                return
+
+            with Multicall(web3_provider) as batch:
+                reads = {key: self._prepare_pool(batch, position, coll_id)
+                         for key, (position, coll_id) in stale_pools.items()}
+            for key, pool in reads.items():
+                self._pools[key] = pool()
+
+    def _prepare_pool(self, batch: Multicall, position, coll_id: int):
+        platform = position._platform
+        staking = platform.staking_contract
+        kind = self._staking_kind(position)
+        self._staking_abis[staking.address.lower()] = platform.staking_contract_abi
+
+        pool_info = platform.prepare_pool_info(batch, coll_id)
+        total_alloc_point, reward_per_second, rewards_expiration, percents, lp_supply = None, None, None, [], None
+        if kind is not None:
+            total_alloc_point = batch.add(staking.functions.totalAllocPoint())
+            lp_token = ContractInstanceFunc(self.web3_provider, "ERC20_ABI.json", position.pool['lpTokenAddress'])
+            lp_supply = batch.add(lp_token.functions.balanceOf(staking.address))
+            if kind == "minichef":
+                reward_per_second = batch.add(staking.functions.rewardPerSecond())
+                rewards_expiration = batch.add(staking.functions.rewardsExpiration())
+            else:
+                reward_per_second = batch.add(staking.functions.joePerSec())
+            if kind == "masterchefv2":
+                percents = [batch.add(staking.functions.devPercent()), batch.add(staking.functions.treasuryPercent()),
+                            batch.add(staking.functions.investorPercent())]
+
+        def pool() -> dict:
+            info = pool_info()
+            return {"kind": kind, "synced_at": time.time(),
+                    "pool_info": {k: v for k, v in info.items() if k != "entryRewardPerShare"},
+                    "total_alloc_point": None if kind is None else total_alloc_point.result,
+                    "reward_per_second": None if kind is None else reward_per_second.result,
+                    "rewards_expiration": None if rewards_expiration is None else rewards_expiration.result,
+                    "lp_percent": 1000 - sum(percent.result for percent in percents),
+                    "lp_supply": None if kind is None else lp_supply.result}
+
+        return pool
+
+    def invalidate(self, staking_address: str = None, pid: int = None, position_id: int = None) -> None:
+        """
+        Drop cached state so that it is read again on the next projection
+
+        :param staking_address: (optional) Only drop the pools of this staking contract
+        :param pid: (optional) Only drop this pool of the staking contract
+        :param position_id: (optional) Only drop this position's collateral info
+        """
+        with self._lock:
+            if position_id is not None:
+                self._positions.pop(position_id, None)
+                return
+            if staking_address is None:
+                self._pools.clear()
+                self._positions.clear()
+                return
+            for key in list(self._pools):
+                if key[0] == staking_address.lower() and (pid is None or key[1] == pid):
+                    del self._pools[key]
+
+    def poll_events(self) -> int:
+        """
+        Invalidate the pools and positions touched by events since the last poll, with a single eth_getLogs over
+        every tracked staking contract and the HomoraBank (the first call only records the current block)
+
+        :return: The number of events seen
+        """
+        block_number = self.web3_provider.eth.block_number
+        if self._last_event_block is None:
+            self._last_event_block = block_number
+            return 0
+        if block_number <= self._last_event_block:
+            return 0
+
+        addresses = [Web3.toChecksumAddress(address) for address in self._staking_abis] + [self._bank.address]
+        logs = self.web3_provider.eth.get_logs({"address": addresses, "fromBlock": self._last_event_block + 1,
+                                                "toBlock": block_number})
+        for log in logs:
+            address = log["address"].lower()
+            if address == self._bank.address.lower():
+                if log["topics"][0] == EXECUTE_TOPIC:
+                    self.invalidate(position_id=int(log["topics"][2].hex(), 16))
+            else:
+                self.invalidate(address, self._decode_pid(address, log))
+
+        self._last_event_block = block_number
+        return len(logs)
+
+    def _decode_pid(self, staking_address: str, log) -> Union[int, None]:
+        """The pid of a staking contract event (None, i.e. every pool, if the event is not pool-specific)"""
+        abi_file = self._staking_abis.get(staking_address)
+        if abi_file is None:
+            return None
+        for event_abi in (item for item in load_abi(abi_file) if item.get("type") == "event"):
+            if event_abi_to_log_topic(event_abi) == bytes(log["topics"][0]):
+                args = get_event_data(self.web3_provider.codec, event_abi, log)["args"]
+                return args.get("pid")
+        return None
+
+    def _is_stale(self, state, now: float, synced_at) -> bool:
+        return state is None or now - synced_at(state) > self.resync_interval
+
+    @staticmethod
+    def _pool_key(position, coll_id: int) -> tuple[str, int]:
+        return position._platform.staking_contract.address.lower(), coll_id >> 240
+
+    @staticmethod
+    def _staking_kind(position) -> Union[str, None]:
+        if position.dex == "Pangolin V2":
+            return "minichef"
+        return {"WMasterChef": "masterchefv2", "WMasterChefJoeV3": "masterchefv3"}.get(position.pool['wTokenType'])
+
+
+reward_engine = RewardEngine()
@@ -0,0 +1,327 @@
+from threading import Event, Lock
+from typing import Any, Callable, Union
+from weakref import WeakSet
+import itertools
+import json
+import time
+
+from .metrics import MIDDLEWARE_NAME, rpc_metrics
+from ._config import RPC_BATCH_SIZE, RPC_BATCH_FLUSH_INTERVAL
+
+from web3 import Web3, HTTPProvider
+from web3._utils.encoding import Web3JsonEncoder
+from web3._utils.method_formatters import get_request_formatters, get_result_formatters
+from web3._utils.request import make_post_request
+from web3.providers.base import BaseProvider
+
+# Request ids of the JSON-RPC batches (unique across batches, so that a response can never be routed to another one)
+_request_ids = itertools.count()
+
+# HTTP providers whose node answered a batch with something else than a JSON array (batches are not tried again)
+_unsupported: WeakSet = WeakSet()
+
+
+def post_batch(provider: HTTPProvider, requests: list[tuple[str, Any]]) -> list[dict]:
+    """
+    Send JSON-RPC requests to an HTTP endpoint as a single batch (one JSON array payload)
+
+    :param provider: The endpoint
+    :param requests: (method, params) pairs
+    :raises TypeError: If the node does not support JSON-RPC batches
+    :return: The responses, in the order of requests (a request the node did not answer gets an error response)
+    """
+    if provider in _unsupported:
+        raise TypeError(f"{provider.endpoint_uri} does not support JSON-RPC batches")
+
+    ids = [next(_request_ids) for _ in requests]
+    payload = [{"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}
+               for request_id, (method, params) in zip(ids, requests)]
+    responses = json.loads(make_post_request(provider.endpoint_uri, json.dumps(payload, cls=Web3JsonEncoder).encode(),
+                                             **dict(provider.get_request_kwargs())))
+    if not isinstance(responses, list):
+        print(f"The RPC node {provider.endpoint_uri} does not support JSON-RPC batches, "
+              f"falling back to single requests")
+        _unsupported.add(provider)
+        raise TypeError(f"Expected a JSON-RPC batch response, got: {responses}")
+
+    by_id = {response.get("id"): response for response in responses}
+    return [by_id.get(request_id, {"jsonrpc": "2.0", "id": request_id,
+                                   "error": {"code": -32603, "message": "Missing from the JSON-RPC batch response"}})
+            for request_id in ids]
+
+
+def make_batch_request(provider: BaseProvider, requests: list[tuple[str, Any]]) -> list[dict]:
+    """
+    Send JSON-RPC requests as a single batch through a Web3 provider (below its middlewares)
+
+    HTTP providers post the batch to their endpoint; providers with a make_batch_request() method (see
+    provider_pool.ProviderPool and BatchingProvider) send it themselves.
+
+    :raises TypeError: If the provider or its node does not support JSON-RPC batches
+    :return: The responses, in the order of requests
+    """
+    if len(requests) == 0:
+        return []
+    if hasattr(provider, "make_batch_request"):
+        return provider.make_batch_request(requests)
+    if isinstance(provider, HTTPProvider):
+        return post_batch(provider, requests)
+    raise TypeError(f"{type(provider).__name__} does not support JSON-RPC batches")
+
+
+class RPCRequest:
+    """
+    A single JSON-RPC request queued on an RPCBatch.
+    The formatted result is available through the result property once the batch has been executed.
+    """
+    __slots__ = ("method", "params", "allow_failure", "default", "success", "_formatter", "_value", "_error")
+
+    def __init__(self, method: str, params: list, formatter: Callable[[Any], Any], allow_failure: bool = False,
+                 default: Any = None):
+        self.method = method
+        self.params = params
+        self.allow_failure = allow_failure
+        self.default = default
+        self.success = None
+        self._formatter = formatter
+        self._value = None
+        self._error = None
+
+    @property
+    def result(self) -> Any:
+        if self.success is None:
+            raise RuntimeError(f"The batch containing {self.method} has not been executed yet")
+        if not self.success and not self.allow_failure:
+            raise self._error
+        return self._value
+
+    def _set_response(self, response: dict) -> None:
+        if "error" in response:
+            self._set_error(ValueError(response["error"]))
+            return
+        self.success = True
+        self._value = self._formatter(response.get("result"))
+
+    def _set_error(self, error: Exception) -> None:
+        self.success = False
+        self._value = self.default
+        self._error = error
+
+
+class RPCBatch:
+    """
+    Sends many JSON-RPC requests in a single HTTP request (a JSON-RPC batch), for the reads that cannot be aggregated
+    through Multicall3 (transactions, receipts, nonces, blocks, gas estimates).
+
+    Can be used directly or as a context manager, in which case the batch is executed on exit:
+
+        with RPCBatch() as batch:
+            transactions = [batch.get_transaction(tx_hash) for tx_hash in tx_hashes]
+            nonce = batch.get_transaction_count(owner_address, "pending")
+        inputs = [transaction.result['input'] for transaction in transactions]
+
+    Params and results are formatted like the Web3 eth methods'. If the provider or node does not support batches,
+    the requests are sent one by one.
+    The batch is sent below the provider's middlewares: if the provider is instrumented (see metrics.rpc_metrics),
+    each batch is recorded as one request and its requests as batched calls.
+    """
+    def __init__(self, web3_provider: Web3 = None, batch_size: int = RPC_BATCH_SIZE):
+        """
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        :param batch_size: The maximum number of requests sent in a single batch
+        """
+        from .provider import avalanche_provider
+
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.batch_size = batch_size
+        self.requests: list[RPCRequest] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, method: str, params: list, allow_failure: bool = False, default: Any = None) -> RPCRequest:
+        """
+        Queue a JSON-RPC request
+
+        :param method: The JSON-RPC method (e.g. "eth_getTransactionByHash")
+        :param params: The method params, as passed to the equivalent Web3 eth method (e.g. int block numbers)
+        :param allow_failure: If True, an error response yields the default value instead of raising on access
+        :param default: The value returned for a failed request when allow_failure is set
+        :return: RPCRequest object holding the formatted result once the batch is executed
+        """
+        request = RPCRequest(method, get_request_formatters(method)(params),
+                             get_result_formatters(method, self.web3_provider.eth), allow_failure, default)
+        self.requests.append(request)
+        return request
+
+    def get_transaction(self, tx_hash: Union[bytes, str], **kwargs) -> RPCRequest:
+        return self.add("eth_getTransactionByHash", [tx_hash], **kwargs)
+
+    def get_transaction_receipt(self, tx_hash: Union[bytes, str], **kwargs) -> RPCRequest:
+        """Queue a receipt lookup (the result is None while the transaction is not mined)"""
+        return self.add("eth_getTransactionReceipt", [tx_hash], **kwargs)
+
+    def get_transaction_count(self, account: str, block_identifier: Union[str, int] = "latest",
+                              **kwargs) -> RPCRequest:
+        return self.add("eth_getTransactionCount", [account, block_identifier], **kwargs)
+
+    def get_block(self, block_identifier: Union[str, int], full_transactions: bool = False, **kwargs) -> RPCRequest:
+        method = "eth_getBlockByHash" if isinstance(block_identifier, bytes) or \
+            (isinstance(block_identifier, str) and block_identifier.startswith("0x")) else "eth_getBlockByNumber"
+        return self.add(method, [block_identifier, full_transactions], **kwargs)
+
+    def estimate_gas(self, transaction: dict, block_identifier: Union[str, int] = None, **kwargs) -> RPCRequest:
+        params = [transaction] if block_identifier is None else [transaction, block_identifier]
+        return self.add("eth_estimateGas", params, **kwargs)
+
+    def execute(self) -> list:
+        """
+        Send every pending request, batch_size requests per batch
+
+        :return: The results in the order the requests were added
+        """
+        pending = [request for request in self.requests if request.success is None]
+        for i in range(0, len(pending), self.batch_size):
+            chunk = pending[i:i + self.batch_size]
+            requests = [(request.method, request.params) for request in chunk]
+            start = time.perf_counter()
+            try:
+                responses = make_batch_request(self.web3_provider.provider, requests)
+            except TypeError:
+                responses = [self._make_request(request) for request in chunk]
+            except Exception:
+                if self._instrumented:
+                    rpc_metrics.record_rpc_batch(requests, None, time.perf_counter() - start)
+                raise
+            else:
+                if self._instrumented:
+                    rpc_metrics.record_rpc_batch(requests, responses, time.perf_counter() - start)
+            for request, response in zip(chunk, responses):
+                if isinstance(response, Exception):
+                    request._set_error(response)
+                else:
+                    request._set_response(response)
+
+        return [request.result for request in self.requests]
+
+    @property
+    def _instrumented(self) -> bool:
+        return MIDDLEWARE_NAME in self.web3_provider.middleware_onion
+
+    def _make_request(self, request: RPCRequest) -> Union[dict, Exception]:
+        start = time.perf_counter()
+        try:
+            response = self.web3_provider.provider.make_request(request.method, request.params)
+        except Exception as exc:
+            response = exc
+        if self._instrumented:
+            rpc_metrics.record_rpc(request.method, request.params, None if isinstance(response, Exception)
+                                   else response, time.perf_counter() - start)
+        return response
+
+
+class _QueuedRequest:
+    __slots__ = ("method", "params", "done", "response", "error")
+
+    def __init__(self, method: str, params: Any):
+        self.method = method
+        self.params = params
+        self.done = Event()
+        self.response = None
+        self.error = None
+
+
+class BatchingProvider(BaseProvider):
+    """
+    Web3 provider coalescing the requests that concurrent threads make into JSON-RPC batches.
+
+    A request waits up to flush_interval seconds for other requests to join it, then the queued requests are sent as
+    one batch (right away once max_batch_size requests are queued) and every response is routed back to its caller.
+    This cuts the HTTP round trips of threaded workloads, e.g. the report workers' eth_calls, at the cost of up to
+    flush_interval seconds of latency per request. Requests are sent one by one if the node rejects batches.
+
+        web3_provider = get_web3_provider(rpc_url, batch_requests=True)  # or Web3(BatchingProvider(provider))
+    """
+    def __init__(self, provider: BaseProvider, max_batch_size: int = RPC_BATCH_SIZE,
+                 flush_interval: float = RPC_BATCH_FLUSH_INTERVAL):
+        """
+        :param provider: The provider the batches are sent through (an HTTPProvider or a provider_pool.ProviderPool)
+        :param max_batch_size: The maximum number of requests sent in a single batch
+        :param flush_interval: Seconds the first queued request waits for others before the batch is sent
+        """
+        super().__init__()
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.batch_supported = True
+        self._queue: list[_QueuedRequest] = []
+        self._lock = Lock()
+
+    def __str__(self) -> str:
+        return f"Batching {self.provider}"
+
+    def make_request(self, method, params) -> dict:
+        if not self.batch_supported:
+            return self.provider.make_request(method, params)
+
+        request = _QueuedRequest(method, params)
+        with self._lock:
+            self._queue.append(request)
+            batch = self._queue
+            leader = len(batch) == 1
+            if len(batch) >= self.max_batch_size:
+                self._queue = []
+            else:
+                batch = None
+        if batch is not None:
+            self._send(batch)
+        elif leader and not request.done.wait(self.flush_interval):
+            # The first request of a batch sends it, unless it filled up and was sent in the meantime
+            with self._lock:
+                batch = self._queue if len(self._queue) > 0 and self._queue[0] is request else None
+                if batch is not None:
+                    self._queue = []
+            if batch is not None:
+                self._send(batch)
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.response
+
+    def make_batch_request(self, requests: list[tuple[str, Any]]) -> list[dict]:
+        responses = []
+        for i in range(0, len(requests), self.max_batch_size):
+            responses.extend(make_batch_request(self.provider, requests[i:i + self.max_batch_size]))
+        return responses
+
+    def _send(self, batch: list[_QueuedRequest]) -> None:
+        try:
+            if len(batch) == 1:
+                responses = [self.provider.make_request(batch[0].method, batch[0].params)]
+            else:
+                try:
+                    responses = make_batch_request(self.provider, [(request.method, request.params)
+                                                                   for request in batch])
+                except TypeError:
+                    self.batch_supported = False
+                    responses = [self.provider.make_request(request.method, request.params) for request in batch]
+        except Exception as exc:
+            for request in batch:
+                request.error = exc
+                request.done.set()
+            return
+
+        for request, response in zip(batch, responses):
+            request.response = response
+            request.done.set()
+
+    def isConnected(self) -> bool:
+        return self.provider.isConnected()
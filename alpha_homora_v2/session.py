@@ -0,0 +1,5 @@
+import requests
+
+# Shared by every Alpha Homora V2 and CREAM API request, so that connections are kept alive between requests and hooks
+# or adapters mounted on it (see metrics.py) apply to all of them
+http_session = requests.Session()
@@ -0,0 +1,107 @@
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Union
+
+from ._config import GAS_ESTIMATE_MARGIN
+
+from web3.contract import Contract
+from web3.exceptions import ContractLogicError
+
+
+@dataclass
+class SimulationResult:
+    """Outcome of a HomoraBank.execute() simulated at the latest block (the dry_run of the position methods)"""
+    success: bool
+    spell_function: str
+    position_id: Union[int, None]  # The value returned by execute() (the new position ID when opening one)
+    gas_estimate: Union[int, None]
+    revert_reason: Union[str, None]
+    # Tokens that must be approved before the execute: the simulation runs with the current allowances, so it
+    # reverts if this is not empty
+    approvals_required: list[str] = field(default_factory=list)
+
+
+class GasCache:
+    """
+    Gas estimates of HomoraBank.execute() per (spell function, pool, call shape), so that the harvests of harvest_all()
+    after the first of each pool skip the estimateGas round trip.
+
+    The call shape (see spell_call_shape()) holds the tokens of the call and which of its amounts are non-zero, so a
+    supply-only add and an add that borrows and swaps get separate estimates. The largest estimate seen is kept, and
+    get() adds a safety margin, as the gas used varies slightly with the amounts and the pool state.
+    Single transactions always estimate their gas, as the estimate also catches a revert before it is broadcast.
+    """
+    def __init__(self, margin: float = GAS_ESTIMATE_MARGIN):
+        """
+        :param margin: Multiplier applied to the cached estimate
+        """
+        self.margin = margin
+        self._estimates: dict[tuple[str, str, tuple], int] = {}
+        self._lock = Lock()
+
+    def get(self, spell_function: str, pool_key: str, call_shape: tuple = ()) -> Union[int, None]:
+        """Returns the gas limit to use (the cached estimate with the margin), or None if nothing is cached"""
+        estimate = self._estimates.get((spell_function, pool_key, call_shape))
+        return None if estimate is None else int(estimate * self.margin)
+
+    def record(self, spell_function: str, pool_key: str, gas: int, call_shape: tuple = ()) -> None:
+        with self._lock:
+            key = (spell_function, pool_key, call_shape)
+            self._estimates[key] = max(gas, self._estimates.get(key, 0))
+
+    def invalidate(self, pool_key: str = None) -> None:
+        """
+        :param pool_key: (optional) Only drop this pool's estimates
+        """
+        with self._lock:
+            for key in [key for key in self._estimates if pool_key is None or key[1] == pool_key]:
+                del self._estimates[key]
+
+
+gas_cache = GasCache()
+
+
+def spell_function_name(spell_contract: Contract, encoded_spell_func: str) -> str:
+    """Decode the spell function name from its encoded call data (no RPC)"""
+    return spell_contract.get_function_by_selector(encoded_spell_func[:10]).fn_name
+
+
+def spell_call_shape(spell_contract: Contract, encoded_spell_func: str) -> tuple:
+    """
+    Decode the shape of a spell call from its encoded call data (no RPC): its token addresses, and whether each of its
+    amounts (supplied, borrowed, repaid...) is non-zero
+    """
+    def shape(value):
+        if isinstance(value, (list, tuple)):
+            return tuple(shape(item) for item in value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value != 0
+        return value.lower() if isinstance(value, str) else value
+
+    _, params = spell_contract.decode_function_input(encoded_spell_func)
+    return tuple((name, shape(value)) for name, value in params.items() if name != "pid")
+
+
+def simulate_execute(position, encoded_spell_func: str, approvals_required: list[str] = None) -> SimulationResult:
+    """
+    Simulate the position's HomoraBank.execute() with eth_call, and estimate its gas if it succeeds
+
+    The gas estimate is recorded in the gas cache.
+
+    :param position: AvalanchePosition
+    :param encoded_spell_func: The encoded spell call (e.g. from SpellClient.prepare_add_liquidity())
+    :param approvals_required: (optional) Addresses of the tokens that would be approved before the execute
+    """
+    spell_function = spell_function_name(position._platform.spell_contract, encoded_spell_func)
+    bank_func = position._homora_bank.functions.execute(position.pos_id, position.spell_address, encoded_spell_func)
+    approvals_required = [] if approvals_required is None else approvals_required
+
+    try:
+        position_id = bank_func.call({"from": position.owner}, "latest")
+        gas = bank_func.estimateGas({"from": position.owner}, "latest")
+    except ContractLogicError as exc:
+        return SimulationResult(False, spell_function, None, None, str(exc), approvals_required)
+
+    gas_cache.record(spell_function, position.pool_key, gas,
+                     spell_call_shape(position._platform.spell_contract, encoded_spell_func))
+    return SimulationResult(True, spell_function, position_id, gas, None, approvals_required)
@@ -0,0 +1,186 @@
+from types import MappingProxyType
+from typing import Union
+
+from .multicall import Multicall, CallCache
+from .oracles import price_service
+from .util import checksum
+from .session import http_session
+from ._config import HOMORA_APYS_URL, CREAM_RATES_URL
+
+
+class PositionSnapshot:
+    """
+    Immutable view of a position's state at a single block, with every informational metric computed in memory.
+
+    Raw state:
+        pos_id, owner, pool_key, symbol, dex - position metadata
+        block_number, timestamp - the block every read was pinned to
+        collateral_size - the position's collateral (LP) size
+        lp_reserves, lp_supply - the pair reserves of the underlying tokens and the LP total supply
+        borrow_balances - the position's borrow balance of each underlying token
+        underlying_symbols, underlying_decimals - metadata of the underlying tokens
+        collateral_credit, borrow_credit - HomoraBank collateral and borrow values (in AVAX, 1e18)
+        fee_bps - the HomoraBank fee in basis points
+        prices - USD prices by symbol (CoinGecko, fetched alongside the snapshot)
+
+    Metrics (same output as the AvalanchePosition methods):
+        position_value, debt_ratio, leverage_ratio, rewards_value, current_apy (None if unavailable)
+        token_debts - tuple of (token address, symbol, debt in integer, debt in token, debt in USD)
+    """
+    __slots__ = ("pos_id", "owner", "pool_key", "symbol", "dex", "block_number", "timestamp",
+                 "collateral_size", "lp_reserves", "lp_supply", "borrow_balances",
+                 "underlying_symbols", "underlying_decimals", "collateral_credit", "borrow_credit", "fee_bps",
+                 "prices", "position_value", "debt_ratio", "leverage_ratio", "rewards_value", "token_debts",
+                 "current_apy")
+
+    def __init__(self, **state):
+        for name in self.__slots__:
+            object.__setattr__(self, name, state[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return f"<PositionSnapshot #{self.pos_id} {self.symbol} {self.dex} @ block {self.block_number}>"
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def fetch_apy_inputs(chain_id: int = 43114) -> tuple[dict, list[dict]]:
+    """
+    Fetch the off-chain inputs of current_apy: the Alpha Homora V2 APYs by pool key and the CREAM borrow rates
+    (pass them to take_snapshots() to share one fetch between many calls)
+    """
+    r = http_session.get(HOMORA_APYS_URL.format(chain_id=chain_id))
+    if r.status_code != 200:
+        raise Exception(f"{r.status_code}, {r.text}")
+    return r.json(), http_session.get(CREAM_RATES_URL).json()['borrowRates']
+
+
+def take_snapshots(positions: list, block_identifier: Union[str, int] = "latest",
+                   apy: bool = True, apy_inputs: tuple[dict, list[dict]] = None, prices: dict[str, float] = None,
+                   call_cache: CallCache = None) -> list[PositionSnapshot]:
+    """
+    Snapshot many positions at one pinned block.
+
+    A block_identifier that is not a block number is resolved to one first, then all contract reads for every
+    position are aggregated into two Multicall round trips pinned to that block (however many aggregate3 calls each
+    round trip is split into), prices are fetched in a single CoinGecko request, and the APY and CREAM rates
+    endpoints are fetched once.
+
+    :param positions: AvalanchePosition objects (read with the first position's provider)
+    :param block_identifier: The block to snapshot ("latest" is resolved to a block number before any read)
+    :param apy: Whether to fetch the APY inputs and compute current_apy
+    :param apy_inputs: (optional) Pre-fetched fetch_apy_inputs() result, used instead of fetching it
+    :param prices: (optional) USD prices by symbol used instead of the CoinGecko prices (e.g. the oracle prices at a
+                   past block, see oracles.prepare_oracle_prices()), including WAVAX, the price_symbols and the reward
+                   token of every position
+    :param call_cache: (optional) Cache of the read results at block numbers (see multicall.CallCache)
+    """
+    if len(positions) == 0:
+        return []
+
+    web3_provider = positions[0].web3_provider
+    block_number = block_identifier if isinstance(block_identifier, int) \
+        else web3_provider.eth.get_block(block_identifier)['number']
+    batch = Multicall(web3_provider, block_number, call_cache=call_cache)
+    timestamp = batch.add(batch.contract.functions.getCurrentBlockTimestamp())
+    fee_bps = batch.add(positions[0]._homora_bank.functions.feeBps())
+
+    reads = []
+    for position in positions:
+        bank = position._homora_bank.functions
+        lp_contract = position._platform.get_lp_contract(position.pool['lpTokenAddress'])
+        underlying_token_data = position.underlying_token_data
+        reads.append({
+            "underlying_token_data": underlying_token_data,
+            "position_info": batch.add(bank.getPositionInfo(position.pos_id)),
+            "position_debts": batch.add(bank.getPositionDebts(position.pos_id)),
+            "reserves": batch.add(lp_contract.functions.getReserves()),
+            "supply": batch.add(lp_contract.functions.totalSupply()),
+            "borrow_balances": [batch.add(bank.borrowBalanceCurrent(position.pos_id, checksum(token['address'])))
+                                for token in underlying_token_data],
+            "collateral_credit": batch.add(bank.getCollateralETHValue(position.pos_id)),
+            "borrow_credit": batch.add(bank.getBorrowETHValue(position.pos_id)),
+        })
+    batch.execute()
+
+    # Second round trip, for the reads that depend on the first one's results
+    pinned = Multicall(web3_provider, block_number, call_cache=call_cache)
+    for position, read in zip(positions, reads):
+        read["rewards_value"] = position.prepare_rewards_value(pinned, read["position_info"].result)
+        debt_tokens = read["position_debts"].result[0]
+        read["debt_symbols"] = [pinned.add(position.get_token(token, web3_provider=web3_provider).contract.functions
+                                           .symbol()) for token in debt_tokens]
+        read["token_debts"] = position.prepare_token_debts(pinned, read["position_debts"].result) \
+            if len(debt_tokens) > 0 else None
+    pinned.execute()
+
+    if prices is None:
+        symbols = {"WAVAX"}
+        for position in positions:
+            symbols.update(position.price_symbols)
+            symbols.add(position.reward_token_symbol)
+        prices = price_service.get_prices(symbols)
+
+    apy_data, cream_borrow_rates = None, None
+    if apy_inputs is not None:
+        apy_data, cream_borrow_rates = apy_inputs
+    elif apy:
+        try:
+            apy_data, cream_borrow_rates = fetch_apy_inputs(positions[0]._platform.network_chain_id)
+        except Exception as exc:
+            print(f"Could not fetch APY data for snapshots - {exc}")
+
+    snapshots = []
+    for position, read in zip(positions, reads):
+        underlying_token_data = read["underlying_token_data"]
+        collateral_size = read["position_info"].result[-1]
+        lp_reserves = tuple(read["reserves"].result[:2])
+        borrow_balances = tuple(balance.result for balance in read["borrow_balances"])
+
+        position_value = position.value_from_state(underlying_token_data, prices, collateral_size, lp_reserves,
+                                                   read["supply"].result, borrow_balances)
+        leverage_ratio = position.leverage_from_value(position_value)
+        try:
+            debt_ratio = read["borrow_credit"].result / read["collateral_credit"].result
+        except ZeroDivisionError:
+            debt_ratio = 0.0
+
+        token_debts = () if read["token_debts"] is None else tuple(
+            (arc20_token.address, symbol.result, debt, debt_token, debt_usd)
+            for (arc20_token, debt, debt_token, debt_usd), symbol
+            in zip(read["token_debts"](prices["WAVAX"]), read["debt_symbols"]))
+
+        current_apy = None
+        if apy_data is not None:
+            try:
+                current_apy = MappingProxyType(position.apy_from_state(
+                    apy_data[position.pool_key], leverage_ratio, cream_borrow_rates, fee_bps.result,
+                    [(symbol, debt_usd) for _, symbol, _, _, debt_usd in token_debts]))
+            except Exception as exc:
+                print(f"Could not get current APY for position #{position.pos_id} - {exc}")
+
+        snapshots.append(PositionSnapshot(
+            pos_id=position.pos_id, owner=position.owner, pool_key=position.pool_key, symbol=position.symbol,
+            dex=position.dex, block_number=block_number, timestamp=timestamp.result,
+            collateral_size=collateral_size, lp_reserves=lp_reserves, lp_supply=read["supply"].result,
+            borrow_balances=borrow_balances,
+            underlying_symbols=tuple(token['symbol'] for token in underlying_token_data),
+            underlying_decimals=tuple(int(token['precision']) for token in underlying_token_data),
+            collateral_credit=read["collateral_credit"].result, borrow_credit=read["borrow_credit"].result,
+            fee_bps=fee_bps.result, prices=MappingProxyType(dict(prices)),
+            position_value=MappingProxyType(position_value), debt_ratio=debt_ratio, leverage_ratio=leverage_ratio,
+            rewards_value=MappingProxyType(read["rewards_value"](prices[position.reward_token_symbol])),
+            token_debts=token_debts, current_apy=current_apy))
+
+    return snapshots
+
+
+def take_snapshot(position, block_identifier: Union[str, int] = "latest", apy: bool = True) -> PositionSnapshot:
+    """Snapshot a single position at one pinned block (see take_snapshots())"""
+    return take_snapshots([position], block_identifier, apy)[0]
@@ -2,6 +2,10 @@ import json
 from os.path import join, abspath, dirname
 from os import getcwd, pardir
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Union
+import time
 
 import web3.eth
 from web3 import Web3
@@ -14,6 +18,8 @@ from .util import ContractInstanceFunc, checksum
 from .resources.abi_reference import *
 from .provider import avalanche_provider
 from .token import ARC20Token
+from .multicall import Multicall
+from ._config import POOL_INFO_CACHE_TTL, POOL_INFO_CACHE_SIZE
 
 
 class SpellClient(ABC):
@@ -22,14 +28,19 @@ class SpellClient(ABC):
     @abstractmethod
     def __init__(self, network_chain_id: int, abi_filename: str, contract_address: str,
                  wrapper_contract_abi: str, wrapper_contract_address: str,
-                 staking_contract_filename: str, staking_contract_address: str):
+                 staking_contract_filename: str, staking_contract_address: str, web3_provider: Web3 = None):
         self.network_chain_id = network_chain_id
-        self.spell_contract = ContractInstanceFunc(avalanche_provider, abi_filename, contract_address)
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.spell_contract = ContractInstanceFunc(self.web3_provider, abi_filename, contract_address)
         self.address = Web3.toChecksumAddress(contract_address)
-        self.wrapper_contract = ContractInstanceFunc(avalanche_provider,
+        self.wrapper_contract = ContractInstanceFunc(self.web3_provider,
                                                      wrapper_contract_abi, wrapper_contract_address)
-        self.staking_contract = ContractInstanceFunc(avalanche_provider,
+        self.staking_contract = ContractInstanceFunc(self.web3_provider,
                                                      staking_contract_filename, staking_contract_address)
+        self.staking_contract_abi = staking_contract_filename
+        # (coll_id, block_identifier) -> (time fetched, get_pool_info() result)
+        self._pool_info_cache: OrderedDict = OrderedDict()
+        self._pool_info_lock = Lock()
 
     @abstractmethod
     def prepare_claim_all_rewards(self) -> ContractFunction:
@@ -96,16 +107,47 @@ class SpellClient(ABC):
         Get the PID for the given token id used as collateral (collid)
         Position must be on the same platform as the spell.
 
+        The wrapper contracts' decodeId() is a pure function (pid << 240 | rewardPerShare), so the id is decoded
+        locally instead of spending a round trip on it.
+
         :return: PID, entryRewardPerShare
         """
-        return self.wrapper_contract.functions.decodeId(coll_id).call()
+        return [coll_id >> 240, coll_id & ((1 << 240) - 1)]
 
     @abstractmethod
-    def get_pool_info(self, coll_id) -> dict:
+    def get_pool_info(self, coll_id, block_identifier: Union[str, int] = "latest") -> dict:
         """
         SEE SPELL CLIENTS FOR RETURN VALUES
 
         Returns a dict with key value pairs since the output is variable depending on the platform.
+
+        Results are memoized per collateral id: for a block number, until evicted; for "latest", for
+        POOL_INFO_CACHE_TTL seconds (about one block).
+        """
+        key = (coll_id, block_identifier)
+        with self._pool_info_lock:
+            cached = self._pool_info_cache.get(key)
+        if cached is not None and (isinstance(block_identifier, int)
+                                   or time.monotonic() - cached[0] < POOL_INFO_CACHE_TTL):
+            return dict(cached[1])
+
+        with Multicall(self.web3_provider, block_identifier) as batch:
+            pool_info = self.prepare_pool_info(batch, coll_id)
+        result = pool_info()
+
+        with self._pool_info_lock:
+            self._pool_info_cache[key] = (time.monotonic(), result)
+            self._pool_info_cache.move_to_end(key)
+            while len(self._pool_info_cache) > POOL_INFO_CACHE_SIZE:
+                self._pool_info_cache.popitem(last=False)
+        return dict(result)
+
+    @abstractmethod
+    def prepare_pool_info(self, batch: Multicall, coll_id) -> Callable[[], dict]:
+        """
+        Queue the reads for get_pool_info() on a Multicall batch
+
+        :return: A function returning the get_pool_info() dict once the batch has been executed
         """
         pass
 
@@ -123,7 +165,7 @@ class SpellClient(ABC):
 
 class TraderJoeClient(SpellClient):
     def __init__(self, spell_address: str, w_token_type: str, w_token_address: str,
-                 staking_address: str):
+                 staking_address: str, web3_provider: Web3 = None):
         spell_contract = (TraderJoeSpellV1_ABI[0], spell_address)
         wrapper_contract = (TRADERJOE_ABI_REF[w_token_type]['wrapper'], w_token_address)
         staking_contract = (TRADERJOE_ABI_REF[w_token_type]['staking'], staking_address)
@@ -131,7 +173,7 @@ class TraderJoeClient(SpellClient):
         self.w_token_type = w_token_type
         self.w_token_address = w_token_address
 
-        super().__init__(43114, *spell_contract, *wrapper_contract, *staking_contract)
+        super().__init__(43114, *spell_contract, *wrapper_contract, *staking_contract, web3_provider)
 
     def prepare_claim_all_rewards(self) -> ContractFunction:
         return self.spell_contract.encodeABI(fn_name='harvestWMasterChef')
@@ -243,9 +285,10 @@ class TraderJoeClient(SpellClient):
                                              args=[underlying_tokens[0][0], underlying_tokens[1][0],
                                                    (amtLPTake, amtLPWithdraw, amtARepay, amtBRepay, amtLPRepay, amtAMin, amtBMin)])
 
-    def get_pool_info(self, coll_id) -> dict:
+    def get_pool_info(self, coll_id, block_identifier: Union[str, int] = "latest") -> dict:
         """
         :param coll_id: The coded collId as returned by HomoraBank.getPositionInfo()
+        :param block_identifier: The block to read the pool info at
 
         :return: (dict)
             pid - The decoded position ID (int)
@@ -256,39 +299,58 @@ class TraderJoeClient(SpellClient):
             accRewardPerShare - acc reward (JOE) per share (str)
             rewarderAddress - rewarder address (str)
         """
+        return super().get_pool_info(coll_id, block_identifier)
+
+    def prepare_pool_info(self, batch: Multicall, coll_id) -> Callable[[], dict]:
         pid, entryRewardPerShare = self.decode_collid(coll_id)
-        pool_info = self.staking_contract.functions.poolInfo(pid).call()
-        # print(self.w_token_type, pool_info)
-        if self.w_token_type in ["WMasterChef", "WMasterChefJoeV3"]:
-            lpTokenAddress = pool_info[0]
-            allocPoint = pool_info[1]
-            lastRewardTimestamp = pool_info[2]
-            accRewardPerShare = pool_info[3]
-            lpAmt = None
-            rewardDebt = None
-            wrapper_token_per_share = None
-        elif self.w_token_type == "WBoostedMasterChefJoe":
-            lpTokenAddress = pool_info[0]
-            allocPoint = pool_info[1]
-            lastRewardTimestamp = pool_info[4]
-            accRewardPerShare = pool_info[2]
-            wrapper_token_per_share = self.wrapper_contract.functions.accJoePerShare().call()
-            lpAmt, rewardDebt, _ = self.staking_contract.functions.userInfo(pid, checksum(self.w_token_address)).call()
-        else:
+        if self.w_token_type not in ["WMasterChef", "WMasterChefJoeV3", "WBoostedMasterChefJoe"]:
             raise NotImplementedError(f"Wrapper contract for the wrapper token type '{self.w_token_type}' is not implemented.")
 
-        return {"pid": pid, "entryRewardPerShare": entryRewardPerShare, "lpTokenAddress": lpTokenAddress,
-                "allocPoint": allocPoint, "lastRewardTimestamp": lastRewardTimestamp,
-                "accRewardPerShare": accRewardPerShare,
-                "lpAmt": lpAmt, "rewardDebt": rewardDebt, "wrapper_token_per_share": wrapper_token_per_share}
+        pool_info_call = batch.add(self.staking_contract.functions.poolInfo(pid))
+        if self.w_token_type == "WBoostedMasterChefJoe":
+            wrapper_token_per_share_call = batch.add(self.wrapper_contract.functions.accJoePerShare())
+            user_info_call = batch.add(self.staking_contract.functions.userInfo(pid, checksum(self.w_token_address)))
+
+        def pool_info() -> dict:
+            pool_info = pool_info_call.result
+            if self.w_token_type == "WMasterChef":
+                lpTokenAddress = pool_info[0]
+                allocPoint = pool_info[1]
+                lastRewardTimestamp = pool_info[2]
+                accRewardPerShare = pool_info[3]
+                lpAmt = None
+                rewardDebt = None
+                wrapper_token_per_share = None
+            elif self.w_token_type == "WMasterChefJoeV3":  # MasterChefJoeV3 orders its pool info differently
+                lpTokenAddress = pool_info[0]
+                accRewardPerShare = pool_info[1]
+                lastRewardTimestamp = pool_info[2]
+                allocPoint = pool_info[3]
+                lpAmt = None
+                rewardDebt = None
+                wrapper_token_per_share = None
+            else:
+                lpTokenAddress = pool_info[0]
+                allocPoint = pool_info[1]
+                lastRewardTimestamp = pool_info[4]
+                accRewardPerShare = pool_info[2]
+                wrapper_token_per_share = wrapper_token_per_share_call.result
+                lpAmt, rewardDebt, _ = user_info_call.result
+
+            return {"pid": pid, "entryRewardPerShare": entryRewardPerShare, "lpTokenAddress": lpTokenAddress,
+                    "allocPoint": allocPoint, "lastRewardTimestamp": lastRewardTimestamp,
+                    "accRewardPerShare": accRewardPerShare,
+                    "lpAmt": lpAmt, "rewardDebt": rewardDebt, "wrapper_token_per_share": wrapper_token_per_share}
+
+        return pool_info
 
     def get_lp_contract(self, lp_token_address: str) -> web3.eth.Contract:
-        return ContractInstanceFunc(avalanche_provider, TraderJoeLP_ABI[0], lp_token_address)
+        return ContractInstanceFunc(self.web3_provider, TraderJoeLP_ABI[0], lp_token_address)
 
 
 class PangolinV2Client(SpellClient):
-    def __init__(self):
-        super().__init__(43114, *PangolinSpellV2_ABI, *WMiniChefPNG_ABI, *MiniChefV2_ABI)
+    def __init__(self, web3_provider: Web3 = None):
+        super().__init__(43114, *PangolinSpellV2_ABI, *WMiniChefPNG_ABI, *MiniChefV2_ABI, web3_provider)
 
     def prepare_claim_all_rewards(self) -> ContractFunction:
         return self.spell_contract.encodeABI(fn_name='harvestWMiniChefRewards')
@@ -401,9 +463,10 @@ class PangolinV2Client(SpellClient):
                                                    (amtLPTake, amtLPWithdraw, amtARepay, amtBRepay, amtLPRepay, amtAMin,
                                                     amtBMin)])
 
-    def get_pool_info(self, coll_id) -> dict:
+    def get_pool_info(self, coll_id, block_identifier: Union[str, int] = "latest") -> dict:
         """
         :param coll_id: The coded collId as returned by HomoraBank.getPositionInfo()
+        :param block_identifier: The block to read the pool info at
 
         :return: (dict)
             pid - The decoded position ID (int)
@@ -412,10 +475,58 @@ class PangolinV2Client(SpellClient):
             lastRewardTimestamp - last reward timestamp (int)
             allocPoint - alloc point
         """
+        return super().get_pool_info(coll_id, block_identifier)
+
+    def prepare_pool_info(self, batch: Multicall, coll_id) -> Callable[[], dict]:
         pid, entryRewardPerShare = self.decode_collid(coll_id)
-        pool_info = self.staking_contract.functions.poolInfo(pid).call()
-        return {"pid": pid, "entryRewardPerShare": entryRewardPerShare, "accRewardPerShare": int(pool_info[0]),
-                "lastRewardTimestamp": pool_info[1], "allocPoint": pool_info[2]}
+        pool_info_call = batch.add(self.staking_contract.functions.poolInfo(pid))
+
+        def pool_info() -> dict:
+            pool_info = pool_info_call.result
+            return {"pid": pid, "entryRewardPerShare": entryRewardPerShare, "accRewardPerShare": int(pool_info[0]),
+                    "lastRewardTimestamp": pool_info[1], "allocPoint": pool_info[2]}
+
+        return pool_info
 
     def get_lp_contract(self, lp_token_address: str) -> web3.eth.Contract:
-        return ContractInstanceFunc(avalanche_provider, PangolinLiquidity_ABI[0], lp_token_address)
+        return ContractInstanceFunc(self.web3_provider, PangolinLiquidity_ABI[0], lp_token_address)
+
+
+# Spell clients interned by (provider, dex, spell address, wrapper token type, wrapper token address, staking address)
+_spell_clients: dict[tuple, SpellClient] = {}
+_spell_clients_lock = Lock()
+
+
+def get_spell_client(dex: str, spell_address: str = None, w_token_type: str = None, w_token_address: str = None,
+                     staking_address: str = None, web3_provider: Web3 = None) -> SpellClient:
+    """
+    Returns the shared spell client for the DEX and contracts, building it on first use
+
+    :param dex: The pool's exchange name ("Trader Joe" or "Pangolin V2")
+    :param spell_address: The spell contract address (Trader Joe only)
+    :param w_token_type: The wrapper token type, e.g. "WMasterChef" (Trader Joe only)
+    :param w_token_address: The wrapper token address (Trader Joe only)
+    :param staking_address: The staking (MasterChef) contract address (Trader Joe only)
+    :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+    """
+    web3_provider = avalanche_provider if web3_provider is None else web3_provider
+    if dex == "Pangolin V2":
+        key = (id(web3_provider), dex)
+    elif dex == "Trader Joe":
+        key = (id(web3_provider), dex, spell_address.lower(), w_token_type, w_token_address.lower(),
+               staking_address.lower())
+    else:
+        raise NotImplementedError(f"Spell client not yet implemented for the '{dex}' DEX. "
+                                  f"Please make sure that the dex entered is exactly as shown on your Alpha Homora V2 position.")
+
+    with _spell_clients_lock:
+        client = _spell_clients.get(key)
+        if client is None:
+            if dex == "Pangolin V2":
+                client = PangolinV2Client(web3_provider)
+            else:
+                client = TraderJoeClient(spell_address=spell_address, w_token_type=w_token_type,
+                                         w_token_address=w_token_address, staking_address=staking_address,
+                                         web3_provider=web3_provider)
+            _spell_clients[key] = client
+    return client
@@ -1,14 +1,20 @@
 from .util import checksum, ContractInstanceFunc
 from .provider import avalanche_provider
 
+from web3 import Web3
 from web3.contract import ContractFunction
 
 
 class ARC20Token:
     """Models all of the needed methods by this package to interact with ARC20 tokens"""
-    def __init__(self, address: str):
+    def __init__(self, address: str, web3_provider: Web3 = None):
+        """
+        :param address: The token contract address
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        """
         self.address = checksum(address)
-        self.contract = ContractInstanceFunc(avalanche_provider, "ERC20_ABI.json", address)
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.contract = ContractInstanceFunc(self.web3_provider, "ERC20_ABI.json", address)
 
     def name(self) -> str:
         return self.contract.functions.name().call()
@@ -0,0 +1,262 @@
+from dataclasses import dataclass, field
+from math import ceil
+from threading import Lock
+from typing import Union
+import time
+
+from .util import checksum
+from .provider import avalanche_provider
+from .receipt import ReceiptService, receipt_service
+from .rpc_batch import RPCBatch
+from ._config import TRANSACTION_RECEIPT_TIMEOUT, TRANSACTION_POLL_INTERVAL, TRANSACTION_STUCK_TIMEOUT, \
+    TRANSACTION_FEE_BUMP, TRANSACTION_MAX_REPLACEMENTS
+
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.contract import ContractFunction
+from web3.exceptions import ContractLogicError, TimeExhausted
+
+# Revert messages of a token transfer pulling more than its allowance (in lower case), as when the approvals a call
+# spends are still pending
+ALLOWANCE_REVERT_MESSAGES = ("allowance", "transfer_from_failed", "transferfrom failed",
+                             "safeerc20: low-level call failed")
+
+
+def is_allowance_revert(exc: Exception) -> bool:
+    """Whether a call or gas estimate reverted because a token transfer exceeded its allowance"""
+    return any(message in str(exc).lower() for message in ALLOWANCE_REVERT_MESSAGES)
+
+
+@dataclass
+class PendingTransaction:
+    """A transaction broadcast by a TransactionManager, tracked until one of its versions is mined"""
+    nonce: int
+    transaction: dict  # Parameters of the latest broadcast version
+    tx_hashes: list[HexBytes]  # Every broadcast version, the original first
+    broadcast_at: float = field(default_factory=time.time)
+    replacements: int = 0
+    receipt: Union[dict, None] = None
+    error: Union[Exception, None] = None
+
+    @property
+    def tx_hash(self) -> HexBytes:
+        return self.tx_hashes[-1]
+
+    @property
+    def done(self) -> bool:
+        return self.receipt is not None or self.error is not None
+
+
+class TransactionManager:
+    """
+    Signs and broadcasts an account's transactions with locally tracked nonces.
+
+    The next nonce is read from the node once (pending block) and then incremented locally, so a sequence of
+    transactions (e.g. token approvals followed by a HomoraBank execute()) is broadcast back-to-back and mined in the
+    same block, and their receipts are awaited together:
+
+        manager = get_transaction_manager(owner_address, owner_private_key)
+        pending = [manager.send(token.prepare_approve(spender)), manager.send(encoded_bank_func)]
+        receipts = manager.wait_all(pending)
+
+    A transaction that is not mined after stuck_timeout seconds is re-signed at the same nonce with fees raised by
+    fee_bump. This both unsticks an underpriced transaction and fills the nonce gap left by one dropped from the
+    mempool, which would otherwise block every later nonce. A "nonce too low" broadcast error (the account was used
+    outside of the manager) resyncs the nonce from the node.
+    """
+    def __init__(self, account: str, private_key: str, web3_provider: Web3 = None,
+                 receipt_timeout: float = TRANSACTION_RECEIPT_TIMEOUT, poll_interval: float = TRANSACTION_POLL_INTERVAL,
+                 stuck_timeout: float = TRANSACTION_STUCK_TIMEOUT, fee_bump: float = TRANSACTION_FEE_BUMP,
+                 max_replacements: int = TRANSACTION_MAX_REPLACEMENTS):
+        """
+        :param account: The wallet address sending the transactions
+        :param private_key: The private key of the wallet
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        :param receipt_timeout: Seconds wait_all() waits for the receipts before raising TimeExhausted
+        :param poll_interval: Seconds between receipt polls
+        :param stuck_timeout: Seconds before an unmined transaction is replaced
+        :param fee_bump: Fee multiplier of a replacement transaction
+        :param max_replacements: Maximum number of times a transaction is replaced
+        """
+        self.account = checksum(account)
+        self.private_key = private_key
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.receipt_timeout = receipt_timeout
+        self.poll_interval = poll_interval
+        self.stuck_timeout = stuck_timeout
+        self.fee_bump = fee_bump
+        self.max_replacements = max_replacements
+        self.receipt_service = receipt_service if web3_provider is None else ReceiptService(self.web3_provider)
+
+        self._nonce = None
+        self._lock = Lock()
+
+    @property
+    def next_nonce(self) -> Union[int, None]:
+        """The nonce of the next transaction (None until the first transaction or sync_nonce())"""
+        return self._nonce
+
+    def sync_nonce(self) -> int:
+        """Read the next nonce from the node's pending block, discarding the local nonce"""
+        with self._lock:
+            self._nonce = self.web3_provider.eth.get_transaction_count(self.account, "pending")
+            return self._nonce
+
+    """ -------------------- SENDING: -------------------- """
+
+    def send(self, function_call: ContractFunction, tx_params: dict = None,
+             gas_limit: int = None) -> PendingTransaction:
+        """
+        Build, sign and broadcast a contract call at the next nonce, without waiting for it to be mined
+
+        :param function_call: The uncalled and prepared contract method
+        :param tx_params: (optional) Transaction parameters (e.g. value, gas)
+        :param gas_limit: (optional) Gas limit to use if the gas estimate reverts for lack of allowance, because the
+                          approvals the call spends are still pending (any other revert is raised)
+        """
+        params = {"from": self.account, **(tx_params or {})}
+        try:
+            transaction = function_call.buildTransaction(params)
+        except (ContractLogicError, ValueError) as exc:
+            if gas_limit is None or "gas" in params or not is_allowance_revert(exc):
+                raise
+            transaction = function_call.buildTransaction({**params, "gas": gas_limit})
+        return self.send_transaction(transaction)
+
+    def send_transaction(self, transaction: dict) -> PendingTransaction:
+        """
+        Sign and broadcast a built transaction at the next nonce (any nonce in the transaction is replaced)
+
+        :param transaction: Transaction parameters, with gas and fees filled (see ContractFunction.buildTransaction)
+        """
+        transaction = {k: v for k, v in transaction.items() if k != "nonce"}
+        with self._lock:
+            if self._nonce is None:
+                self._nonce = self.web3_provider.eth.get_transaction_count(self.account, "pending")
+            try:
+                tx_hash = self._broadcast({**transaction, "nonce": self._nonce})
+            except ValueError as exc:
+                if "nonce too low" not in str(exc).lower():
+                    raise
+                # The account sent transactions outside of this manager: resync and retry once
+                self._nonce = self.web3_provider.eth.get_transaction_count(self.account, "pending")
+                tx_hash = self._broadcast({**transaction, "nonce": self._nonce})
+            # The nonce is only consumed once the node accepted the transaction, so a failed broadcast leaves no gap
+            nonce = self._nonce
+            self._nonce += 1
+
+        return PendingTransaction(nonce, {**transaction, "nonce": nonce}, [tx_hash])
+
+    def _broadcast(self, transaction: dict) -> HexBytes:
+        signed_txn = self.web3_provider.eth.account.sign_transaction(transaction, private_key=self.private_key)
+        try:
+            return HexBytes(self.web3_provider.eth.send_raw_transaction(signed_txn.rawTransaction))
+        except ValueError as exc:
+            if "already known" in str(exc).lower():
+                return HexBytes(signed_txn.hash)
+            raise
+
+    """ -------------------- WAITING: -------------------- """
+
+    def wait(self, pending: PendingTransaction, timeout: float = None) -> dict:
+        """
+        Wait for a transaction's receipt (see wait_all())
+
+        :return: The transaction receipt (dict)
+        """
+        return self.wait_all([pending], timeout)[0]
+
+    def wait_all(self, pending_transactions: list[PendingTransaction], timeout: float = None) -> list[dict]:
+        """
+        Wait for the receipts of several transactions at once, replacing the oldest one if it is stuck
+
+        :param pending_transactions: Transactions returned by send()
+        :param timeout: (optional) Seconds to wait (defaults to receipt_timeout)
+        :return: The transaction receipts (dicts), in the order of pending_transactions
+        """
+        timeout = self.receipt_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        while True:
+            # Every version of every waiting transaction is looked up in one batch
+            waiting = [pending for pending in pending_transactions if not pending.done]
+            self._check_receipts(waiting)
+
+            waiting = [pending for pending in waiting if not pending.done]
+            if len(waiting) == 0:
+                break
+            # Later nonces cannot be mined before the lowest one, so only the lowest is ever replaced
+            lowest = min(waiting, key=lambda pending: pending.nonce)
+            if time.time() - lowest.broadcast_at >= self.stuck_timeout:
+                self._recover(lowest)
+
+            if time.time() >= deadline:
+                raise TimeExhausted(f"Transactions {[pending.tx_hash.hex() for pending in waiting]} "
+                                    f"were not mined after {timeout}s")
+            time.sleep(self.poll_interval)
+
+        for pending in pending_transactions:
+            if pending.error is not None:
+                raise pending.error
+        return [pending.receipt for pending in pending_transactions]
+
+    def _check_receipts(self, pending_transactions: list[PendingTransaction]) -> None:
+        receipts = self.receipt_service.get_receipts(tx_hash for pending in pending_transactions
+                                                     for tx_hash in pending.tx_hashes)
+        for pending in pending_transactions:
+            pending.receipt = next((receipts[tx_hash] for tx_hash in pending.tx_hashes
+                                    if receipts[tx_hash] is not None), None)
+
+    def _recover(self, pending: PendingTransaction) -> None:
+        with RPCBatch(self.web3_provider) as batch:
+            mined_nonce = batch.get_transaction_count(self.account, "latest")
+            gas_price = batch.add("eth_gasPrice", [])
+        if mined_nonce.result > pending.nonce:
+            # The nonce was mined: either one of our versions was mined since the last poll, or another transaction
+            self._check_receipts([pending])
+            if pending.receipt is None:
+                pending.error = Exception(f"Transaction {pending.tx_hash.hex()} was replaced by a transaction sent "
+                                          f"outside of the TransactionManager (nonce {pending.nonce})")
+            return
+
+        pending.broadcast_at = time.time()
+        if pending.replacements >= self.max_replacements:
+            return
+
+        transaction = dict(pending.transaction)
+        if "gasPrice" in transaction:
+            transaction["gasPrice"] = max(ceil(transaction["gasPrice"] * self.fee_bump), gas_price.result)
+        else:
+            transaction["maxFeePerGas"] = ceil(transaction["maxFeePerGas"] * self.fee_bump)
+            transaction["maxPriorityFeePerGas"] = ceil(transaction["maxPriorityFeePerGas"] * self.fee_bump)
+        try:
+            tx_hash = self._broadcast(transaction)
+        except ValueError as exc:
+            # Most likely mined in the meantime: the next poll will find the receipt
+            print(f"Could not replace transaction {pending.tx_hash.hex()} (nonce {pending.nonce}) - {exc}")
+            return
+
+        print(f"Replaced stuck transaction {pending.tx_hash.hex()} (nonce {pending.nonce}) with {tx_hash.hex()}")
+        pending.transaction = transaction
+        pending.tx_hashes.append(tx_hash)
+        pending.replacements += 1
+
+
+_transaction_managers: dict[str, TransactionManager] = {}
+_transaction_managers_lock = Lock()
+
+
+def get_transaction_manager(account: str, private_key: str, web3_provider: Web3 = None) -> TransactionManager:
+    """
+    Returns the shared TransactionManager of the account, so that every position of an owner draws its nonces from
+    the same counter, whatever provider the position uses
+
+    :param account: The wallet address sending the transactions
+    :param private_key: The private key of the wallet
+    :param web3_provider: The Web3 object used to interact with the chain if the account's manager does not exist
+                          yet (defaults to the Avalanche provider); an existing manager keeps its provider
+    """
+    key = account.lower()
+    with _transaction_managers_lock:
+        if key not in _transaction_managers:
+            _transaction_managers[key] = TransactionManager(account, private_key, web3_provider)
+        return _transaction_managers[key]
@@ -1,14 +1,24 @@
 from os.path import join, abspath, dirname
 from os import getcwd, pardir
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
 import json
-from typing import Union
-import csv
+from typing import Mapping, Union
+
+from ._config import CONTRACT_CACHE_SIZE
+from .registry import get_token_registry, get_pool_registry
+from .metrics import rpc_metrics
+from .provider_pool import ProviderPool
+from .rpc_batch import BatchingProvider
 
 import requests
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
+from web3.middleware import geth_poa_middleware, construct_simple_cache_middleware
 import web3.eth
 
+CHAIN_ID_CACHE_NAME = "chain_id_cache"
+
 
 def cov_from(amount):
     return float(Web3.fromWei(amount, 'ether'))
@@ -18,31 +28,91 @@ def checksum(address: str) -> str:
     return Web3.toChecksumAddress(address)
 
 
-def get_web3_provider(network_rpc_url: str) -> Web3:
-    """Returns a Web3 connection provider object"""
-    provider = Web3(Web3.HTTPProvider(network_rpc_url))
+def get_web3_provider(network_rpc_url: Union[str, list[str]], metrics: bool = False, batch_requests: bool = False,
+                      **pool_options) -> Web3:
+    """
+    Returns a Web3 connection provider object
+
+    The chain ID is requested once: web3 validates every eth_call against it, which would otherwise cost a second
+    request per call.
+
+    :param network_rpc_url: The RPC node URL, or several RPC node URLs to spread the requests over with failover
+                            (see provider_pool.ProviderPool)
+    :param metrics: Record the provider's requests in metrics.rpc_metrics
+    :param batch_requests: Coalesce the requests of concurrent threads into JSON-RPC batches
+                           (see rpc_batch.BatchingProvider)
+    :param pool_options: (optional) ProviderPool keyword arguments (e.g. hedge_delay), when several URLs are given
+    """
+    if isinstance(network_rpc_url, str):
+        transport = Web3.HTTPProvider(network_rpc_url)
+    elif len(network_rpc_url) == 1:
+        transport = Web3.HTTPProvider(network_rpc_url[0])
+    else:
+        transport = ProviderPool(network_rpc_url, **pool_options)
+    provider = Web3(BatchingProvider(transport) if batch_requests else transport)
 
     provider.middleware_onion.inject(geth_poa_middleware, layer=0)
+    provider.middleware_onion.add(construct_simple_cache_middleware(dict, rpc_whitelist={"eth_chainId"}),
+                                  name=CHAIN_ID_CACHE_NAME)
+    if metrics:
+        rpc_metrics.instrument_provider(provider)
 
     return provider
 
 
+# Contract instances interned by (provider, ABI filename, address), evicting the least recently used
+_contract_cache: OrderedDict = OrderedDict()
+_contract_cache_lock = Lock()
+
+
+@lru_cache(maxsize=None)
+def load_abi(json_abi_file: str) -> list:
+    """
+    Parse a local JSON ABI file once per process
+
+    :param json_abi_file: The filename for the contract's local JSON ABI file (in the package's abi directory)
+    """
+    abi_storage_path = join(abspath(dirname(__file__)), "abi")
+    with open(join(abi_storage_path, json_abi_file)) as json_file:
+        return json.load(json_file)
+
+
 def ContractInstanceFunc(web3_provider: Web3, json_abi_file, contract_address) -> web3.eth.Contract:
     """
     Set up the contract instance with the provided ABI and address
 
+    Instances are shared process-wide by (provider, ABI, address) in a bounded LRU cache (see
+    _config.CONTRACT_CACHE_SIZE), so repeated lookups for the same contract do not rebuild it.
+
     :param web3_provider: The Web3 object used to interact with the chain
                           (ex. Web3(Web3.HTTPProvider(your_network_rpc_url)))
     :param json_abi_file: The filename for the contract's local JSON ABI file
     :param contract_address: The on-chain address for the smart contract
     """
-    abi_storage_path = join(abspath(dirname(__file__)), "abi")
-    with open(join(abi_storage_path, json_abi_file)) as json_file:
-        contract_abi = json.load(json_file)
-
     contract_address = Web3.toChecksumAddress(contract_address)
+    key = (web3_provider, json_abi_file, contract_address)
+
+    with _contract_cache_lock:
+        contract = _contract_cache.get(key)
+        if contract is not None:
+            _contract_cache.move_to_end(key)
+            return contract
 
-    return web3_provider.eth.contract(address=contract_address, abi=contract_abi)
+    contract = web3_provider.eth.contract(address=contract_address, abi=load_abi(json_abi_file))
+
+    with _contract_cache_lock:
+        contract = _contract_cache.setdefault(key, contract)
+        _contract_cache.move_to_end(key)
+        while len(_contract_cache) > CONTRACT_CACHE_SIZE:
+            _contract_cache.popitem(last=False)
+
+    return contract
+
+
+def clear_contract_cache() -> None:
+    """Drop every interned contract instance (e.g. after replacing a provider)"""
+    with _contract_cache_lock:
+        _contract_cache.clear()
 
 
 def store_abi(abi_url: str, abi_filename: str, abi_path: str = None) -> None:
@@ -60,29 +130,27 @@ def store_abi(abi_url: str, abi_filename: str, abi_path: str = None) -> None:
     with open(path, "w") as json_file:
         json_file.write(json.dumps(contract_abi, indent=2))
 
+    load_abi.cache_clear()
+
 
-def get_token_info_from_ref(identifier: str) -> Union[dict, None]:
+def get_token_info_from_ref(identifier: str) -> Union[Mapping, None]:
     """
-    Get the token info row (dict) from the reference file (resources/token_metadata.csv)
+    Get the token info row (read-only dict) from the reference file (resources/token_metadata.csv)
+
+    The reference file is loaded once per process into an indexed TokenRegistry (see registry.py).
     
     :param identifier: Either the token symbol or the token address
-    :return: The token info as a dict:
+    :return: The token info as a read-only dict:
         {'symbol (str)', 'coingecko_id (str)', 'precision (str need to convert to int)', 'address (str)'}
     """
-    path = join(abspath((dirname(__file__))), "resources", "token_metadata.csv")
-    with open(path) as csv_file:
-        reader = csv.DictReader(csv_file)
-        for row in reader:
-            if row["symbol"].upper() == identifier.upper() or row['address'] == identifier.lower():
-                return row
-    return None
+    return get_token_registry().get(identifier)
 
 
 def get_all_pool_underlying_token_addresses() -> dict:
     """Did not use exchange identifier because this was used to aggregate all supported tokens for the reference in resources"""
-    r = requests.get("https://homora-api.alphafinance.io/v2/43114/pools").json()
-    return {pool['name']: [(pool['name'].split('/')[i], token) for i, token in enumerate(pool['tokens'])] for pool in r}
+    return {pool['name']: [(pool['name'].split('/')[i], token) for i, token in enumerate(pool['tokens'])]
+            for pool in get_pool_registry().pools}
 
 
 def get_avalanche_pool_wtoken_types(dex: str):
-    return list(set(pool['wTokenType'] for pool in requests.get("https://homora-api.alphafinance.io/v2/43114/pools").json() if pool['exchange']['name'] == dex))
+    return list(set(pool['wTokenType'] for pool in get_pool_registry().by_exchange(dex)))
@@ -0,0 +1,132 @@
+from typing import Iterable, Union
+
+import numpy as np
+
+# Columns of the valuation result (one row per position). Values follow AvalanchePosition.get_position_value(),
+# get_leverage_ratio() and get_debt_ratio(); owned_reserves and token_debts hold one column per underlying token.
+VALUATION_DTYPE = np.dtype([
+    ("pos_id", np.int64),
+    ("owned_reserves", np.float64, (2,)),
+    ("token_debts", np.float64, (2,)),
+    ("position_usd", np.float64),
+    ("position_avax", np.float64),
+    ("debt_usd", np.float64),
+    ("debt_avax", np.float64),
+    ("equity_usd", np.float64),
+    ("equity_avax", np.float64),
+    ("leverage_ratio", np.float64),
+    ("debt_ratio", np.float64),
+])
+
+
+def _as_float_array(values, shape: tuple) -> np.ndarray:
+    # uint256 values do not fit in int64, so they are converted through Python floats
+    return np.array(values, dtype=np.float64).reshape(shape)
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    # Mirrors the scalar path, which returns 0.0 on a zero division
+    out = np.zeros(np.broadcast(numerator, denominator).shape, dtype=np.float64)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+
+def value_positions(collateral_size: Iterable[int], reserves: Iterable, supply: Iterable[int],
+                    borrow_balances: Iterable, decimals: Iterable, token_prices_usd: Iterable,
+                    avax_price_usd: Union[float, Iterable[float]], collateral_credit: Iterable[int] = None,
+                    borrow_credit: Iterable[int] = None, pos_ids: Iterable[int] = None) -> np.ndarray:
+    """
+    Value many positions at once from raw state with NumPy array operations
+
+    Every per-token argument has shape (n, 2), ordered like the pool's underlying tokens.
+
+    :param collateral_size: The positions' collateral (LP) sizes, shape (n,)
+    :param reserves: The pair reserves of each position's underlying tokens, shape (n, 2)
+    :param supply: The LP total supply of each position's pair, shape (n,)
+    :param borrow_balances: The positions' borrow balance of each underlying token, shape (n, 2)
+    :param decimals: The decimals of each underlying token, shape (n, 2)
+    :param token_prices_usd: The USD price of each underlying token, shape (n, 2)
+    :param avax_price_usd: The USD price of AVAX (scalar, or shape (n,))
+    :param collateral_credit: (optional) HomoraBank.getCollateralETHValue() per position, shape (n,)
+    :param borrow_credit: (optional) HomoraBank.getBorrowETHValue() per position, shape (n,)
+    :param pos_ids: (optional) The position IDs, stored in the pos_id column
+    :return: Structured array with VALUATION_DTYPE (debt_ratio is NaN if the credits are not given)
+    """
+    collateral_size = np.array(collateral_size, dtype=np.float64)
+    n = len(collateral_size)
+    reserves = _as_float_array(reserves, (n, 2))
+    supply = _as_float_array(supply, (n,))
+    borrow_balances = _as_float_array(borrow_balances, (n, 2))
+    scale = 10.0 ** _as_float_array(decimals, (n, 2))
+    token_prices_usd = _as_float_array(token_prices_usd, (n, 2))
+    avax_price_usd = np.broadcast_to(np.array(avax_price_usd, dtype=np.float64), (n,))
+
+    owned_reserves = reserves * _safe_divide(collateral_size, supply)[:, None] / scale
+    token_debts = borrow_balances / scale
+
+    position_usd = (owned_reserves * token_prices_usd).sum(axis=1)
+    debt_usd = (token_debts * token_prices_usd).sum(axis=1)
+    position_avax = position_usd / avax_price_usd
+    debt_avax = debt_usd / avax_price_usd
+
+    result = np.zeros(n, dtype=VALUATION_DTYPE)
+    if pos_ids is not None:
+        result["pos_id"] = np.array(pos_ids, dtype=np.int64)
+    result["owned_reserves"] = owned_reserves
+    result["token_debts"] = token_debts
+    result["position_usd"] = position_usd
+    result["position_avax"] = position_avax
+    result["debt_usd"] = debt_usd
+    result["debt_avax"] = debt_avax
+    result["equity_usd"] = position_usd - debt_usd
+    result["equity_avax"] = position_avax - debt_avax
+    result["leverage_ratio"] = _safe_divide(position_usd, position_usd - debt_usd)
+    if collateral_credit is None or borrow_credit is None:
+        result["debt_ratio"] = np.nan
+    else:
+        result["debt_ratio"] = _safe_divide(_as_float_array(borrow_credit, (n,)),
+                                            _as_float_array(collateral_credit, (n,)))
+
+    return result
+
+
+def value_snapshots(snapshots: list) -> np.ndarray:
+    """
+    Value many PositionSnapshot objects (see snapshot.take_snapshots()) at once
+
+    :return: Structured array with VALUATION_DTYPE, one row per snapshot
+    """
+    return value_positions(
+        collateral_size=[s.collateral_size for s in snapshots],
+        reserves=[s.lp_reserves for s in snapshots],
+        supply=[s.lp_supply for s in snapshots],
+        borrow_balances=[s.borrow_balances for s in snapshots],
+        decimals=[s.underlying_decimals for s in snapshots],
+        token_prices_usd=[[s.prices[symbol] for symbol in s.underlying_symbols] for s in snapshots],
+        avax_price_usd=[s.prices["AVAX"] for s in snapshots],
+        collateral_credit=[s.collateral_credit for s in snapshots],
+        borrow_credit=[s.borrow_credit for s in snapshots],
+        pos_ids=[s.pos_id for s in snapshots])
+
+
+def to_dataframe(result: np.ndarray):
+    """
+    Convert a valuation result to a pandas DataFrame indexed by pos_id (requires pandas)
+
+    The per-token columns are split into owned_reserve_0/1 and token_debt_0/1.
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError("pandas is required for to_dataframe(): pip install pandas")
+
+    columns = {}
+    for name in VALUATION_DTYPE.names:
+        if name == "pos_id":
+            continue
+        if result[name].ndim == 2:
+            for i in range(result[name].shape[1]):
+                columns[f"{name[:-1]}_{i}"] = result[name][:, i]
+        else:
+            columns[name] = result[name]
+    return pd.DataFrame(columns, index=pd.Index(result["pos_id"], name="pos_id"))
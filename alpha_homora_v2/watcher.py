@@ -0,0 +1,243 @@
+from threading import Event, Lock, Thread
+from typing import Callable, NamedTuple, Union
+
+from .util import ContractInstanceFunc, checksum
+from .resources.abi_reference import HomoraBank_ABI, AggregatorOracle_ABI, TraderJoeLP_ABI
+from .provider import avalanche_provider
+from .multicall import Multicall
+from ._config import WATCHER_POLL_INTERVAL
+
+from web3 import Web3
+
+# HomoraBank events that change a position's collateral or debt (every position action goes through execute())
+EXECUTE_TOPIC = Web3.keccak(text="Execute(address,uint256,address)").hex()
+LIQUIDATE_TOPIC = Web3.keccak(text="Liquidate(uint256,address,address,uint256,uint256,uint256)").hex()
+
+
+class DebtRatioCrossing(NamedTuple):
+    """Passed to the DebtRatioWatcher callbacks when a position's debt ratio crosses a threshold"""
+    position: object  # AvalanchePosition
+    threshold: float
+    previous_debt_ratio: float
+    debt_ratio: float
+    direction: str  # "above" or "below"
+    block_number: int
+
+
+class DebtRatioWatcher:
+    """
+    Follows new blocks and recomputes a position's debt ratio only when one of its inputs changed:
+
+        - the oracle price of its LP or underlying tokens (AggregatorOracle.getETHPx)
+        - its pair's reserves or LP supply
+        - the HomoraBank debt of a token it borrowed (interest accrual, HomoraBank.banks)
+        - its own collateral or debt (HomoraBank Execute and Liquidate events)
+
+    Each new block costs one Multicall of the shared inputs (one read per distinct token, pair and bank, not per
+    position) and one eth_getLogs, plus one Multicall for the positions that need recomputing. Callbacks receive a
+    DebtRatioCrossing when a debt ratio crosses one of the thresholds in either direction.
+
+    Usage:
+        watcher = DebtRatioWatcher(positions, thresholds=[0.9, 0.95], callback=print)
+        watcher.start()  # or watcher.run() to block, or watcher.poll() from your own loop
+    """
+    def __init__(self, positions: list, thresholds: list[float] = (0.8, 0.9, 0.95),
+                 callback: Callable[[DebtRatioCrossing], None] = None, poll_interval: float = WATCHER_POLL_INTERVAL,
+                 web3_provider: Web3 = None):
+        """
+        :param positions: AvalanchePosition objects to watch
+        :param thresholds: Debt ratios (e.g. 0.9 = 90%) that trigger the callbacks when crossed
+        :param callback: (optional) Function called with a DebtRatioCrossing (see add_callback())
+        :param poll_interval: Seconds between checks for a new block
+        :param web3_provider: The Web3 object used to interact with the chain (defaults to the Avalanche provider)
+        """
+        self.web3_provider = avalanche_provider if web3_provider is None else web3_provider
+        self.thresholds = sorted(thresholds)
+        self.poll_interval = poll_interval
+        self.callbacks: list[Callable[[DebtRatioCrossing], None]] = [] if callback is None else [callback]
+
+        self.positions: dict[int, object] = {}
+        self.debt_ratios: dict[int, float] = {}
+        self.block_number: Union[int, None] = None
+
+        self._bank = ContractInstanceFunc(self.web3_provider, *HomoraBank_ABI)
+        self._oracle = ContractInstanceFunc(self.web3_provider, *AggregatorOracle_ABI)
+        # Input key -> last read value, and input key -> IDs of the positions depending on it
+        self._inputs: dict[tuple, object] = {}
+        self._dependents: dict[tuple, set[int]] = {}
+        self._position_inputs: dict[int, set[tuple]] = {}
+        self._pending: set[int] = set()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+        for position in positions:
+            self.watch(position)
+
+    def add_callback(self, callback: Callable[[DebtRatioCrossing], None]) -> None:
+        self.callbacks.append(callback)
+
+    def watch(self, position) -> None:
+        """Start watching a position (its debt ratio is computed on the next poll)"""
+        with self._lock:
+            self.positions[position.pos_id] = position
+            self._set_inputs(position.pos_id, self._pool_inputs(position))
+            self._pending.add(position.pos_id)
+
+    def unwatch(self, position_id: int) -> None:
+        with self._lock:
+            self.positions.pop(position_id, None)
+            self.debt_ratios.pop(position_id, None)
+            self._pending.discard(position_id)
+            self._set_inputs(position_id, set())
+
+    def get_debt_ratio(self, position_id: int) -> Union[float, None]:
+        """Returns the debt ratio as of the last processed block (None if not yet computed)"""
+        return self.debt_ratios.get(position_id)
+
+    """ -------------------- BLOCK PROCESSING: -------------------- """
+
+    def poll(self) -> Union[int, None]:
+        """
+        Process the chain head if it is a new block
+
+        :return: The processed block number, or None if there was no new block
+        """
+        block_number = self.web3_provider.eth.block_number
+        if self.block_number is not None and block_number <= self.block_number:
+            return None
+
+        with self._lock:
+            changed = set(self._pending)
+            if self.block_number is not None:
+                changed.update(self._touched_positions(self.block_number + 1, block_number))
+
+            # Read every shared input once, at the new block
+            with Multicall(self.web3_provider, block_number) as batch:
+                reads = {key: batch.add(self._input_call(key), allow_failure=True) for key in self._dependents}
+            for key, call in reads.items():
+                value = call.result
+                if self._inputs.get(key) != value:
+                    self._inputs[key] = value
+                    changed.update(self._dependents[key])
+
+            crossings = self._recompute([pos_id for pos_id in changed if pos_id in self.positions], block_number)
+            self._pending.clear()
+            self.block_number = block_number
+
+        for crossing in crossings:
+            for callback in self.callbacks:
+                try:
+                    callback(crossing)
+                except Exception as exc:
+                    print(f"DebtRatioWatcher callback failed for position #{crossing.position.pos_id} - {exc}")
+
+        return block_number
+
+    def run(self) -> None:
+        """Poll for new blocks until stop() is called"""
+        self._stop.clear()
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as exc:
+                print(f"DebtRatioWatcher could not process block - {exc}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self) -> None:
+        """Run the watcher in a background (daemon) thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = Thread(target=self.run, name="DebtRatioWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _recompute(self, position_ids: list[int], block_number: int) -> list[DebtRatioCrossing]:
+        if len(position_ids) == 0:
+            return []
+
+        with Multicall(self.web3_provider, block_number) as batch:
+            reads = [(pos_id,
+                      batch.add(self._bank.functions.getCollateralETHValue(pos_id)),
+                      batch.add(self._bank.functions.getBorrowETHValue(pos_id)),
+                      batch.add(self._bank.functions.getPositionDebts(pos_id)))
+                     for pos_id in position_ids]
+
+        # Debt tokens may have changed: track the banks of newly borrowed tokens from this block on
+        for pos_id, _, _, position_debts in reads:
+            debt_inputs = {("bank", token.lower()) for token in position_debts.result[0]}
+            self._set_inputs(pos_id, self._pool_inputs(self.positions[pos_id]) | debt_inputs)
+        new_inputs = [key for key in self._dependents if key not in self._inputs]
+        if len(new_inputs) > 0:
+            with Multicall(self.web3_provider, block_number) as batch:
+                new_reads = [(key, batch.add(self._input_call(key), allow_failure=True)) for key in new_inputs]
+            self._inputs.update((key, call.result) for key, call in new_reads)
+
+        crossings = []
+        for pos_id, collateral_credit, borrow_credit, _ in reads:
+            try:
+                debt_ratio = borrow_credit.result / collateral_credit.result
+            except ZeroDivisionError:
+                debt_ratio = 0.0
+
+            previous = self.debt_ratios.get(pos_id)
+            self.debt_ratios[pos_id] = debt_ratio
+            if previous is None:
+                continue
+            for threshold in self.thresholds:
+                if previous < threshold <= debt_ratio:
+                    direction = "above"
+                elif debt_ratio < threshold <= previous:
+                    direction = "below"
+                else:
+                    continue
+                crossings.append(DebtRatioCrossing(self.positions[pos_id], threshold, previous, debt_ratio,
+                                                   direction, block_number))
+        return crossings
+
+    def _touched_positions(self, from_block: int, to_block: int) -> set[int]:
+        """IDs of the positions executed on or liquidated between the two blocks (inclusive)"""
+        logs = self.web3_provider.eth.get_logs({"address": self._bank.address, "fromBlock": from_block,
+                                                "toBlock": to_block, "topics": [[EXECUTE_TOPIC, LIQUIDATE_TOPIC]]})
+        touched = set()
+        for log in logs:
+            if log["topics"][0].hex() == EXECUTE_TOPIC:
+                touched.add(int(log["topics"][2].hex(), 16))
+            else:
+                data = log["data"] if isinstance(log["data"], bytes) else bytes.fromhex(log["data"][2:])
+                touched.add(int.from_bytes(data[:32], "big"))
+        return touched
+
+    """ -------------------- INPUTS: -------------------- """
+
+    @staticmethod
+    def _pool_inputs(position) -> set[tuple]:
+        lp_token = position.pool['lpTokenAddress'].lower()
+        return {("reserves", lp_token), ("price", lp_token)} | \
+               {("price", token.lower()) for token in position.pool['tokens']}
+
+    def _set_inputs(self, position_id: int, inputs: set[tuple]) -> None:
+        for key in self._position_inputs.get(position_id, set()) - inputs:
+            self._dependents[key].discard(position_id)
+            if len(self._dependents[key]) == 0:
+                del self._dependents[key]
+                self._inputs.pop(key, None)
+        for key in inputs:
+            self._dependents.setdefault(key, set()).add(position_id)
+        self._position_inputs[position_id] = inputs
+
+    def _input_call(self, key: tuple):
+        kind, address = key
+        if kind == "price":
+            return self._oracle.functions.getETHPx(checksum(address))
+        if kind == "bank":
+            return self._bank.functions.banks(checksum(address))
+        if kind == "reserves":
+            # Mints and burns update the reserves, so the reserves also cover changes to the LP supply
+            return ContractInstanceFunc(self.web3_provider, TraderJoeLP_ABI[0], address).functions.getReserves()
+        raise ValueError(f"Unknown watcher input: {kind}")
@@ -0,0 +1,306 @@
+"""
+Deterministic chain and API state for the offline benchmarks.
+
+The state is generated from the package's bundled pool list (abi/pool.json) and token metadata, so that every
+contract address the package reads from resolves to a known ABI. The package itself is not imported here: its
+endpoints are read from the environment when it is first imported (see run.py).
+"""
+from os.path import join, dirname, abspath
+from zlib import crc32
+import csv
+import hashlib
+import json
+
+from eth_abi import decode_abi, encode_abi
+from web3 import Web3
+from web3._utils.abi import collapse_if_tuple
+
+PACKAGE_DIR = join(dirname(abspath(__file__)), "..", "alpha_homora_v2")
+ABI_DIR = join(PACKAGE_DIR, "abi")
+
+CHAIN_ID = 43114
+BLOCK_NUMBER = 30000000
+TIMESTAMP = 1700000000
+AVAX_PRICE_USD = 20.0
+
+# Contracts with a fixed address (see resources/abi_reference.py)
+HOMORA_BANK = "0x376d16c7de138b01455a51da79ad65806e9cd694"
+AGGREGATOR_ORACLE = "0xc842cc25fe89f0a60fe9c1fd6483b6971020eb3a"
+SAFE_ORACLE = "0xdb90a1a31ff72976b6f2f009e77131673404180b"
+MULTICALL3 = "0xca11bde05977b3631167028862be2a173976ca11"
+PANGOLIN_SPELL = "0x966bbec3ac35452133b5c236b4139c07b1e2c9b1"
+PANGOLIN_WRAPPER = "0xa67cf61b0b9bc39c6df04095a118e53bfb9303c7"
+PANGOLIN_MINICHEF = "0x1f806f7c8ded893fd3cae279191ad7aa3798e928"
+
+# Wrapper token type -> (wrapper ABI, staking ABI) of the Trader Joe pools (see TRADERJOE_ABI_REF)
+TRADERJOE_ABIS = {"WMasterChef": ("WMasterchefJoeV2_ABI.json", "MasterChefJoeV2_ABI.json"),
+                  "WMasterChefJoeV3": ("WMasterChefJoeV3_ABI.json", "MasterChefJoeV3_ABI.json"),
+                  "WBoostedMasterChefJoe": ("WBoostedMasterChefJoe_ABI.json", "BoostedMasterChefJoe_custom_ABI.json")}
+
+# Values of named contract outputs that do not depend on the call arguments
+NAMED_OUTPUTS = {
+    "allocPoint": 100, "totalAllocPoint": 1000,
+    "lastRewardTimestamp": TIMESTAMP - 60, "lastRewardTime": TIMESTAMP - 60,
+    "accJoePerShare": 3 * 10 ** 12, "accRewardPerShare": 3 * 10 ** 30,
+    "rewardPerSecond": 10 ** 18, "joePerSec": 10 ** 18, "rewardsExpiration": TIMESTAMP + 10 ** 7,
+    "devPercent": 100, "treasuryPercent": 100, "investorPercent": 100, "feeBps": 1000,
+}
+
+
+def _address(seed: str) -> str:
+    return "0x" + hashlib.sha256(seed.encode()).hexdigest()[:40]
+
+
+def _selectors(abi_filename: str) -> dict[bytes, dict]:
+    with open(join(ABI_DIR, abi_filename)) as abi_file:
+        abi = json.load(abi_file)
+    selectors = {}
+    for item in abi:
+        if item.get("type") == "function":
+            signature = f"{item['name']}({','.join(collapse_if_tuple(i) for i in item['inputs'])})"
+            selectors[Web3.keccak(text=signature)[:4]] = item
+    return selectors
+
+
+def _zero(output: dict):
+    """The zero value of an ABI output (tuples are zeroed component by component)"""
+    abi_type = output["type"]
+    if abi_type.endswith("]"):
+        return []
+    if abi_type == "tuple":
+        return tuple(_zero(component) for component in output["components"])
+    if abi_type == "address":
+        return "0x" + "00" * 20
+    if abi_type == "bool":
+        return False
+    if abi_type == "string":
+        return ""
+    if abi_type.startswith("bytes"):
+        return b"" if abi_type == "bytes" else b"\0" * int(abi_type[5:])
+    return 0
+
+
+class ChainFixture:
+    """
+    Contract state of n positions spread over the supported pools of the bundled pool list.
+
+    answer() decodes an eth_call by the ABI of the called address and returns the ABI encoded output. Arguments
+    matter for the position, token and pool reads; other outputs are resolved by name (NAMED_OUTPUTS) or are zero.
+    """
+    def __init__(self, owner_sizes: list[int], first_position_id: int = 1000):
+        """
+        :param owner_sizes: Number of positions held by each owner (one owner per size)
+        :param first_position_id: The ID of the first position
+        """
+        with open(join(ABI_DIR, "pool.json")) as pool_file:
+            self.pools = json.load(pool_file)
+        with open(join(PACKAGE_DIR, "resources", "token_metadata.csv")) as token_file:
+            self.tokens = {row["address"].lower(): row for row in csv.DictReader(token_file)}
+
+        # Pools the spell clients support, with every underlying token in the token metadata
+        self.supported_pools = [pool for pool in self.pools
+                                if (pool["exchange"]["name"] == "Pangolin V2"
+                                    or (pool.get("wTokenType") in TRADERJOE_ABIS
+                                        and "spellAddress" in pool and "stakingAddress" in pool))
+                                and all(token.lower() in self.tokens for token in pool["tokens"])]
+
+        self.owners = {size: _address(f"owner-{size}") for size in owner_sizes}
+        self.positions: dict[int, dict] = {}
+        position_id = first_position_id
+        for size, owner in self.owners.items():
+            for _ in range(size):
+                self.positions[position_id] = self._position(position_id, owner)
+                position_id += 1
+
+        self._abis: dict[str, dict[bytes, dict]] = {}
+        self._lp_pools: dict[str, dict] = {}
+        self._register(HOMORA_BANK, "HomoraBankABI.json")
+        self._register(AGGREGATOR_ORACLE, "AggregatorOracle_ABI.json")
+        self._register(SAFE_ORACLE, "ISafeOracle_ABI.json")
+        self._register(MULTICALL3, "Multicall3_ABI.json")
+        self._register(PANGOLIN_SPELL, "PangolinSpellV2.json")
+        self._register(PANGOLIN_WRAPPER, "WMiniChefPNG.json")
+        self._register(PANGOLIN_MINICHEF, "Minichef_v2ABI.json")
+        for pool in self.supported_pools:
+            self._lp_pools[pool["lpTokenAddress"].lower()] = pool
+            self._register(pool["lpTokenAddress"], "TraderJoeLP_ABI.json")
+            for token in pool["tokens"]:
+                self._register(token, "ERC20_ABI.json")
+            self._register(pool["exchange"]["reward"]["rewardTokenAddress"], "ERC20_ABI.json")
+            if pool["exchange"]["name"] == "Trader Joe":
+                wrapper_abi, staking_abi = TRADERJOE_ABIS[pool["wTokenType"]]
+                self._register(pool["spellAddress"], "TraderJoeSpellV1ABI.json")
+                self._register(pool["wTokenAddress"], wrapper_abi)
+                self._register(pool["stakingAddress"], staking_abi)
+
+    def _register(self, address: str, abi_filename: str) -> None:
+        self._abis[address.lower()] = _selectors(abi_filename)
+
+    def _position(self, position_id: int, owner: str) -> dict:
+        pool = self.supported_pools[position_id % len(self.supported_pools)]
+        collateral_size = (1 + position_id % 7) * 10 ** 18
+        entry_reward_per_share = (position_id % 3) * 10 ** 12 if pool["exchange"]["name"] == "Trader Joe" else \
+            (position_id % 3) * 10 ** 30
+        reserves = self.reserves(pool)
+        # Borrow 40% of the first token's owned reserve
+        debt = reserves[0] * collateral_size // self.lp_supply() * 2 // 5
+        return {"id": position_id, "owner": owner, "pool": pool, "collateral_size": collateral_size,
+                "coll_id": (pool["pid"] << 240) | entry_reward_per_share,
+                "debts": {pool["tokens"][0].lower(): debt},
+                "collateral_credit": 100 * 10 ** 18, "borrow_credit": (30 + position_id % 50) * 10 ** 18}
+
+    """ -------------------- PRICES AND POOL STATE: -------------------- """
+
+    def price_usd(self, coingecko_id: str) -> float:
+        if coingecko_id == "avalanche-2":
+            return AVAX_PRICE_USD
+        if "usd" in coingecko_id or "dai" in coingecko_id:
+            return 1.0
+        return 1 + crc32(coingecko_id.encode()) % 5000 / 100
+
+    def token_price_usd(self, token_address: str) -> float:
+        return self.price_usd(self.tokens[token_address.lower()]["coingecko_id"])
+
+    def decimals(self, token_address: str) -> int:
+        return int(self.tokens[token_address.lower()]["precision"])
+
+    def reserves(self, pool: dict) -> tuple[int, int]:
+        # One million dollars of each token
+        return tuple(int(10 ** 6 / self.token_price_usd(token)) * 10 ** self.decimals(token)
+                     for token in pool["tokens"])
+
+    @staticmethod
+    def lp_supply() -> int:
+        return 10 ** 24
+
+    """ -------------------- CONTRACT CALLS: -------------------- """
+
+    def answer(self, to: str, data: bytes) -> tuple[bool, bytes]:
+        """
+        Answer an eth_call
+
+        :return: (success, ABI encoded output)
+        """
+        function = self._abis.get(to.lower(), {}).get(data[:4])
+        if function is None:
+            return False, b""
+        input_types = [collapse_if_tuple(i) for i in function["inputs"]]
+        output_types = [collapse_if_tuple(o) for o in function["outputs"]]
+        args = decode_abi(input_types, data[4:])
+
+        handler = getattr(self, f"_{function['name']}", None)
+        values = None if handler is None else handler(to.lower(), *args)
+        if values is None:
+            values = [NAMED_OUTPUTS.get(output["name"] or function["name"], _zero(output))
+                      for output in function["outputs"]]
+        elif len(output_types) == 1:
+            values = [values]
+        return True, encode_abi(output_types, values)
+
+    # Multicall3
+
+    def _getBlockNumber(self, to):
+        return BLOCK_NUMBER
+
+    def _getCurrentBlockTimestamp(self, to):
+        return TIMESTAMP
+
+    # HomoraBank
+
+    def _getPositionInfo(self, to, position_id):
+        position = self.positions[position_id]
+        return [position["owner"], position["pool"].get("wTokenAddress", PANGOLIN_WRAPPER), position["coll_id"],
+                position["collateral_size"]]
+
+    def _getPositionDebts(self, to, position_id):
+        debts = self.positions[position_id]["debts"]
+        return [list(debts), list(debts.values())]
+
+    def _borrowBalanceCurrent(self, to, position_id, token):
+        return self.positions[position_id]["debts"].get(token.lower(), 0)
+
+    _borrowBalanceStored = _borrowBalanceCurrent
+
+    def _getCollateralETHValue(self, to, position_id):
+        return self.positions[position_id]["collateral_credit"]
+
+    def _getBorrowETHValue(self, to, position_id):
+        return self.positions[position_id]["borrow_credit"]
+
+    # Oracles
+
+    def _getETHPx(self, to, token):
+        token = token.lower()
+        if token in self._lp_pools:
+            pool = self._lp_pools[token]
+            value_usd = sum(reserve / 10 ** self.decimals(address) * self.token_price_usd(address)
+                            for reserve, address in zip(self.reserves(pool), pool["tokens"]))
+            return int(value_usd / (self.lp_supply() / 10 ** 18) / AVAX_PRICE_USD * 2 ** 112)
+        # Per unit of the token's smallest denomination, in wei
+        return int(self.token_price_usd(token) / AVAX_PRICE_USD * 2 ** 112 * 10 ** (18 - self.decimals(token)))
+
+    def _getSafeETHPx(self, to, token):
+        return [self._getETHPx(to, token), True]
+
+    # LP pairs and ERC20 tokens
+
+    def _getReserves(self, to):
+        return [*self.reserves(self._lp_pools[to]), TIMESTAMP - 10]
+
+    def _totalSupply(self, to):
+        return self.lp_supply() if to in self._lp_pools else 10 ** 27
+
+    def _decimals(self, to):
+        return 18 if to in self._lp_pools else self.decimals(to)
+
+    def _symbol(self, to):
+        return "JLP" if to in self._lp_pools else self.tokens[to]["symbol"]
+
+    def _balanceOf(self, to, owner):
+        return 10 ** 24
+
+    # Staking contracts
+
+    def _userInfo(self, to, pid, user):
+        values = {"amount": 10 ** 21, "rewardDebt": 10 ** 20, "factor": 0}
+        return [values[name] for name in self._output_names(to, "userInfo")]
+
+    def _poolInfo(self, to, pid):
+        pool = next((pool for pool in self.supported_pools if pool["pid"] == pid
+                     and pool.get("stakingAddress", PANGOLIN_MINICHEF).lower() == to), None)
+        lp_token = "0x" + "00" * 20 if pool is None else pool["lpTokenAddress"]
+        function = next(item for item in self._abis[to].values() if item["name"] == "poolInfo")
+        return [lp_token if output["name"] == "lpToken" else NAMED_OUTPUTS.get(output["name"], _zero(output))
+                for output in function["outputs"]]
+
+    def _accJoePerShare(self, to):
+        return 10 ** 18
+
+    def _output_names(self, to: str, function_name: str) -> list[str]:
+        function = next(item for item in self._abis[to].values() if item["name"] == function_name)
+        return [output["name"] for output in function["outputs"]]
+
+    """ -------------------- API PAYLOADS: -------------------- """
+
+    def positions_payload(self) -> list[dict]:
+        """The Alpha Homora V2 positions endpoint"""
+        return [{"id": position["id"], "owner": position["owner"],
+                 "collateralSize": str(position["collateral_size"]), "pool": {"key": position["pool"]["key"]},
+                 "collateralCredit": str(position["collateral_credit"]),
+                 "borrowCredit": str(position["borrow_credit"]),
+                 "debtRatio": str(position["borrow_credit"] / position["collateral_credit"])}
+                for position in self.positions.values()]
+
+    def apys_payload(self) -> dict:
+        """The Alpha Homora V2 APYs endpoint"""
+        return {pool["key"]: {"tradingFeeAPY": "0.05", "farmingAPY": "0.12", "totalAPY": "0.17"}
+                for pool in self.pools}
+
+    def cream_payload(self) -> dict:
+        """The CREAM borrow rates endpoint"""
+        return {"borrowRates": [{"tokenAddress": address, "tokenSymbol": token["symbol"], "apy": "0.04"}
+                                for address, token in self.tokens.items()]}
+
+    def coingecko_price_payload(self, ids: str) -> dict:
+        """The CoinGecko simple price endpoint"""
+        return {coingecko_id: {"usd": self.price_usd(coingecko_id)} for coingecko_id in ids.split(",")}
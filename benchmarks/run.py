@@ -0,0 +1,162 @@
+"""
+Offline benchmarks of the position read paths.
+
+The package's RPC node and HTTP APIs are replaced by local stand-ins (benchmarks/servers.py) serving a synthetic chain
+(benchmarks/fixtures.py), so the runs are deterministic and need no network. Every scenario reports its wall time,
+the number of HTTP requests made to the RPC node, the number of eth_call requests and contract reads, and the number
+of HTTP API requests.
+
+    python -m benchmarks.run --sizes 1 10 100 --output results.json
+    python -m benchmarks.run --baseline results.json  # Exit with an error if a scenario regressed
+"""
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from os.path import join
+import json
+import os
+import sys
+import time
+
+from .fixtures import ChainFixture
+from .servers import MockRPCServer, ReplayServer
+
+DEFAULT_SIZES = [1, 10, 100, 1000]
+
+# Scenarios measured per position on every position of an owner (the others run once per owner)
+PER_POSITION_SCENARIOS = ["get_position_value", "get_rewards_value", "get_current_apy"]
+
+
+def _measure(name: str, size: int, rpc: MockRPCServer, replay: ReplayServer, func) -> dict:
+    rpc.reset()
+    replay.reset()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    contract_reads = sum(count for key, count in rpc.counts.items() if key.startswith("call:"))
+    return {"scenario": name, "positions": size, "seconds": round(elapsed, 4),
+            "rpc_requests": rpc.counts["http"], "eth_calls": rpc.counts["eth_call"],
+            "contract_reads": contract_reads, "http_requests": replay.counts["http"],
+            "unknown_reads": rpc.counts["call:unknown"]}
+
+
+def run(sizes: list[int], max_workers: int = 8) -> list[dict]:
+    """
+    Run every scenario for an owner of each size
+
+    :param sizes: Number of positions of each benchmarked owner
+    :param max_workers: Report worker threads
+    :return: One result dict per (scenario, size)
+    """
+    fixture = ChainFixture(sizes)
+    rpc = MockRPCServer(fixture).start()
+    replay = ReplayServer(fixture).start()
+    # The endpoints are read from the environment when the package is imported
+    os.environ.update({"AVAX_RPC_URL": rpc.url, "AVAX_RPC_URLS": rpc.url, **replay.environment})
+
+    from alpha_homora_v2.oracles import price_service
+    from alpha_homora_v2.position import AvalanchePosition, get_avax_positions_by_owner
+    from alpha_homora_v2.registry import get_pool_registry
+    from alpha_homora_v2.report import generate_report
+    from alpha_homora_v2.rewards import reward_engine
+
+    def cold():
+        price_service.invalidate()
+        reward_engine.invalidate()
+
+    results = []
+    try:
+        get_pool_registry().refresh(block=True)
+        with TemporaryDirectory() as output_dir:
+            for size, owner in fixture.owners.items():
+                position_ids = [pos_id for pos_id, position in fixture.positions.items()
+                                if position["owner"] == owner]
+                cold()
+                results.append(_measure("init", size, rpc, replay, lambda: [
+                    AvalanchePosition(pos_id, owner) for pos_id in position_ids]))
+
+                positions = get_avax_positions_by_owner(owner)
+                for scenario in PER_POSITION_SCENARIOS:
+                    cold()
+                    results.append(_measure(scenario, size, rpc, replay, lambda: [
+                        getattr(position, scenario)() for position in positions]))
+
+                cold()
+                results.append(_measure("get_avax_positions_by_owner", size, rpc, replay,
+                                        lambda: get_avax_positions_by_owner(owner)))
+
+                cold()
+                results.append(_measure("report", size, rpc, replay, lambda: generate_report(
+                    get_avax_positions_by_owner(owner), join(output_dir, f"report_{size}.csv"),
+                    max_workers=max_workers, verbose=False)))
+    finally:
+        rpc.stop()
+        replay.stop()
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """
+    Compare results to a baseline run
+
+    Request counts must not grow, and wall time must not grow by more than the tolerance.
+
+    :param tolerance: Allowed relative wall time increase (e.g. 0.5 for 50%)
+    :return: A description of each regression
+    """
+    baseline = {(result["scenario"], result["positions"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["scenario"], result["positions"]))
+        if previous is None:
+            continue
+        label = f"{result['scenario']} ({result['positions']} positions)"
+        for key in ("rpc_requests", "eth_calls", "contract_reads", "http_requests"):
+            if result[key] > previous[key]:
+                regressions.append(f"{label}: {key} {previous[key]} -> {result[key]}")
+        if result["seconds"] > previous["seconds"] * (1 + tolerance):
+            regressions.append(f"{label}: seconds {previous['seconds']} -> {result['seconds']}")
+    return regressions
+
+
+def print_table(results: list[dict]) -> None:
+    columns = ["scenario", "positions", "seconds", "rpc_requests", "eth_calls", "contract_reads", "http_requests"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main(argv: list[str] = None) -> int:
+    parser = ArgumentParser(description="Offline benchmarks of the Alpha Homora V2 position read paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Number of positions per benchmarked owner")
+    parser.add_argument("--max-workers", type=int, default=8, help="Report worker threads")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Fail if a scenario regressed from the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed relative wall time increase over the baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.max_workers)
+    print_table(results)
+
+    unknown = [result for result in results if result["unknown_reads"] > 0]
+    for result in unknown:
+        print(f"Warning: {result['scenario']} made {result['unknown_reads']} reads the fixture does not know")
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
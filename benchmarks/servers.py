@@ -0,0 +1,186 @@
+"""
+Local stand-ins for the package's network dependencies: a JSON-RPC node and a replay server for the Alpha Homora V2,
+CREAM and CoinGecko HTTP APIs. Both count every request they serve.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import urlparse, parse_qs
+import json
+
+from eth_abi import decode_abi, encode_abi
+
+from .fixtures import ChainFixture, CHAIN_ID, BLOCK_NUMBER, TIMESTAMP, MULTICALL3
+
+# Multicall3.aggregate3((address,bool,bytes)[])
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+
+
+class _CountingServer:
+    """Serves a request handler on a free local port in a daemon thread, and counts the requests"""
+    def __init__(self, handler_class):
+        self.counts = Counter()
+        self._counts_lock = Lock()
+        handler = type(handler_class.__name__, (handler_class,), {"server_state": self})
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def count(self, *keys: str) -> None:
+        with self._counts_lock:
+            for key in keys:
+                self.counts[key] += 1
+
+    def reset(self) -> None:
+        with self._counts_lock:
+            self.counts.clear()
+
+    def start(self):
+        self._thread = Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like a real node behind a load balancer
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status: int = 200) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockRPCServer(_CountingServer):
+    """
+    A JSON-RPC node answering eth_call from a ChainFixture (Multicall3 aggregate3 calls are answered call by call).
+
+    counts holds "http" (HTTP requests), one key per JSON-RPC method, and "call:<function>" per contract read
+    (including the reads inside a Multicall).
+    """
+    def __init__(self, fixture: ChainFixture):
+        self.fixture = fixture
+        super().__init__(_RPCHandler)
+
+    def handle(self, request: dict) -> dict:
+        method, params = request["method"], request.get("params", [])
+        self.count(method)
+        try:
+            result = self._result(method, params)
+        except Exception as exc:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32000, "message": str(exc)}}
+        if isinstance(result, dict) and "error" in result:
+            return {"jsonrpc": "2.0", "id": request.get("id"), **result}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def _result(self, method: str, params: list):
+        if method == "eth_chainId":
+            return hex(CHAIN_ID)
+        if method == "net_version":
+            return str(CHAIN_ID)
+        if method == "eth_blockNumber":
+            return hex(BLOCK_NUMBER)
+        if method in ("eth_getBlockByNumber", "eth_getBlockByHash"):
+            return self._block()
+        if method == "eth_gasPrice":
+            return hex(25 * 10 ** 9)
+        if method == "eth_getLogs":
+            return []
+        if method == "eth_getTransactionReceipt":
+            return None
+        if method == "eth_call":
+            return self._eth_call(params[0]["to"], bytes.fromhex(params[0]["data"][2:]))
+        raise ValueError(f"Method {method} is not supported by the benchmark node")
+
+    def _eth_call(self, to: str, data: bytes):
+        if to.lower() == MULTICALL3 and data[:4] == AGGREGATE3_SELECTOR:
+            calls, = decode_abi(["(address,bool,bytes)[]"], data[4:])
+            results = [self._answer(target, call_data) for target, _, call_data in calls]
+            return "0x" + encode_abi(["(bool,bytes)[]"], [results]).hex()
+
+        success, output = self._answer(to, data)
+        if not success:
+            return {"error": {"code": 3, "message": "execution reverted", "data": "0x"}}
+        return "0x" + output.hex()
+
+    def _answer(self, to: str, data: bytes) -> tuple[bool, bytes]:
+        function = self.fixture._abis.get(to.lower(), {}).get(data[:4])
+        self.count(f"call:{'unknown' if function is None else function['name']}")
+        return self.fixture.answer(to, data)
+
+    @staticmethod
+    def _block() -> dict:
+        zero_hash = "0x" + "00" * 32
+        return {"number": hex(BLOCK_NUMBER), "hash": "0x" + "11" * 32, "parentHash": zero_hash,
+                "timestamp": hex(TIMESTAMP), "baseFeePerGas": hex(25 * 10 ** 9), "gasLimit": hex(15 * 10 ** 6),
+                "gasUsed": "0x0", "miner": "0x" + "00" * 20, "extraData": "0x", "difficulty": "0x1",
+                "totalDifficulty": "0x1", "size": "0x0", "nonce": "0x0000000000000000", "sha3Uncles": zero_hash,
+                "logsBloom": "0x" + "00" * 256, "transactionsRoot": zero_hash, "stateRoot": zero_hash,
+                "receiptsRoot": zero_hash, "mixHash": zero_hash, "transactions": [], "uncles": []}
+
+
+class _RPCHandler(_Handler):
+    def do_POST(self):
+        state = self.server_state
+        state.count("http")
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if isinstance(request, list):
+            self._send_json([state.handle(item) for item in request])
+        else:
+            self._send_json(state.handle(request))
+
+
+class ReplayServer(_CountingServer):
+    """
+    Replays the Alpha Homora V2 (positions, pools, APYs), CREAM rates and CoinGecko simple price endpoints from a
+    ChainFixture. counts holds "http" and one key per path.
+    """
+    def __init__(self, fixture: ChainFixture):
+        self.fixture = fixture
+        self._payloads = {"/homora/positions": fixture.positions_payload(),
+                          "/homora/pools": fixture.pools,
+                          "/homora/apys": fixture.apys_payload(),
+                          "/homora/tokens": {address: {"name": token["symbol"]}
+                                             for address, token in fixture.tokens.items()},
+                          "/cream/rates": fixture.cream_payload()}
+        super().__init__(_ReplayHandler)
+
+    @property
+    def environment(self) -> dict[str, str]:
+        """The package's endpoint environment variables (see alpha_homora_v2/_config.py) pointing at this server"""
+        return {"HOMORA_POSITIONS_URL": self.url + "/homora/positions",
+                "HOMORA_POOLS_URL": self.url + "/homora/pools",
+                "HOMORA_APYS_URL": self.url + "/homora/apys?chain_id={chain_id}",
+                "HOMORA_TOKENS_URL": self.url + "/homora/tokens",
+                "CREAM_RATES_URL": self.url + "/cream/rates",
+                "COINGECKO_API_URL": self.url + "/coingecko/"}
+
+    def payload(self, path: str, query: dict):
+        if path == "/coingecko/simple/price":
+            return self.fixture.coingecko_price_payload(query["ids"][0])
+        return self._payloads.get(path)
+
+
+class _ReplayHandler(_Handler):
+    def do_GET(self):
+        state = self.server_state
+        url = urlparse(self.path)
+        state.count("http", url.path)
+        payload = state.payload(url.path, parse_qs(url.query))
+        if payload is None:
+            self._send_json({"error": f"Unknown endpoint: {url.path}"}, status=404)
+        else:
+            self._send_json(payload)
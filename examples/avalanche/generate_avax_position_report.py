@@ -1,74 +1,27 @@
 from os.path import join, dirname
 import os
-import csv
 import sys
 
 sys.path.insert(0, join(dirname(__file__), '../..'))
 
-from alpha_homora_v2.position import get_avax_positions_by_owner, AvalanchePosition
+from alpha_homora_v2.position import get_avax_positions_by_owner
+from alpha_homora_v2.report import generate_report
 
 
 ADDRESS = os.getenv("PUBLIC_WALLET_ADDRESS")  # Set your public wallet address
 CSV_OUTPUT_FILEPATH = os.path.join(os.path.dirname(__file__), "report.csv")  # File will be generated to examples/report.csv
-
-
-def build_rows(ahv2_positions: list[AvalanchePosition]):
-    for p in ahv2_positions:
-        # Meta
-        p_id = p.pos_id
-        dex = p.dex
-        symbol = p.symbol
-
-        print(f"Processing #{p_id} {symbol} {dex}...")
-
-        # Position values
-        values = p.get_position_value()
-        position_value_usd = values['position_usd']
-        equity_value_usd = values['equity_usd']
-        debt_value_usd = values['debt_usd']
-
-        # Debt and leverage ratios
-        debt_ratio = p.get_debt_ratio()
-        leverage_ratio = p.get_leverage_ratio()
-
-        # APYs
-        apys = p.get_current_apy()
-        farming_apy = apys['farmingAPY']
-        trading_fee_apy = apys['tradingFeeAPY']
-        borrow_apy = apys['borrowAPY']  # Not yet working
-        agg_apy = apys['APY']
-
-        # Rewards
-        rewards = p.get_rewards_value()
-        pending_rewards_token = rewards['reward_token']
-        pending_rewards_usd = rewards['reward_usd']
-        reward_token_symbol = rewards['reward_token_symbol']
-
-        yield [p_id, dex, symbol, position_value_usd, equity_value_usd, debt_value_usd, debt_ratio, leverage_ratio,
-               trading_fee_apy, farming_apy, borrow_apy, agg_apy, pending_rewards_token, pending_rewards_usd, reward_token_symbol]
+# Use a .jsonl or .parquet (requires pyarrow) file path to generate the report in another format
 
 
 if __name__ == "__main__":
-    positions = get_avax_positions_by_owner(ADDRESS)
-
-    assert len(positions) > 0
     assert ADDRESS is not None
 
-    # Generate report CSV
-    header = ['position_id', 'dex', 'symbol', 'position_value_usd', 'equity_value_usd', 'debt_value_usd', 'debt_ratio', 'leverage',
-              'tradingFeeAPY', 'farmingAPY', 'borrowAPY', 'aggAPY', 'pending_rewards_token', 'pending_rewards_usd', 'reward_token_symbol']
-
-    rows = build_rows(positions)
-
-    with open(CSV_OUTPUT_FILEPATH, 'w') as report:
-        writer = csv.writer(report)
-
-        writer.writerow(header)
-        for row in rows:
-            writer.writerow(row)
-
-    print("Operation complete.")
-
+    positions = get_avax_positions_by_owner(ADDRESS)
 
+    assert len(positions) > 0
 
+    # Generate report CSV (rows are built concurrently, at a single block, and written as they are ready)
+    summary = generate_report(positions, CSV_OUTPUT_FILEPATH)
 
+    print(f"Operation complete: {summary['rows']} rows ({summary['errors']} errors) "
+          f"in {summary['elapsed_seconds']:.1f}s.")